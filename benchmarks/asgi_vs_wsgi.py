@@ -0,0 +1,127 @@
+"""Compares sync WSGI and async ASGI throughput of the polling endpoints.
+
+Sets up a throwaway test database with one running match of --clients
+players, then lets every player poll the same mix of endpoints --requests
+times: once through the WSGI handler with a pool of --threads threads, and
+once through the ASGI handler with all clients polling concurrently on one
+event loop. Load shedding is turned off, as it would turn some of the
+simultaneous requests away; requests which do not answer 200 are counted as
+failed.
+
+Usage (from the repository root):
+    python benchmarks/asgi_vs_wsgi.py --clients 200 --requests 20
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'django_template.settings')
+
+import django
+
+django.setup()
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.contrib.gis.geos import Point
+from django.db import connection, connections
+from django.test import AsyncClient, Client, override_settings
+from django.test.utils import setup_test_environment
+
+from social_app.models import Match, Player
+
+ENDPOINTS = [
+    '/match_started/',
+    '/check_if_caught/',
+    '/all_loaded/',
+    '/get_hiders_locations/',
+    '/check_if_hider_nearby/50/',
+]
+
+
+def create_world(number_of_clients):
+    match = Match.objects.create(host='player0', name='benchmark', numberOfHunters=number_of_clients,
+                                 numberOfHiders=number_of_clients, joined_players=number_of_clients,
+                                 createdAtLocation=Point(11.57, 48.14), has_started=True, phase='hunting')
+    User.objects.bulk_create([User(username=f'player{i}') for i in range(number_of_clients)])
+    Player.objects.bulk_create([
+        Player(user=user, match=match, role='HU' if i % 2 else 'HI', is_loaded=True,
+               location=Point(11.57 + i * 1e-5, 48.14 + i * 1e-5))
+        for i, user in enumerate(User.objects.order_by('id'))
+    ])
+    return list(User.objects.order_by('id'))
+
+
+def run_wsgi(users, number_of_requests, number_of_threads):
+    clients = []
+    for user in users:
+        client = Client()
+        client.force_login(user)
+        clients.append(client)
+
+    def poll(client):
+        try:
+            return sum(client.get(ENDPOINTS[i % len(ENDPOINTS)]).status_code != 200
+                       for i in range(number_of_requests))
+        finally:
+            connections.close_all()
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(number_of_threads) as pool:
+        failed = sum(pool.map(poll, clients))
+    return time.perf_counter() - start, failed
+
+
+def run_asgi(users, number_of_requests):
+    # logging in is sync, so it happens before the event loop starts
+    clients = []
+    for user in users:
+        client = AsyncClient()
+        client.force_login(user)
+        clients.append(client)
+
+    async def main():
+        async def poll(client):
+            failed = 0
+            for i in range(number_of_requests):
+                response = await client.get(ENDPOINTS[i % len(ENDPOINTS)])
+                failed += response.status_code != 200
+            return failed
+
+        start = time.perf_counter()
+        failed = sum(await asyncio.gather(*(poll(client) for client in clients)))
+        return time.perf_counter() - start, failed
+
+    return asyncio.run(main())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--clients', type=int, default=200)
+    parser.add_argument('--requests', type=int, default=20, help='requests per client')
+    parser.add_argument('--threads', type=int, default=16, help='WSGI worker threads')
+    args = parser.parse_args()
+
+    setup_test_environment()
+    test_database = connection.creation.create_test_db(verbosity=0)
+    try:
+        users = create_world(args.clients)
+        total = args.clients * args.requests
+        with override_settings(MIDDLEWARE=[m for m in settings.MIDDLEWARE
+                                           if not m.endswith('LoadSheddingMiddleware')]):
+            runs = [
+                ('wsgi (sync views)', run_wsgi(users, args.requests, args.threads)),
+                ('asgi (async views)', run_asgi(users, args.requests)),
+            ]
+        for name, (seconds, failed) in runs:
+            print(f'{name:20} {total} requests in {seconds:6.2f}s  {total / seconds:8.1f} req/s  {failed} failed')
+    finally:
+        connection.creation.destroy_test_db(test_database, verbosity=0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,254 @@
+"""Microbenchmarks of the primitives the views spend their time in.
+
+Covers geo distances, Point construction, JsonResponse encoding of listings
+and the Friendship lookups of Player. Each benchmark reports the median time
+per operation over several timing runs. Results are printed as JSON and
+stored in benchmarks/results/<commit>.json, so that runs on different commits
+can be compared with --compare.
+
+Usage (from the repository root):
+    python benchmarks/micro.py                  # run everything
+    python benchmarks/micro.py -k geo           # only benchmarks matching "geo"
+    python benchmarks/micro.py --compare        # table of all stored results
+"""
+import argparse
+import json
+import math
+import os
+import statistics
+import subprocess
+import sys
+import time
+import timeit
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS = os.path.join(ROOT, 'benchmarks', 'results')
+
+sys.path.insert(0, ROOT)
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'django_template.settings')
+
+import django
+
+django.setup()
+
+import numpy as np
+from django.contrib.auth.models import User
+from django.contrib.gis.geos import GEOSGeometry, Point
+from django.db import connection
+from django.http import JsonResponse
+from django.test.utils import setup_test_environment
+from geopy.distance import distance, great_circle
+
+from social_app import geo, geofence
+from social_app.models import Friendship, Player
+
+BENCHMARKS = {}
+
+
+# registers fn as a benchmark; fn(context) returns the callable to time, and
+# ops is the number of operations one call of it performs
+def benchmark(name, ops=1, database=False):
+    def register(fn):
+        BENCHMARKS[name] = (fn, ops, database)
+        return fn
+    return register
+
+
+MUNICH = (48.1374, 11.5755)
+GARCHING = (48.2489, 11.6532)
+
+
+def haversine_m(latitude1, longitude1, latitude2, longitude2):
+    latitude1, longitude1, latitude2, longitude2 = map(math.radians, (latitude1, longitude1, latitude2, longitude2))
+    a = (math.sin((latitude2 - latitude1) / 2) ** 2
+         + math.cos(latitude1) * math.cos(latitude2) * math.sin((longitude2 - longitude1) / 2) ** 2)
+    return 2 * geofence.EARTH_RADIUS_M * math.asin(math.sqrt(a))
+
+
+@benchmark('geo.distance.geopy_geodesic')
+def geopy_geodesic(context):
+    return lambda: distance(MUNICH, GARCHING).kilometers
+
+
+@benchmark('geo.distance.geopy_geodesic_points')
+def geopy_geodesic_points(context):
+    # what the views do: pass GEOS points straight to geopy
+    a, b = Point(MUNICH[1], MUNICH[0]), Point(GARCHING[1], GARCHING[0])
+    return lambda: distance(a, b).kilometers
+
+
+@benchmark('geo.distance.geopy_great_circle')
+def geopy_great_circle(context):
+    return lambda: great_circle(MUNICH, GARCHING).kilometers
+
+
+@benchmark('geo.distance.haversine')
+def haversine(context):
+    return lambda: haversine_m(*MUNICH, *GARCHING)
+
+
+@benchmark('geo.distance.local_equirectangular')
+def local_equirectangular(context):
+    return lambda: geo.local_distance_m(*MUNICH, *GARCHING)
+
+
+@benchmark('geo.distance.numpy_haversine_10k', ops=10000)
+def numpy_haversine(context):
+    rng = np.random.default_rng(0)
+    latitudes = MUNICH[0] + rng.normal(0, 0.05, 10000)
+    longitudes = MUNICH[1] + rng.normal(0, 0.05, 10000)
+    return lambda: geofence.distances_m(*MUNICH, latitudes, longitudes)
+
+
+@benchmark('geo.point.constructor')
+def point_constructor(context):
+    return lambda: Point(11.5755, 48.1374)
+
+
+@benchmark('geo.point.constructor_with_srid')
+def point_constructor_with_srid(context):
+    return lambda: Point(11.5755, 48.1374, srid=4326)
+
+
+@benchmark('geo.point.from_wkt')
+def point_from_wkt(context):
+    return lambda: GEOSGeometry('POINT(11.5755 48.1374)')
+
+
+def listing_rows(count):
+    return [
+        {
+            "name": f"match {i}",
+            "host": f"player{i}",
+            "latitude": 48.1374 + i * 1e-5,
+            "longitude": 11.5755 + i * 1e-5,
+            "duration": 30,
+            "hiding_duration": 5,
+            "hint_interval_duration": 2,
+            "distance": i * 0.01,
+            "number_of_joined_players": 3,
+            "number_of_hunters": 2,
+            "number_of_hiders": 4,
+            "number_of_joined_hunters": 1,
+            "number_of_joined_hiders": 2,
+        }
+        for i in range(count)
+    ]
+
+
+for rows in (100, 1000, 10000):
+    def json_listing(context, rows=rows):
+        listing = listing_rows(rows)
+        return lambda: JsonResponse(listing, safe=False).content
+
+    benchmark(f'json.listing_{rows}_rows')(json_listing)
+
+
+def friendship_world(context):
+    if 'players' not in context:
+        users = User.objects.bulk_create([User(username=f'bench{i}') for i in range(200)])
+        players = Player.objects.bulk_create([Player(user=user) for user in users])
+        Friendship.objects.bulk_create([
+            Friendship(player=players[i], friend=players[j])
+            for i in range(len(players)) for j in range(i + 1, len(players), 7)
+        ])
+        context['players'] = list(Player.objects.select_related('user').order_by('pk'))
+    return context['players']
+
+
+@benchmark('friendship.is_friend_with', database=True)
+def is_friend_with(context):
+    players = friendship_world(context)
+    return lambda: players[10].is_friend_with(players[17])
+
+
+@benchmark('friendship.get_experience_with', database=True)
+def get_experience_with(context):
+    players = friendship_world(context)
+    return lambda: players[10].get_experience_with(players[17])
+
+
+@benchmark('friendship.get_friends', database=True)
+def get_friends(context):
+    players = friendship_world(context)
+    return lambda: players[10].get_friends()
+
+
+def measure(fn, ops, repeats=5):
+    timer = timeit.Timer(fn)
+    number, _ = timer.autorange()
+    runs = timer.repeat(repeat=repeats, number=number)
+    return {
+        "ns_per_op": statistics.median(runs) / number / ops * 1e9,
+        "min_ns_per_op": min(runs) / number / ops * 1e9,
+        "calls_per_run": number,
+    }
+
+
+def current_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def run(selected):
+    context = {}
+    results = {}
+    needs_database = any(BENCHMARKS[name][2] for name in selected)
+    if needs_database:
+        setup_test_environment()
+        test_database = connection.creation.create_test_db(verbosity=0)
+    try:
+        for name in selected:
+            fn, ops, _ = BENCHMARKS[name]
+            results[name] = measure(fn(context), ops)
+            print(f'{name:45} {results[name]["ns_per_op"]:14.1f} ns/op', file=sys.stderr)
+    finally:
+        if needs_database:
+            connection.creation.destroy_test_db(test_database, verbosity=0)
+    return results
+
+
+def compare():
+    runs = []
+    for file_name in os.listdir(RESULTS) if os.path.isdir(RESULTS) else []:
+        with open(os.path.join(RESULTS, file_name)) as f:
+            runs.append(json.load(f))
+    runs.sort(key=lambda r: r['timestamp'])
+
+    names = sorted({name for r in runs for name in r['results']})
+    print(f'{"ns/op":45}' + ''.join(f'{r["commit"]:>12}' for r in runs))
+    for name in names:
+        cells = [r['results'].get(name, {}).get('ns_per_op') for r in runs]
+        print(f'{name:45}' + ''.join(f'{c:12.1f}' if c is not None else f'{"-":>12}' for c in cells))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('-k', dest='pattern', default='', help='only run benchmarks whose name contains this')
+    parser.add_argument('--compare', action='store_true', help='print the stored results of all commits')
+    parser.add_argument('--no-save', action='store_true', help='do not store the results')
+    args = parser.parse_args()
+
+    if args.compare:
+        compare()
+        return
+
+    selected = [name for name in BENCHMARKS if args.pattern in name]
+    report = {
+        "commit": current_commit(),
+        "timestamp": time.time(),
+        "python": sys.version.split()[0],
+        "results": run(selected),
+    }
+    print(json.dumps(report, indent=2))
+
+    if not args.no_save:
+        os.makedirs(RESULTS, exist_ok=True)
+        with open(os.path.join(RESULTS, f'{report["commit"]}.json'), 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
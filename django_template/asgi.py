@@ -2,6 +2,8 @@
 ASGI config for django_template project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
+Requests served through it use django_template/asgi_urls.py, which routes the
+polling endpoints to the async views in social_app/async_views.py.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/4.0/howto/deployment/asgi/
@@ -14,3 +16,10 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'django_template.settings')
 
 application = get_asgi_application()
+
+# periodic clean-up of abandoned matches, if GC_INTERVAL_SECONDS is set, and
+# the background task workers, which rerun journaled tasks of a previous run
+from social_app import cleanup, tasks  # noqa: E402
+
+cleanup.start_periodic()
+tasks.background.start()
@@ -0,0 +1,13 @@
+"""django_template URL Configuration for ASGI
+
+Same as urls.py, except that the high-frequency polling endpoints are served
+by the async views in social_app/async_views.py. Selected per request by
+social_app.middleware.AsgiUrlconfMiddleware.
+"""
+from django.urls import include, path
+
+from . import urls
+
+urlpatterns = [
+    path('', include('social_app.async_urls')),
+] + urls.urlpatterns
@@ -49,11 +49,14 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'social_app.middleware.LoadSheddingMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'social_app.middleware.AsgiUrlconfMiddleware',
+    'social_app.middleware.PollIntervalMiddleware',
 ]
 
 ROOT_URLCONF = 'django_template.urls'
@@ -83,9 +86,35 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.contrib.gis.db.backends.spatialite',
         'NAME': BASE_DIR / 'db.sqlite3',
+        'OPTIONS': {
+            # seconds a connection waits for the write lock before failing
+            'timeout': 20,
+        },
+        # the concurrency tests run several threads against the test database,
+        # which does not work with the default shared in-memory database
+        'TEST': {
+            'NAME': BASE_DIR / 'test_db.sqlite3',
+        },
     }
 }
 
+# Applied to every new SQLite connection (see social_app/writer.py). WAL lets
+# readers carry on while a write is in progress, and with WAL synchronous=NORMAL
+# is still safe against corruption.
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'busy_timeout': 20000,
+    'mmap_size': 256 * 1024 * 1024,
+    'cache_size': -64 * 1024,  # in KiB when negative
+    'temp_store': 'MEMORY',
+}
+
+# Small writes of the hot in-game endpoints go through one writer thread which
+# commits up to SQLITE_WRITE_BATCH_SIZE of them per transaction.
+SQLITE_SINGLE_WRITER = True
+SQLITE_WRITE_BATCH_SIZE = 100
+
 # Password validation
 # https://docs.djangoproject.com/en/4.0/ref/settings/#auth-password-validators
 
@@ -131,3 +160,129 @@ STATIC_ROOT = os.path.join(BASE_DIR, "static")
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 APPEND_SLASH=False
+
+# The match durations (duration, hiding_duration and hint_interval_duration)
+# sent by the client are given in minutes.
+MATCH_DURATION_UNIT_SECONDS = 60
+
+# Clues handed to hunters are placed up to this many meters away from the
+# hider's actual location.
+HINT_FUZZ_RADIUS_M = 50
+
+# A trap or loot object triggers once a player comes this close to it.
+OBJECT_TRIGGER_RADIUS_M = 10
+
+# A match holds at most OBJECT_MAX_PER_MATCH traps and loot, scattered at most
+# OBJECT_MAX_RADIUS_M around the place it was created at.
+OBJECT_MAX_PER_MATCH = 200
+OBJECT_MAX_RADIUS_M = 5000
+
+# Location trails are written in blocks of up to TRAIL_BLOCK_SIZE fixes per
+# player; fixes which have not filled a block yet are written out every
+# TRAIL_FLUSH_SECONDS.
+TRAIL_BLOCK_SIZE = 256
+TRAIL_FLUSH_SECONDS = 30
+
+# Players and match hosts who have not been seen for GC_INACTIVE_SECONDS count
+# as gone: the gc_matches management command resets their player state and
+# deletes the matches they abandoned. When GC_INTERVAL_SECONDS is set, the
+# server also runs this clean-up itself at that interval.
+GC_INACTIVE_SECONDS = 30 * 60
+GC_INTERVAL_SECONDS = 5 * 60
+
+# Friend suggestions: every SUGGESTIONS_REFRESH_SECONDS up to
+# SUGGESTIONS_BATCH_SIZE players whose friendships or location changed get
+# their SUGGESTIONS_PER_PLAYER best candidates recomputed. Candidates are
+# friends of friends, former co-players and up to SUGGESTIONS_MAX_NEARBY
+# players within SUGGESTIONS_RADIUS_KM.
+SUGGESTIONS_REFRESH_SECONDS = 10
+SUGGESTIONS_BATCH_SIZE = 500
+SUGGESTIONS_PER_PLAYER = 20
+SUGGESTIONS_RADIUS_KM = 5
+SUGGESTIONS_MAX_NEARBY = 200
+SUGGESTIONS_MUTUAL_WEIGHT = 1.0
+SUGGESTIONS_SHARED_MATCH_WEIGHT = 2.0
+SUGGESTIONS_PROXIMITY_WEIGHT = 1.0
+
+# Matchmaking: every MATCHMAKING_INTERVAL_SECONDS queued players are put into
+# the closest joinable match within MATCHMAKING_RADIUS_KM. Where there is
+# none, a match with the MATCHMAKING_* settings below is created for them.
+MATCHMAKING_INTERVAL_SECONDS = 0.3
+MATCHMAKING_RADIUS_KM = 5
+MATCHMAKING_HUNTERS = 2
+MATCHMAKING_HIDERS = 4
+MATCHMAKING_DURATION = 30
+MATCHMAKING_HIDING_DURATION = 5
+MATCHMAKING_HINT_INTERVAL_DURATION = 2
+
+# The lobby listing is served from an in-memory snapshot of the joinable
+# matches, which is reloaded completely after this many seconds to pick up
+# changes made by other processes.
+LOBBY_SNAPSHOT_MAX_AGE_SECONDS = 5
+
+# Map clustering: points are bucketed into CLUSTER_CELLS_PER_TILE squared
+# cells per 256 pixel map tile, from coordinates cached for
+# CLUSTER_CACHE_SECONDS. Each cluster lists up to CLUSTER_SAMPLE_SIZE ids.
+# Above CLUSTER_MAX_ZOOM clients request the plain listings instead.
+CLUSTER_CELLS_PER_TILE = 4
+CLUSTER_CACHE_SECONDS = 10
+CLUSTER_SAMPLE_SIZE = 5
+CLUSTER_MAX_ZOOM = 16
+
+# Map tiles (tiles/<z>/<x>/<y>/) are served from zoom level TILE_MIN_ZOOM on
+# and cached in an LRU of TILE_CACHE_SIZE tiles. Tiles are rebuilt when
+# something inside them changes, or at the latest after TILE_MAX_AGE_SECONDS.
+TILE_MIN_ZOOM = 12
+TILE_CACHE_SIZE = 4096
+TILE_MAX_AGE_SECONDS = 30
+
+# Load shedding (social_app.middleware.LoadSheddingMiddleware): at most
+# `limit` requests of each priority class are served at once per process.
+# Requests wait up to `wait` seconds for a slot, classes with `yields_to` are
+# also refused while one of those classes is full. Refused requests get a
+# 503 with Retry-After: LOAD_SHEDDING_RETRY_AFTER_SECONDS.
+LOAD_SHEDDING_CLASSES = {
+    'game': {'limit': 64, 'wait': 2.0},
+    'poll': {'limit': 512},
+    'default': {'limit': 32, 'wait': 0.5},
+    'lobby': {'limit': 8, 'yields_to': ['game']},
+}
+LOAD_SHEDDING_DEFAULT_CLASS = 'default'
+LOAD_SHEDDING_RETRY_AFTER_SECONDS = 2
+
+# Background tasks (social_app/tasks.py): TASKS_WORKERS threads run up to
+# TASKS_MAX_QUEUED queued tasks, and get TASKS_DRAIN_SECONDS to finish them
+# on shutdown. Set TASKS_JOURNAL to a file path to keep queued tasks in
+# SQLite until they have run, so that they survive a crash.
+TASKS_WORKERS = 2
+TASKS_MAX_QUEUED = 1000
+TASKS_DRAIN_SECONDS = 10
+TASKS_JOURNAL = None
+
+# Recommended poll intervals in seconds, per match phase. While hunting the
+# interval shrinks from POLL_INTERVALS["hunting"] at POLL_FAR_M from the
+# nearest opponent down to POLL_NEAR_INTERVAL at POLL_NEAR_M. Under full
+# load intervals are stretched by a factor of 1 + POLL_LOAD_STRETCH.
+POLL_INTERVALS = {
+    "lobby": 3.0,
+    "hiding": 2.0,
+    "hiding_hunter": 5.0,
+    "hunting": 2.0,
+    "ended": 10.0,
+}
+POLL_NEAR_M = 30
+POLL_FAR_M = 300
+POLL_NEAR_INTERVAL = 0.5
+POLL_LOAD_STRETCH = 2.0
+POLL_MIN_INTERVAL = 0.5
+POLL_MAX_INTERVAL = 30.0
+POLL_OPPONENT_CACHE_SECONDS = 1.0
+
+# Live match state shared by the worker processes of a host
+# (social_app/shared_state.py): a shared memory segment named
+# SHARED_STATE_NAME with room for SHARED_STATE_SLOTS players. Slots not
+# written for SHARED_STATE_MAX_AGE_SECONDS are ignored.
+SHARED_STATE_ENABLED = True
+SHARED_STATE_NAME = 'soc_group_2_match_state'
+SHARED_STATE_SLOTS = 65536
+SHARED_STATE_MAX_AGE_SECONDS = 60
@@ -14,3 +14,10 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'django_template.settings')
 
 application = get_wsgi_application()
+
+# periodic clean-up of abandoned matches, if GC_INTERVAL_SECONDS is set, and
+# the background task workers, which rerun journaled tasks of a previous run
+from social_app import cleanup, tasks  # noqa: E402
+
+cleanup.start_periodic()
+tasks.background.start()
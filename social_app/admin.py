@@ -1,6 +1,6 @@
 from django.contrib import admin
 
-from social_app.models import Player, Friendship, Match, FriendshipRequest
+from social_app.models import Player, Friendship, Match, FriendshipRequest, MatchArchive
 
 # All this does is add these tables to the admin site, where you can view
 # and add entries table entries for testing purposes.
@@ -10,3 +10,4 @@ admin.site.register(Player)
 admin.site.register(Friendship)
 admin.site.register(Match)
 admin.site.register(FriendshipRequest)
+admin.site.register(MatchArchive)
@@ -4,3 +4,8 @@ from django.apps import AppConfig
 class SocialAppConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'social_app'
+
+    def ready(self):
+        # connects the hint_tick, phase_changed, slots_changed,
+        # connection_created, match, player and friendship receivers
+        from . import archive, hints, lobby, shared_state, suggestions, tiles, trails, triggers, writer
@@ -0,0 +1,122 @@
+import itertools
+import json
+
+from asgiref.sync import sync_to_async
+from django.dispatch import receiver
+from django.utils import timezone
+
+from . import trails
+from .models import Match, MatchArchive, MatchEvent, MatchParticipation
+from .signals import phase_changed
+
+# Archiving of ended matches and their NDJSON replay export. A match is
+# archived when it reaches its ended phase, and otherwise right before it is
+# deleted (end_match, the last player leaving, garbage collection) if it was
+# ever started.
+
+
+# archives the match unless it already has an archive; an archive is never
+# replaced, as a later roster can only have lost players
+def archive_match(match):
+    trails.store.flush_match(match.id)
+    roster = [
+        {"id": player_id, "username": username, "role": role, "is_caught": is_caught}
+        for player_id, username, role, is_caught
+        in match.player_set.values_list('pk', 'user__username', 'role', 'is_caught')
+    ]
+    _, created = MatchArchive.objects.get_or_create(match_id=match.id, defaults={
+        "host": match.host,
+        "name": match.name,
+        "numberOfHunters": match.numberOfHunters,
+        "numberOfHiders": match.numberOfHiders,
+        "duration": match.duration,
+        "hiding_duration": match.hiding_duration,
+        "hint_interval_duration": match.hint_interval_duration,
+        "createdAtLocation": match.createdAtLocation,
+        "started_at": match.started_at,
+        "ended_at": timezone.now(),
+        "roster": roster,
+    })
+    if not created:
+        return
+    MatchParticipation.objects.bulk_create(
+        [MatchParticipation(match_id=match.id, player_id=player["id"]) for player in roster],
+        ignore_conflicts=True,
+    )
+
+
+# archives the given matches which have been started and have no archive yet
+def archive_started(matches):
+    matches = [match for match in matches if match.has_started]
+    archived = set(MatchArchive.objects.filter(match_id__in=[match.id for match in matches])
+                   .values_list('match_id', flat=True))
+    for match in matches:
+        if match.id not in archived:
+            archive_match(match)
+
+
+@receiver(phase_changed)
+def match_phase_changed(sender, match_id, phase, **kwargs):
+    if phase != "ended":
+        return
+    match = Match.objects.filter(pk=match_id).first()
+    if match is not None:
+        archive_started([match])
+
+
+EXPORT_CHUNK_LINES = 500
+
+
+def _line(record):
+    return json.dumps(record) + '\n'
+
+
+# yields the replay of an archived match one NDJSON line at a time: the match
+# itself, its roster, its events (phase changes, catches, ...) and finally
+# every location fix. Events and fixes are read in chunks, so memory use does
+# not grow with the length of the match.
+def export_match(archive):
+    location = archive.createdAtLocation
+    yield _line({
+        "type": "match",
+        "id": archive.match_id,
+        "name": archive.name,
+        "host": archive.host,
+        "latitude": location.y if location else None,
+        "longitude": location.x if location else None,
+        "number_of_hunters": archive.numberOfHunters,
+        "number_of_hiders": archive.numberOfHiders,
+        "duration": archive.duration,
+        "hiding_duration": archive.hiding_duration,
+        "hint_interval_duration": archive.hint_interval_duration,
+        "started_at": archive.started_at.isoformat() if archive.started_at else None,
+        "ended_at": archive.ended_at.isoformat(),
+    })
+
+    for player in archive.roster:
+        yield _line({"type": "player", **player})
+
+    match_events = MatchEvent.objects.filter(match_id=archive.match_id).order_by('id')
+    for kind, data, created_at in match_events.values_list('kind', 'data', 'created_at').iterator(chunk_size=500):
+        yield _line({"type": "event", "kind": kind, "time": created_at.isoformat(), **data})
+
+    for player_id, time_ms, latitude, longitude in trails.store.read(archive.match_id):
+        yield _line({"type": "fix", "player": player_id, "time_ms": time_ms,
+                     "latitude": latitude, "longitude": longitude})
+
+
+def _next_lines(lines, count):
+    return list(itertools.islice(lines, count))
+
+
+# export_match for ASGI, which would read a sync iterator into memory before
+# sending it: the lines are produced EXPORT_CHUNK_LINES at a time in the
+# sync thread and handed out from there
+async def aexport_match(archive):
+    lines = export_match(archive)
+    while True:
+        chunk = await sync_to_async(_next_lines)(lines, EXPORT_CHUNK_LINES)
+        if not chunk:
+            return
+        for line in chunk:
+            yield line
@@ -0,0 +1,18 @@
+from django.urls import path
+
+from . import async_views
+
+# The async polling endpoints and the streaming replay export, routed in
+# front of social_app/urls.py when the server runs under ASGI.
+urlpatterns = [
+    path('update_location/', async_views.update_location),
+    path('get_hiders_locations/', async_views.get_hiders_locations),
+    path('get_hunters_locations/', async_views.get_hunters_locations),
+    path('check_if_caught/', async_views.check_if_caught),
+    path('match_started/', async_views.match_started),
+    path('match_ended/', async_views.match_ended),
+    path('all_ready/', async_views.all_ready),
+    path('all_loaded/', async_views.all_loaded),
+    path('check_if_hider_nearby/<str:max_radius_m>/', async_views.check_if_hider_nearby),
+    path('export_match/<int:match_id>/', async_views.export_match),
+]
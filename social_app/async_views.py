@@ -0,0 +1,221 @@
+import asyncio
+import json
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth import get_user
+from django.contrib.gis.geos import Point
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
+from django.utils import timezone
+from geopy.distance import distance
+
+from . import archive, shared_state, suggestions
+from .models import MatchArchive, Player
+from .views import after_location_update
+from .writer import writes
+
+# Async versions of the endpoints clients poll many times a second during a
+# match. They are routed instead of their sync counterparts when the server
+# runs under ASGI (see django_template/asgi_urls.py), so a waiting poll does
+# not hold on to a worker thread. They answer exactly like the sync views.
+
+
+# the signed in user's player together with its user and match, or None;
+# it is also left on the request for PollIntervalMiddleware
+async def get_player(request):
+    user = await sync_to_async(get_user)(request)
+    if not user.is_authenticated:
+        return None
+    request.player = await Player.objects.select_related('user', 'match').aget(pk=user.pk)
+    return request.player
+
+
+async def update_location(request):
+    player = await get_player(request)
+    if player is None:
+        return HttpResponse(f'User not signed in')
+
+    data = json.loads(request.body)
+    latitude = float(data['latitude'])
+    longitude = float(data['longitude'])
+
+    player.location = Point(longitude, latitude)
+    player.last_seen = timezone.now()
+    changes = {"location": player.location, "last_seen": player.last_seen}
+    if settings.SQLITE_SINGLE_WRITER:
+        await asyncio.wrap_future(writes.submit(Player.objects.filter(pk=player.pk).update, **changes))
+    else:
+        await Player.objects.filter(pk=player.pk).aupdate(**changes)
+    await sync_to_async(after_location_update)(player)
+    suggestions.mark_dirty(player.pk)
+
+    return HttpResponse("1: Successfully updated location!")
+
+
+async def get_hiders_locations(request):
+    player = await get_player(request)
+    if player is None:
+        return HttpResponse(f'0: User not signed in')
+
+    if player.match is None:
+        return HttpResponse(f'0: Player not in match')
+
+    if player.role != "HU":
+        return HttpResponse(f'0: Not a hunter')
+
+    players = shared_state.locations(player.match, "HI", visible_only=True)
+    if players is not None:
+        return JsonResponse(players, safe=False)
+
+    hiders = Player.objects.filter(match=player.match_id, role="HI", is_invisible=False)
+    players = [
+        {
+            "latitude": location.y,
+            "longitude": location.x,
+            "out_of_bounds": out_of_bounds,
+        }
+        async for location, out_of_bounds in hiders.values_list('location', 'is_out_of_bounds')
+    ]
+    return JsonResponse(players, safe=False)
+
+
+async def get_hunters_locations(request):
+    player = await get_player(request)
+    if player is None:
+        return HttpResponse(f'0: User not signed in')
+
+    if player.match is None:
+        return HttpResponse(f'0: Player not in match')
+
+    if player.role != "HI":
+        return HttpResponse(f'0: Not a hider')
+
+    players = shared_state.locations(player.match, "HU")
+    if players is not None:
+        return JsonResponse(players, safe=False)
+
+    hunters = Player.objects.filter(match=player.match_id, role="HU")
+    players = [
+        {
+            "latitude": location.y,
+            "longitude": location.x,
+            "out_of_bounds": out_of_bounds,
+        }
+        async for location, out_of_bounds in hunters.values_list('location', 'is_out_of_bounds')
+    ]
+    return JsonResponse(players, safe=False)
+
+
+async def check_if_caught(request):
+    player = await get_player(request)
+    if player is None:
+        return HttpResponse(f'0: User not signed in')
+
+    if player.match is None:
+        return HttpResponse(f'0: Player not in match')
+
+    if player.is_caught:
+        return HttpResponse(f'1: You are caught')
+    return HttpResponse(f'0: You are not caught')
+
+
+async def match_started(request):
+    player = await get_player(request)
+    if player is None:
+        return HttpResponse(f'user not signed in')
+
+    if player.match is None:
+        return HttpResponse(f"0: There is no active match!")
+
+    if player.match.has_started:
+        return HttpResponse(f"1: Match has started!")
+
+    return HttpResponse(f"0: Match hasn't started!")
+
+
+async def match_ended(request):
+    player = await get_player(request)
+    if player is None:
+        return HttpResponse(f'user not signed in')
+
+    if player.match is None:
+        return HttpResponse(f"1: Match was ended!")
+
+    return HttpResponse(f"0: Match hasn't ended!")
+
+
+async def all_ready(request):
+    player = await get_player(request)
+    if player is None:
+        return HttpResponse(f'user not signed in')
+
+    if player.match_id is None:
+        return HttpResponse(f'0: Player not in match')
+
+    players = Player.objects.filter(match=player.match_id)
+    count = await players.acount()
+    if count < 2:
+        return HttpResponse(f'0: Not enough players')
+
+    if await players.filter(ready=False).aexists():
+        return HttpResponse(f'0: Not all players are ready')
+    return HttpResponse(f'1: All players are ready! {count}')
+
+
+async def all_loaded(request):
+    player = await get_player(request)
+    if player is None:
+        return HttpResponse(f'user not signed in')
+
+    if player.match_id is None:
+        return HttpResponse(f'0: Player not in match')
+
+    players = Player.objects.filter(match=player.match_id)
+    if await players.acount() < 2:
+        return HttpResponse(f'0: Not enough players')
+
+    if await players.filter(is_loaded=False).aexists():
+        return HttpResponse(f'0: Not all players are loaded')
+    return HttpResponse(f'1: All players are loaded!')
+
+
+async def check_if_hider_nearby(request, max_radius_m):
+    player = await get_player(request)
+    if player is None:
+        return HttpResponse(f'0: User not signed in')
+
+    if player.match is None:
+        return HttpResponse(f'0: Player not in match')
+
+    hiders = Player.objects.filter(match=player.match_id, role="HI")
+    if not await hiders.aexists():
+        return HttpResponse(f"2: You win! No hiders!")
+
+    nearest_username = None
+    nearest_distance = None
+    async for username, location in hiders.filter(is_invisible=False).values_list('user__username', 'location'):
+        distance_to_hider = distance(location, player.location).meters
+        if nearest_distance is None or distance_to_hider < nearest_distance:
+            nearest_username, nearest_distance = username, distance_to_hider
+
+    if nearest_distance is not None and nearest_distance <= float(max_radius_m):
+        return HttpResponse(f"1:{nearest_username}")
+    return HttpResponse(f"0: No hiders around you!")
+
+
+# the replay of an ended match the player took part in, streamed from an
+# async iterator so that it is not read into memory first
+async def export_match(request, match_id):
+    user = await sync_to_async(get_user)(request)
+    if not user.is_authenticated:
+        return HttpResponse(f'user not signed in')
+
+    try:
+        match_archive = await MatchArchive.objects.aget(match_id=match_id)
+    except MatchArchive.DoesNotExist:
+        return HttpResponse(f'0: No archived match with id {match_id}')
+
+    if not any(player["id"] == user.pk for player in match_archive.roster):
+        return HttpResponse(f'0: You did not take part in this match')
+
+    return StreamingHttpResponse(archive.aexport_match(match_archive), content_type='application/x-ndjson')
@@ -0,0 +1,82 @@
+import datetime
+import logging
+
+from django.conf import settings
+from django.db.models import Count, Exists, IntegerField, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from . import archive
+from .models import Player, Match
+from .scheduler import scheduler
+from .signals import slots_changed
+
+logger = logging.getLogger(__name__)
+
+# Garbage collection of abandoned matches and stale player state, all done
+# with a handful of set-based UPDATE/DELETE statements:
+#  - players who have not been seen for a while are taken out of their match
+#    and have their match flags reset,
+#  - matches whose host has not been seen for a while are deleted, as are
+#    ended matches nobody cleaned up; started ones are archived first, and
+#    the players left in them get the same reset,
+#  - the slot counters of the matches which lost players are recounted.
+
+STALE_PLAYER_FIELDS = {
+    "match": None,
+    "role": None,
+    "ready": False,
+    "is_loaded": False,
+    "is_caught": False,
+    "is_invisible": False,
+    "is_out_of_bounds": False,
+}
+
+
+def _count_players(**filters):
+    players = Player.objects.filter(match=OuterRef('pk'), **filters).order_by() \
+        .values('match').annotate(count=Count('pk')).values('count')
+    return Coalesce(Subquery(players, output_field=IntegerField()), 0)
+
+
+def collect_garbage(inactive_for, dry_run=False):
+    cutoff = timezone.now() - inactive_for
+
+    stale_players = Player.objects.filter(last_seen__lt=cutoff).filter(
+        Q(match__isnull=False) | Q(ready=True) | Q(is_loaded=True) | Q(role__isnull=False))
+    host_is_active = Player.objects.filter(user__username=OuterRef('host'), last_seen__gte=cutoff)
+    abandoned_matches = Match.objects.filter(last_activity__lt=cutoff).filter(
+        ~Exists(host_is_active) | Q(phase="ended"))
+
+    if dry_run:
+        return {"players": stale_players.count(), "matches": abandoned_matches.count()}
+
+    # archived before their players are taken out of them, so that the
+    # archive keeps the full roster
+    archive.archive_started(abandoned_matches.filter(has_started=True))
+    affected_matches = list(stale_players.exclude(match=None).values_list('match', flat=True).distinct())
+    reset_players = stale_players.update(**STALE_PLAYER_FIELDS)
+    # players still in the abandoned matches would otherwise only lose their
+    # match through SET_NULL and keep their role and flags
+    Player.objects.filter(match__in=abandoned_matches).update(**STALE_PLAYER_FIELDS)
+    deleted_matches = abandoned_matches.delete()[1].get(Match._meta.label, 0)
+
+    Match.objects.filter(id__in=affected_matches).update(
+        joined_players=_count_players(),
+        joined_hunters=_count_players(role='HU'),
+        joined_hiders=_count_players(role='HI'),
+    )
+    slots_changed.send(sender=Match, match_ids=affected_matches)
+    return {"players": reset_players, "matches": deleted_matches}
+
+
+# runs the collection every GC_INTERVAL_SECONDS in this process, if set
+def start_periodic():
+    if not settings.GC_INTERVAL_SECONDS:
+        return
+
+    def collect(_):
+        result = collect_garbage(datetime.timedelta(seconds=settings.GC_INACTIVE_SECONDS))
+        logger.info('reset %(players)d stale players and deleted %(matches)d abandoned matches', result)
+
+    scheduler.call_every(settings.GC_INTERVAL_SECONDS, collect, key='cleanup')
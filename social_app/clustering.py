@@ -0,0 +1,77 @@
+import threading
+import time
+
+import numpy as np
+from django.conf import settings
+
+from .geo import tile_xy
+from .models import Player, Match
+
+# Server-side map clustering. The coordinates of all matches and players are
+# cached as NumPy arrays for CLUSTER_CACHE_SECONDS. A request buckets the
+# points inside the requested bounding box into a grid of
+# CLUSTER_CELLS_PER_TILE x CLUSTER_CELLS_PER_TILE cells per map tile at the
+# requested zoom level and returns one cluster per non-empty cell, so the
+# payload is bounded by the number of cells on screen instead of the number
+# of rows.
+
+
+class CoordinateCache:
+    def __init__(self, rows):
+        # rows() returns (id, point) pairs
+        self.rows = rows
+        self.lock = threading.Lock()
+        self.loaded_at = None
+        self.arrays = None
+
+    def get(self):
+        with self.lock:
+            if self.loaded_at is None or time.monotonic() - self.loaded_at > settings.CLUSTER_CACHE_SECONDS:
+                rows = list(self.rows())
+                self.arrays = (
+                    np.array([pk for pk, _ in rows], dtype=np.int64),
+                    np.array([point.y for _, point in rows]),
+                    np.array([point.x for _, point in rows]),
+                )
+                self.loaded_at = time.monotonic()
+            return self.arrays
+
+
+caches = {
+    "matches": CoordinateCache(
+        lambda: Match.objects.filter(createdAtLocation__isnull=False).values_list('pk', 'createdAtLocation')),
+    "players": CoordinateCache(
+        lambda: Player.objects.filter(location__isnull=False).values_list('pk', 'location')),
+}
+
+
+# clusters of the given kind ("matches" or "players") inside the bounding
+# box, as dicts with the centroid, the number of points and a few of their ids
+def clusters(kind, zoom, min_latitude, min_longitude, max_latitude, max_longitude):
+    ids, latitudes, longitudes = caches[kind].get()
+    inside = ((latitudes >= min_latitude) & (latitudes <= max_latitude)
+              & (longitudes >= min_longitude) & (longitudes <= max_longitude))
+    ids, latitudes, longitudes = ids[inside], latitudes[inside], longitudes[inside]
+    if not len(ids):
+        return []
+
+    x, y = tile_xy(latitudes, longitudes, zoom)
+    cells_per_row = 2 ** zoom * settings.CLUSTER_CELLS_PER_TILE
+    cells = (np.floor(y * settings.CLUSTER_CELLS_PER_TILE).astype(np.int64) * cells_per_row
+             + np.floor(x * settings.CLUSTER_CELLS_PER_TILE).astype(np.int64))
+    _, cluster_of_point, counts = np.unique(cells, return_inverse=True, return_counts=True)
+
+    centroid_latitudes = np.bincount(cluster_of_point, weights=latitudes) / counts
+    centroid_longitudes = np.bincount(cluster_of_point, weights=longitudes) / counts
+    order = np.argsort(cluster_of_point, kind='stable')
+    starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+
+    return [
+        {
+            "latitude": float(centroid_latitudes[i]),
+            "longitude": float(centroid_longitudes[i]),
+            "count": int(counts[i]),
+            "ids": ids[order[starts[i]:starts[i] + min(counts[i], settings.CLUSTER_SAMPLE_SIZE)]].tolist(),
+        }
+        for i in range(len(counts))
+    ]
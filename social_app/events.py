@@ -0,0 +1,26 @@
+from .models import MatchEvent
+
+# The events of every match (phase changes, hint ticks, triggers, catches),
+# stored as MatchEvent rows. The row id doubles as the event's sequence
+# number, so every worker process sees the events published by any other.
+# Clients poll them through the get_match_events view instead of polling the
+# server time and working out the phase themselves; the same rows make up the
+# match replay.
+
+MAX_EVENTS_PER_POLL = 100
+
+
+def _as_event(pk, kind, data, created_at):
+    return {"seq": pk, "kind": kind, "time": created_at.timestamp(), **data}
+
+
+def publish(match_id, kind, **data):
+    event = MatchEvent.objects.create(match_id=match_id, kind=kind, data=data)
+    return _as_event(event.pk, kind, data, event.created_at)
+
+
+# the oldest MAX_EVENTS_PER_POLL events of the match newer than seq
+def since(match_id, seq):
+    rows = MatchEvent.objects.filter(match_id=match_id, id__gt=seq).order_by('id') \
+        .values_list('id', 'kind', 'data', 'created_at')[:MAX_EVENTS_PER_POLL]
+    return [_as_event(*row) for row in rows]
@@ -0,0 +1,49 @@
+import math
+import random
+
+import numpy as np
+from django.contrib.gis.geos import Point
+
+# Small helpers for working with WGS84 (longitude, latitude) points over the
+# short distances of a match, where an equirectangular approximation is
+# plenty accurate.
+
+METERS_PER_DEGREE = 111320
+
+
+# approximate distance in meters between two points a few kilometers apart
+def local_distance_m(latitude1, longitude1, latitude2, longitude2):
+    dy = (latitude2 - latitude1) * METERS_PER_DEGREE
+    dx = (longitude2 - longitude1) * METERS_PER_DEGREE * math.cos(math.radians((latitude1 + latitude2) / 2))
+    return math.hypot(dx, dy)
+
+
+# a point at most radius_m meters away from location, uniformly distributed
+# over the disc around it
+def random_point_near(location, radius_m):
+    offset = radius_m * math.sqrt(random.random())
+    bearing = random.uniform(0, 2 * math.pi)
+    latitude = location.y + offset * math.cos(bearing) / METERS_PER_DEGREE
+    longitude = location.x + offset * math.sin(bearing) / (METERS_PER_DEGREE * math.cos(math.radians(location.y)))
+    return Point(longitude, latitude)
+
+
+# Web Mercator "slippy map" tile coordinates of points at the given zoom
+# level, as floats: the integer part is the tile, the fraction the position
+# within it. Works on scalars and NumPy arrays.
+def tile_xy(latitudes, longitudes, zoom):
+    n = 2 ** zoom
+    latitudes = np.radians(np.clip(latitudes, -85.0511, 85.0511))
+    x = (np.asarray(longitudes) + 180) / 360 * n
+    y = (1 - np.log(np.tan(latitudes) + 1 / np.cos(latitudes)) / math.pi) / 2 * n
+    return x, y
+
+
+# (min_longitude, min_latitude, max_longitude, max_latitude) of a tile
+def tile_bounds(zoom, x, y):
+    n = 2 ** zoom
+
+    def latitude(tile_y):
+        return math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * tile_y / n))))
+
+    return x / n * 360 - 180, latitude(y + 1), (x + 1) / n * 360 - 180, latitude(y)
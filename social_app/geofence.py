@@ -0,0 +1,77 @@
+import numpy as np
+
+from . import shared_state
+from .models import Player
+
+# Play area enforcement. A match can be limited to a radius around the place
+# it was created at or to a polygon. On every location update all players of
+# the match are tested in one vectorized pass and their is_out_of_bounds
+# flags are corrected with at most two UPDATEs.
+
+EARTH_RADIUS_M = 6371008.8
+
+
+# haversine distance in meters from one point to arrays of points
+def distances_m(latitude, longitude, latitudes, longitudes):
+    latitude, longitude = np.radians(latitude), np.radians(longitude)
+    latitudes, longitudes = np.radians(latitudes), np.radians(longitudes)
+    a = (np.sin((latitudes - latitude) / 2) ** 2
+         + np.cos(latitude) * np.cos(latitudes) * np.sin((longitudes - longitude) / 2) ** 2)
+    return 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(a))
+
+
+# even-odd ray casting of all points against the polygon's exterior ring at
+# once, looping only over the (few) polygon edges
+def points_in_polygon(latitudes, longitudes, polygon):
+    ring = np.asarray(polygon.exterior_ring.coords)
+    xs, ys = ring[:, 0], ring[:, 1]
+    inside = np.zeros(len(latitudes), dtype=bool)
+    for x1, y1, x2, y2 in zip(xs[:-1], ys[:-1], xs[1:], ys[1:]):
+        if y1 == y2:
+            continue
+        crosses = (y1 > latitudes) != (y2 > latitudes)
+        x_at_latitude = x1 + (latitudes - y1) * (x2 - x1) / (y2 - y1)
+        inside ^= crosses & (longitudes < x_at_latitude)
+    return inside
+
+
+def has_play_area(match):
+    return match.play_area is not None or (match.play_area_radius is not None and match.createdAtLocation is not None)
+
+
+# boolean array telling which of the given points lie inside the play area
+def inside_play_area(match, latitudes, longitudes):
+    inside = np.ones(len(latitudes), dtype=bool)
+    if match.play_area is not None:
+        inside &= points_in_polygon(latitudes, longitudes, match.play_area)
+    if match.play_area_radius is not None and match.createdAtLocation is not None:
+        center = match.createdAtLocation
+        inside &= distances_m(center.y, center.x, latitudes, longitudes) <= match.play_area_radius
+    return inside
+
+
+# corrects the is_out_of_bounds flags of the match's players; returns the
+# ids of the players who left and who returned to the play area
+def enforce(match):
+    if match is None or not has_play_area(match):
+        return [], []
+
+    rows = list(Player.objects.filter(match=match, location__isnull=False)
+                .values_list('pk', 'location', 'is_out_of_bounds'))
+    if not rows:
+        return [], []
+
+    ids = np.array([pk for pk, _, _ in rows])
+    latitudes = np.array([location.y for _, location, _ in rows])
+    longitudes = np.array([location.x for _, location, _ in rows])
+    flagged = np.array([out for _, _, out in rows], dtype=bool)
+
+    out = ~inside_play_area(match, latitudes, longitudes)
+    left = ids[out & ~flagged].tolist()
+    returned = ids[~out & flagged].tolist()
+    if left:
+        Player.objects.filter(pk__in=left).update(is_out_of_bounds=True)
+    if returned:
+        Player.objects.filter(pk__in=returned).update(is_out_of_bounds=False)
+    shared_state.refresh(left + returned)
+    return left, returned
@@ -0,0 +1,27 @@
+from django.conf import settings
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .geo import random_point_near
+from .models import Player, Clue
+from .signals import hint_tick
+
+
+# Serves the hint ticks of all matches that fell due together: one query
+# snapshots every uncaught, visible hider of those matches and one upsert
+# replaces each hider's clue with a fuzzed copy of their current location.
+@receiver(hint_tick)
+def generate_hints(sender, match_ids, **kwargs):
+    hiders = Player.objects.filter(
+        match_id__in=match_ids, role='HI', is_caught=False, is_invisible=False, location__isnull=False
+    ).values_list('pk', 'match_id', 'location')
+
+    now = timezone.now()
+    clues = [
+        Clue(player_id=player_id, match_id=match_id, created_at=now,
+             location=random_point_near(location, settings.HINT_FUZZ_RADIUS_M))
+        for player_id, match_id, location in hiders
+    ]
+    if clues:
+        Clue.objects.bulk_create(clues, update_conflicts=True, unique_fields=['player'],
+                                 update_fields=['match', 'location', 'created_at'])
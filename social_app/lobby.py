@@ -0,0 +1,128 @@
+import json
+import threading
+import time
+
+import numpy as np
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import F
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .geofence import distances_m
+from .models import Match
+from .signals import phase_changed, slots_changed
+
+# In-memory snapshot of the joinable matches (not started and not full) for
+# the lobby listing. Every match is kept with its coordinates and its entry of
+# the listing already encoded as JSON, minus the per-client distance. Match
+# saves, deletes, phase changes and slot counter changes mark the match dirty,
+# and the next read reloads just the dirty matches with one query. A lobby
+# request then is a NumPy radius filter plus joining the ready-made
+# fragments.
+#
+# Changes made by other processes only reach this one through the full
+# reload every LOBBY_SNAPSHOT_MAX_AGE_SECONDS.
+
+FIELDS = ['id', 'name', 'host', 'createdAtLocation', 'duration', 'hiding_duration', 'hint_interval_duration',
+          'joined_players', 'numberOfHunters', 'numberOfHiders', 'joined_hunters', 'joined_hiders']
+
+
+def _joinable():
+    return Match.objects.filter(has_started=False, phase="lobby", createdAtLocation__isnull=False,
+                                joined_players__lt=F('numberOfHunters') + F('numberOfHiders'))
+
+
+# the listing entry of a match without its closing brace, so that the
+# distance can be appended per request
+def _fragment(row):
+    entry = {
+        "name": row['name'],
+        "host": row['host'],
+        "latitude": row['createdAtLocation'].y,
+        "longitude": row['createdAtLocation'].x,
+        "duration": row['duration'],
+        "hiding_duration": row['hiding_duration'],
+        "hint_interval_duration": row['hint_interval_duration'],
+        "number_of_joined_players": row['joined_players'],
+        "number_of_hunters": row['numberOfHunters'],
+        "number_of_hiders": row['numberOfHiders'],
+        "number_of_joined_hunters": row['joined_hunters'],
+        "number_of_joined_hiders": row['joined_hiders'],
+    }
+    return json.dumps(entry, cls=DjangoJSONEncoder)[:-1].encode()
+
+
+class LobbySnapshot:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.entries = {}
+        self.dirty = set()
+        self.loaded_at = None
+        self.arrays = None
+
+    def mark_dirty(self, match_ids):
+        with self.lock:
+            self.dirty.update(match_ids)
+
+    def _store(self, row):
+        location = row['createdAtLocation']
+        self.entries[row['id']] = (location.y, location.x, _fragment(row))
+
+    def _refresh(self):
+        if self.loaded_at is None or time.monotonic() - self.loaded_at > settings.LOBBY_SNAPSHOT_MAX_AGE_SECONDS:
+            self.dirty.clear()
+            self.entries = {}
+            for row in _joinable().values(*FIELDS):
+                self._store(row)
+            self.loaded_at = time.monotonic()
+            self.arrays = None
+        elif self.dirty:
+            dirty, self.dirty = self.dirty, set()
+            for match_id in dirty:
+                self.entries.pop(match_id, None)
+            for row in _joinable().filter(id__in=dirty).values(*FIELDS):
+                self._store(row)
+            self.arrays = None
+
+        if self.arrays is None:
+            entries = list(self.entries.values())
+            self.arrays = (
+                np.array([latitude for latitude, _, _ in entries]),
+                np.array([longitude for _, longitude, _ in entries]),
+                [fragment for _, _, fragment in entries],
+            )
+        return self.arrays
+
+    # the JSON listing of the joinable matches within radius_km of the
+    # given location
+    def nearby(self, latitude, longitude, radius_km):
+        with self.lock:
+            latitudes, longitudes, fragments = self._refresh()
+        if not fragments:
+            return b'[]'
+
+        distances = distances_m(latitude, longitude, latitudes, longitudes) / 1000
+        inside = np.flatnonzero(distances < radius_km)
+        return b'[' + b', '.join(
+            fragments[i] + b', "distance": ' + repr(float(distances[i])).encode() + b'}' for i in inside
+        ) + b']'
+
+
+snapshot = LobbySnapshot()
+
+
+@receiver(post_save, sender=Match)
+@receiver(post_delete, sender=Match)
+def match_saved(sender, instance, **kwargs):
+    snapshot.mark_dirty([instance.pk])
+
+
+@receiver(slots_changed)
+def match_slots_changed(sender, match_ids, **kwargs):
+    snapshot.mark_dirty(match_ids)
+
+
+@receiver(phase_changed)
+def match_phase_changed(sender, match_id, phase, **kwargs):
+    snapshot.mark_dirty([match_id])
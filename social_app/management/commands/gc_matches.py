@@ -0,0 +1,23 @@
+import datetime
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from social_app.cleanup import collect_garbage
+
+
+class Command(BaseCommand):
+    help = 'Resets stale players and deletes abandoned matches.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--inactive-seconds', type=int, default=settings.GC_INACTIVE_SECONDS,
+                            help='how long a player or host has to be gone to count as inactive')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='only count what would be cleaned up')
+
+    def handle(self, *args, **options):
+        result = collect_garbage(datetime.timedelta(seconds=options['inactive_seconds']),
+                                 dry_run=options['dry_run'])
+        prefix = 'Dry run: ' if options['dry_run'] else ''
+        self.stdout.write(f"{prefix}{result['players']} stale players reset, "
+                          f"{result['matches']} abandoned matches deleted")
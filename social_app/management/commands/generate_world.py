@@ -0,0 +1,207 @@
+import time
+
+import numpy as np
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.contrib.gis.geos import Point
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from social_app.models import Player, Match, Friendship, FriendshipRequest
+
+# meters per degree of latitude, for spreading players around cluster centers
+METERS_PER_DEGREE = 111320
+
+PHASES = ["lobby", "hiding", "hunting", "ended"]
+
+
+class Command(BaseCommand):
+    help = ('Fills the database with a synthetic world for capacity testing: users and players '
+            'clustered around a number of towns, a power-law friendship graph, pending friendship '
+            'requests and matches in every phase.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--players', type=int, default=10000)
+        parser.add_argument('--towns', type=int, default=50,
+                            help='number of clusters players live around')
+        parser.add_argument('--town-radius', type=float, default=3000,
+                            help='standard deviation of the distance to the town center, in meters')
+        parser.add_argument('--bbox', type=float, nargs=4, default=[47.3, 5.9, 55.0, 15.0],
+                            metavar=('MIN_LAT', 'MIN_LON', 'MAX_LAT', 'MAX_LON'),
+                            help='area the towns are placed in')
+        parser.add_argument('--mean-friends', type=float, default=8)
+        parser.add_argument('--pending-requests', type=float, default=0.5,
+                            help='pending friendship requests per player')
+        parser.add_argument('--matches', type=int, default=500)
+        parser.add_argument('--prefix', default='synth',
+                            help='usernames are <prefix><number>')
+        parser.add_argument('--password', default='password',
+                            help='password of every generated user')
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--seed', type=int, default=None)
+
+    def handle(self, *args, **options):
+        self.rng = np.random.default_rng(options['seed'])
+        self.batch_size = options['batch_size']
+        self.started = time.perf_counter()
+        n = options['players']
+
+        latitudes, longitudes = self.place_players(n, options['towns'], options['town_radius'], options['bbox'])
+        match_of_player, role_of_player, matches = self.plan_matches(n, options['matches'], options['prefix'],
+                                                                     latitudes, longitudes)
+        self.log(f'planned {n} players in {options["towns"]} towns and {len(matches)} matches')
+
+        with transaction.atomic():
+            Match.objects.bulk_create(matches, batch_size=self.batch_size)
+        match_ids = np.array([match.pk for match in matches] or [0])
+        self.log('created matches')
+
+        player_ids = self.create_players(n, options['prefix'], options['password'], latitudes, longitudes,
+                                         match_of_player, role_of_player, match_ids)
+        self.log(f'created {n} users and players')
+
+        friendships = self.create_friendships(player_ids, options['mean_friends'])
+        self.log(f'created {friendships} friendships')
+
+        requests = self.create_requests(player_ids, options['pending_requests'])
+        self.log(f'created {requests} pending friendship requests')
+
+    def log(self, message):
+        self.stdout.write(f'[{time.perf_counter() - self.started:7.1f}s] {message}')
+
+    # players live around towns whose sizes follow a Zipf-like distribution,
+    # at a normally distributed distance from the town center
+    def place_players(self, n, towns, town_radius, bbox):
+        min_lat, min_lon, max_lat, max_lon = bbox
+        town_latitudes = self.rng.uniform(min_lat, max_lat, towns)
+        town_longitudes = self.rng.uniform(min_lon, max_lon, towns)
+        sizes = 1 / np.arange(1, towns + 1)
+        town = self.rng.choice(towns, size=n, p=sizes / sizes.sum())
+
+        latitudes = town_latitudes[town] + self.rng.normal(0, town_radius, n) / METERS_PER_DEGREE
+        longitudes = town_longitudes[town] + self.rng.normal(0, town_radius, n) / (
+            METERS_PER_DEGREE * np.cos(np.radians(town_latitudes[town])))
+        return latitudes, longitudes
+
+    # hosts are the first players, each match is filled with players from
+    # further down the list; returns per player the index of its match (-1
+    # for none) and its role
+    def plan_matches(self, n, number_of_matches, prefix, latitudes, longitudes):
+        match_of_player = np.full(n, -1)
+        role_of_player = np.full(n, None, dtype=object)
+        matches = []
+        next_player = min(number_of_matches, n)
+        now = timezone.now()
+
+        for i in range(min(number_of_matches, n)):
+            hunters, hiders = int(self.rng.integers(1, 4)), int(self.rng.integers(2, 8))
+            phase = PHASES[i % len(PHASES)]
+            joined = min(int(self.rng.integers(1, hunters + hiders + 1)), n - next_player + 1)
+            members = [i] + list(range(next_player, next_player + joined - 1))
+            next_player += joined - 1
+
+            joined_hunters = joined_hiders = 0
+            for member in members:
+                match_of_player[member] = i
+                if phase != "lobby" or self.rng.random() < 0.5:
+                    if joined_hunters < hunters:
+                        role_of_player[member] = 'HU'
+                        joined_hunters += 1
+                    elif joined_hiders < hiders:
+                        role_of_player[member] = 'HI'
+                        joined_hiders += 1
+
+            matches.append(Match(
+                host=f'{prefix}{i}', name=f'{prefix} match {i}',
+                numberOfHunters=hunters, numberOfHiders=hiders,
+                duration=30, hiding_duration=5, hint_interval_duration=2,
+                createdAtLocation=Point(float(longitudes[i]), float(latitudes[i])),
+                has_started=phase != "lobby", phase=phase,
+                started_at=None if phase == "lobby" else now,
+                joined_players=len(members), joined_hunters=joined_hunters, joined_hiders=joined_hiders,
+            ))
+        return match_of_player, role_of_player, matches
+
+    def create_players(self, n, prefix, password, latitudes, longitudes, match_of_player, role_of_player,
+                       match_ids):
+        # every user shares one password hash, so the (deliberately slow)
+        # password hasher runs once instead of once per user
+        password_hash = make_password(password)
+        player_ids = []
+
+        for start in range(0, n, self.batch_size):
+            end = min(start + self.batch_size, n)
+            with transaction.atomic():
+                users = User.objects.bulk_create([
+                    User(username=f'{prefix}{i}', password=password_hash) for i in range(start, end)
+                ])
+                Player.objects.bulk_create([
+                    Player(
+                        user_id=user.pk,
+                        location=Point(float(longitudes[i]), float(latitudes[i])),
+                        match_id=int(match_ids[match_of_player[i]]) if match_of_player[i] >= 0 else None,
+                        role=role_of_player[i],
+                        ready=bool(match_of_player[i] >= 0),
+                        is_loaded=bool(match_of_player[i] >= 0),
+                    )
+                    for i, user in zip(range(start, end), users)
+                ])
+            player_ids.extend(user.pk for user in users)
+        return np.array(player_ids)
+
+    # Chung-Lu style graph: every player gets a Pareto distributed weight and
+    # edge endpoints are drawn proportionally to it, which gives a power-law
+    # degree distribution with the requested mean
+    def create_friendships(self, player_ids, mean_friends):
+        n = len(player_ids)
+        if n < 2:
+            return 0
+        weights = self.rng.pareto(2.1, n) + 1
+        p = weights / weights.sum()
+        edges = self.random_pairs(player_ids, int(n * mean_friends / 2), p)
+
+        # with ignore_conflicts bulk_create returns every object passed in,
+        # so the rows actually inserted are counted afterwards
+        before = Friendship.objects.count()
+        for start in range(0, len(edges), self.batch_size):
+            with transaction.atomic():
+                Friendship.objects.bulk_create([
+                    Friendship(player_id=int(a), friend_id=int(b),
+                               experience=int(self.rng.integers(0, 100)))
+                    for a, b in edges[start:start + self.batch_size]
+                ], ignore_conflicts=True)
+        return Friendship.objects.count() - before
+
+    def create_requests(self, player_ids, per_player):
+        if len(player_ids) < 2:
+            return 0
+        pairs = self.random_pairs(player_ids, int(len(player_ids) * per_player))
+
+        # players who are friends already have no pending request; friendships
+        # are stored low id first, like the pairs
+        friendships = np.array(Friendship.objects.values_list('player_id', 'friend_id'), dtype=np.int64)
+        if len(friendships):
+            stride = int(max(pairs.max(initial=0), friendships.max())) + 1
+            pairs = pairs[~np.isin(pairs[:, 0] * stride + pairs[:, 1],
+                                   friendships[:, 0] * stride + friendships[:, 1])]
+        # either player may have sent the request
+        flip = self.rng.random(len(pairs)) < 0.5
+        pairs[flip] = pairs[flip][:, ::-1]
+
+        before = FriendshipRequest.objects.count()
+        for start in range(0, len(pairs), self.batch_size):
+            with transaction.atomic():
+                FriendshipRequest.objects.bulk_create([
+                    FriendshipRequest(requester_id=int(a), recipient_id=int(b))
+                    for a, b in pairs[start:start + self.batch_size]
+                ], ignore_conflicts=True)
+        return FriendshipRequest.objects.count() - before
+
+    # distinct pairs (low id first) of different players
+    def random_pairs(self, player_ids, count, p=None):
+        a = self.rng.choice(player_ids, size=count, p=p)
+        b = self.rng.choice(player_ids, size=count, p=p)
+        pairs = np.stack([np.minimum(a, b), np.maximum(a, b)], axis=1)
+        pairs = pairs[pairs[:, 0] != pairs[:, 1]]
+        return np.unique(pairs, axis=0)
@@ -0,0 +1,247 @@
+import datetime
+import threading
+import uuid
+from collections import defaultdict
+
+import numpy as np
+from django.conf import settings
+from django.contrib.gis.geos import Point
+from django.db.models import F, Q
+from django.utils import timezone
+
+from . import shared_state
+from .geofence import distances_m
+from .models import MatchmakingEntry, Player, Match
+from .scheduler import scheduler
+from .signals import slots_changed
+
+# Automatic matchmaking. Players enqueue with their location and preferred
+# role; every MATCHMAKING_INTERVAL_SECONDS a batch matcher assigns everyone
+# queued to the closest joinable match (not started, within
+# MATCHMAKING_RADIUS_KM, with a free slot in the wanted role), creating new
+# matches hosted by queued players where there is none. All matches are
+# loaded with one query per cycle, the distances of all queued players to all
+# matches are computed in one NumPy pass, and slots are claimed with one
+# conditional UPDATE per match, so a concurrent manual join can never
+# overfill a match - players whose match filled up in between simply stay
+# queued for the next cycle.
+#
+# The queue is the MatchmakingEntry table, so every worker process sees the
+# same queue and a player can be queued only once. Each process that took an
+# enqueue runs cycles until it finds the queue empty; a cycle first claims the
+# unclaimed entries with one conditional UPDATE, so no two processes ever
+# place the same player.
+
+ROLES = ['HU', 'HI']
+
+# how long a cycle may hold its entries before other processes may take them
+CLAIM_SECONDS = 60
+
+_lock = threading.Lock()
+_running = False
+
+
+def enqueue(player_id, latitude, longitude, role=None):
+    global _running
+    MatchmakingEntry.objects.update_or_create(player_id=player_id, defaults=dict(
+        latitude=latitude, longitude=longitude, role=role, enqueued_at=timezone.now(),
+        host="", claim="", claimed_until=None,
+    ))
+    with _lock:
+        if not _running:
+            _running = True
+            scheduler.call_every(settings.MATCHMAKING_INTERVAL_SECONDS, lambda _: run_cycle(), key='matchmaking')
+
+
+def dequeue(player_id):
+    return MatchmakingEntry.objects.filter(player_id=player_id, host="").delete()[0] > 0
+
+
+# 'queued', the host name of the match the player was put into, or None
+def status(player_id):
+    host = MatchmakingEntry.objects.filter(player_id=player_id).values_list('host', flat=True).first()
+    if host is None:
+        return None
+    return host or 'queued'
+
+
+class OpenMatches:
+    # the joinable matches of one cycle as parallel arrays, so that new
+    # matches created during the cycle can simply be appended
+    def __init__(self):
+        rows = list(Match.objects.filter(has_started=False, phase='lobby', createdAtLocation__isnull=False)
+                    .values_list('id', 'host', 'createdAtLocation', 'numberOfHunters', 'numberOfHiders',
+                                 'joined_players', 'joined_hunters', 'joined_hiders'))
+        self.ids = [row[0] for row in rows]
+        self.hosts = [row[1] for row in rows]
+        self.latitudes = np.array([row[2].y for row in rows])
+        self.longitudes = np.array([row[2].x for row in rows])
+        self.free = {
+            None: np.array([row[3] + row[4] - row[5] for row in rows]),
+            'HU': np.array([row[3] - row[6] for row in rows]),
+            'HI': np.array([row[4] - row[7] for row in rows]),
+        }
+        self.new = []
+
+    def __len__(self):
+        return len(self.ids)
+
+    def has_room(self, index, role):
+        return self.free[None][index] > 0 and self.free[role][index] > 0
+
+    def take(self, index, role):
+        self.free[None][index] -= 1
+        self.free[role][index] -= 1
+
+    # plans a new match hosted by the given queued player
+    def create(self, entry, host):
+        match = Match(
+            host=host, name=f"{host}'s match",
+            numberOfHunters=settings.MATCHMAKING_HUNTERS, numberOfHiders=settings.MATCHMAKING_HIDERS,
+            duration=settings.MATCHMAKING_DURATION, hiding_duration=settings.MATCHMAKING_HIDING_DURATION,
+            hint_interval_duration=settings.MATCHMAKING_HINT_INTERVAL_DURATION,
+            createdAtLocation=Point(entry.longitude, entry.latitude),
+        )
+        self.new.append((len(self.ids), match))
+        self.ids.append(None)
+        self.hosts.append(host)
+        self.latitudes = np.append(self.latitudes, entry.latitude)
+        self.longitudes = np.append(self.longitudes, entry.longitude)
+        self.free[None] = np.append(self.free[None], match.numberOfHunters + match.numberOfHiders)
+        self.free['HU'] = np.append(self.free['HU'], match.numberOfHunters)
+        self.free['HI'] = np.append(self.free['HI'], match.numberOfHiders)
+        return len(self.ids) - 1
+
+
+def _pick_role(matches, index, preferred):
+    if preferred is not None:
+        return preferred if matches.has_room(index, preferred) else None
+    roles = [role for role in ROLES if matches.has_room(index, role)]
+    return max(roles, key=lambda role: matches.free[role][index]) if roles else None
+
+
+def run_cycle():
+    global _running
+    # a plain read while the queue is empty, which also stops the cycles of
+    # this process until the next enqueue
+    with _lock:
+        if not MatchmakingEntry.objects.filter(host="").exists():
+            scheduler.cancel('matchmaking')
+            _running = False
+            return
+
+    claim = uuid.uuid4().hex
+    now = timezone.now()
+    claimed = MatchmakingEntry.objects.filter(host="").filter(
+        Q(claimed_until__isnull=True) | Q(claimed_until__lt=now)
+    ).update(claim=claim, claimed_until=now + datetime.timedelta(seconds=CLAIM_SECONDS))
+    if not claimed:
+        return
+    try:
+        _place(list(MatchmakingEntry.objects.filter(claim=claim).order_by('enqueued_at')))
+    finally:
+        MatchmakingEntry.objects.filter(claim=claim).update(claim="", claimed_until=None)
+
+
+def _place(entries):
+    # players who joined a match on their own in the meantime drop out
+    free_players = set(Player.objects.filter(pk__in=[e.player_id for e in entries], match__isnull=True)
+                       .values_list('pk', flat=True))
+    MatchmakingEntry.objects.filter(pk__in=[e.player_id for e in entries if e.player_id not in free_players]) \
+        .delete()
+    usernames = dict(Player.objects.filter(pk__in=free_players).values_list('pk', 'user__username'))
+    entries = [e for e in entries if e.player_id in free_players]
+    if not entries:
+        return
+
+    matches = OpenMatches()
+    distances = np.full((len(entries), len(matches)), np.inf)
+    if len(matches):
+        for row, entry in enumerate(entries):
+            distances[row] = distances_m(entry.latitude, entry.longitude, matches.latitudes, matches.longitudes)
+    radius_m = settings.MATCHMAKING_RADIUS_KM * 1000
+
+    assignments = []
+    for row, entry in enumerate(entries):
+        placed = None
+        for index in np.argsort(distances[row]):
+            if distances[row][index] > radius_m:
+                break
+            role = _pick_role(matches, index, entry.role)
+            if role is not None:
+                placed = index, role
+                break
+        # matches planned earlier in this cycle are not in the distance matrix
+        if placed is None:
+            for index, _ in matches.new:
+                role = _pick_role(matches, index, entry.role)
+                near = distances_m(entry.latitude, entry.longitude,
+                                   matches.latitudes[index:index + 1], matches.longitudes[index:index + 1])[0]
+                if role is not None and near <= radius_m:
+                    placed = index, role
+                    break
+        if placed is None:
+            index = matches.create(entry, usernames[entry.player_id])
+            placed = index, _pick_role(matches, index, entry.role)
+        matches.take(*placed)
+        assignments.append((entry, *placed))
+
+    _apply(matches, assignments)
+
+
+def _apply(matches, assignments):
+    if matches.new:
+        created = Match.objects.bulk_create([match for _, match in matches.new])
+        for (index, _), match in zip(matches.new, created):
+            matches.ids[index] = match.pk
+
+    joining = defaultdict(list)
+    for entry, index, role in assignments:
+        joining[index].append((entry, role))
+
+    now = timezone.now()
+    placed = {}
+    for index, members in joining.items():
+        match_id = matches.ids[index]
+        hunters = sum(1 for _, role in members if role == 'HU')
+        hiders = len(members) - hunters
+        # claims all slots of this match at once; fails as a whole if the
+        # match filled up since it was loaded
+        claimed = Match.objects.filter(
+            pk=match_id,
+            has_started=False,
+            joined_players__lte=F('numberOfHunters') + F('numberOfHiders') - len(members),
+            joined_hunters__lte=F('numberOfHunters') - hunters,
+            joined_hiders__lte=F('numberOfHiders') - hiders,
+        ).update(
+            joined_players=F('joined_players') + len(members),
+            joined_hunters=F('joined_hunters') + hunters,
+            joined_hiders=F('joined_hiders') + hiders,
+            last_activity=now,
+        )
+        if not claimed:
+            continue
+
+        for role in ROLES:
+            ids = [entry.player_id for entry, r in members if r == role]
+            if not ids:
+                continue
+            Player.objects.filter(pk__in=ids, match__isnull=True).update(
+                match=match_id, role=role, ready=False, is_loaded=False, last_seen=now)
+            moved = set(Player.objects.filter(pk__in=ids, match=match_id, role=role).values_list('pk', flat=True))
+            # give back the slots of players who joined elsewhere meanwhile;
+            # their entries go back to the queue, which drops them next cycle
+            for _ in range(len(ids) - len(moved)):
+                Match(pk=match_id).release_slot(role)
+                Match(pk=match_id).release_slot()
+            for player_id in moved:
+                placed[player_id] = matches.hosts[index]
+            shared_state.refresh(moved)
+
+    slots_changed.send(sender=Match, match_ids=[matches.ids[index] for index in joining])
+
+    hosts = defaultdict(list)
+    for player_id, host in placed.items():
+        hosts[host].append(player_id)
+    for host, player_ids in hosts.items():
+        MatchmakingEntry.objects.filter(pk__in=player_ids).update(host=host)
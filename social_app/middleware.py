@@ -0,0 +1,205 @@
+import asyncio
+import threading
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.http import HttpResponse
+
+from . import polling
+
+
+# Routes requests which come in through ASGI to django_template/asgi_urls.py,
+# so that they are served by the async polling views. WSGI requests keep
+# using ROOT_URLCONF.
+class AsgiUrlconfMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        return self.get_response(request)
+
+    async def __acall__(self, request):
+        if isinstance(request, ASGIRequest):
+            request.urlconf = 'django_template.asgi_urls'
+        return await self.get_response(request)
+
+
+class PriorityClass:
+    def __init__(self, name, limit, wait=0, yields_to=()):
+        self.name = name
+        self.limit = limit
+        self.wait = wait
+        self.yields_to = yields_to
+        self.condition = threading.Condition()
+        self.in_flight = 0
+        self.waiting = 0
+        self.peak_in_flight = 0
+        self.admitted = 0
+        self.shed = 0
+        self.wait_seconds = 0.0
+
+    def saturated(self):
+        return self.in_flight >= self.limit
+
+    def try_acquire(self, timeout=0):
+        with self.condition:
+            if self.saturated() and timeout > 0:
+                self.waiting += 1
+                started = time.monotonic()
+                self.condition.wait_for(lambda: not self.saturated(), timeout)
+                self.waiting -= 1
+                self.wait_seconds += time.monotonic() - started
+            if self.saturated():
+                return False
+            self.in_flight += 1
+            self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+            self.admitted += 1
+            return True
+
+    def reject(self):
+        with self.condition:
+            self.shed += 1
+
+    def release(self):
+        with self.condition:
+            self.in_flight -= 1
+            self.condition.notify()
+
+    def metrics(self):
+        with self.condition:
+            return {
+                "limit": self.limit,
+                "in_flight": self.in_flight,
+                "waiting": self.waiting,
+                "peak_in_flight": self.peak_in_flight,
+                "admitted": self.admitted,
+                "shed": self.shed,
+                "wait_seconds": round(self.wait_seconds, 3),
+            }
+
+
+priority_classes = {
+    name: PriorityClass(name, **options) for name, options in settings.LOAD_SHEDDING_CLASSES.items()
+}
+
+
+# Priority aware load shedding. Every route belongs to a priority class (see
+# ROUTE_PRIORITIES in social_app/urls.py) which admits a bounded number of
+# requests at once. A request that finds its class full waits up to the
+# class's `wait` seconds for a slot and is answered with a 503 and a
+# Retry-After header otherwise. Classes with `yields_to` are also shed while
+# any of those classes is full, so lobby traffic backs off as soon as
+# in-game calls start to queue up. Counters are per process; see
+# get_load_metrics.
+class LoadSheddingMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        # imported here, as the views import this module
+        from .urls import ROUTE_PRIORITIES
+
+        self.get_response = get_response
+        self.routes = ROUTE_PRIORITIES
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def _class_of(self, request):
+        route = request.path_info.strip('/').split('/')[0]
+        return priority_classes[self.routes.get(route, settings.LOAD_SHEDDING_DEFAULT_CLASS)]
+
+    def _yields(self, priority_class):
+        return any(priority_classes[name].saturated() for name in priority_class.yields_to)
+
+    def _busy(self, priority_class):
+        priority_class.reject()
+        response = HttpResponse('0: Server busy, try again later', status=503)
+        response['Retry-After'] = str(settings.LOAD_SHEDDING_RETRY_AFTER_SECONDS)
+        return response
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+
+        priority_class = self._class_of(request)
+        if self._yields(priority_class) or not priority_class.try_acquire(priority_class.wait):
+            return self._busy(priority_class)
+        try:
+            return self.get_response(request)
+        finally:
+            priority_class.release()
+
+    async def __acall__(self, request):
+        priority_class = self._class_of(request)
+        if self._yields(priority_class):
+            return self._busy(priority_class)
+        # never block the event loop on the condition, poll for a free slot
+        # instead
+        deadline = time.monotonic() + priority_class.wait
+        while not priority_class.try_acquire():
+            if time.monotonic() >= deadline:
+                return self._busy(priority_class)
+            await asyncio.sleep(0.005)
+        try:
+            return await self.get_response(request)
+        finally:
+            priority_class.release()
+
+
+def load_metrics():
+    return {name: priority_class.metrics() for name, priority_class in priority_classes.items()}
+
+
+# Adds the X-Poll-Interval header (see social_app/polling.py) to the
+# responses of the routes in MATCH_ROUTES of social_app/urls.py, for players
+# in a match. It uses the player the view loaded, so it normally costs no
+# extra query.
+class PollIntervalMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        # imported here, as the views import this module
+        from .urls import MATCH_ROUTES
+
+        self.get_response = get_response
+        self.routes = MATCH_ROUTES
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def _applies(self, request):
+        return request.path_info.strip('/').split('/')[0] in self.routes
+
+    def _add_header(self, request, response):
+        # async views leave their player on the request
+        player = getattr(request, 'player', None)
+        if player is None:
+            if not request.user.is_authenticated or not hasattr(request.user, 'player'):
+                return
+            player = request.user.player
+        interval = polling.recommended_interval(player)
+        if interval is not None:
+            response['X-Poll-Interval'] = str(interval)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        response = self.get_response(request)
+        if self._applies(request):
+            self._add_header(request, response)
+        return response
+
+    async def __acall__(self, request):
+        response = await self.get_response(request)
+        if self._applies(request):
+            await sync_to_async(self._add_header)(request, response)
+        return response
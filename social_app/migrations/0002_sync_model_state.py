@@ -0,0 +1,131 @@
+# Generated by Django 4.2.2 on 2026-10-19 10:05
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("social_app", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name="match",
+            name="password",
+        ),
+        migrations.RemoveField(
+            model_name="match",
+            name="radius",
+        ),
+        migrations.RemoveField(
+            model_name="match",
+            name="players",
+        ),
+        migrations.RemoveField(
+            model_name="match",
+            name="host",
+        ),
+        migrations.AddField(
+            model_name="match",
+            name="host",
+            field=models.CharField(default="", max_length=20),
+        ),
+        migrations.AddField(
+            model_name="match",
+            name="name",
+            field=models.CharField(default="", max_length=25),
+        ),
+        migrations.RemoveField(
+            model_name="match",
+            name="duration",
+        ),
+        migrations.AddField(
+            model_name="match",
+            name="duration",
+            field=models.IntegerField(null=True),
+        ),
+        migrations.AddField(
+            model_name="match",
+            name="hiding_duration",
+            field=models.IntegerField(null=True),
+        ),
+        migrations.AddField(
+            model_name="match",
+            name="hint_interval_duration",
+            field=models.IntegerField(null=True),
+        ),
+        migrations.AddField(
+            model_name="match",
+            name="has_started",
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AlterField(
+            model_name="player",
+            name="role",
+            field=models.CharField(
+                blank=True,
+                choices=[("HI", "Hider"), ("HU", "Hunter")],
+                max_length=10,
+                null=True,
+            ),
+        ),
+        migrations.AddField(
+            model_name="player",
+            name="ready",
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name="player",
+            name="is_loaded",
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name="player",
+            name="is_caught",
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name="player",
+            name="is_invisible",
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name="player",
+            name="match",
+            field=models.ForeignKey(
+                blank=True,
+                null=True,
+                on_delete=django.db.models.deletion.SET_NULL,
+                to="social_app.match",
+            ),
+        ),
+        migrations.AlterUniqueTogether(
+            name="friendshiprequest",
+            unique_together=set(),
+        ),
+        migrations.RenameField(
+            model_name="friendshiprequest",
+            old_name="player",
+            new_name="requester",
+        ),
+        migrations.RenameField(
+            model_name="friendshiprequest",
+            old_name="friend",
+            new_name="recipient",
+        ),
+        migrations.RemoveField(
+            model_name="friendshiprequest",
+            name="is_accepted",
+        ),
+        migrations.AlterUniqueTogether(
+            name="friendshiprequest",
+            unique_together={("requester", "recipient")},
+        ),
+        migrations.AddField(
+            model_name="friendship",
+            name="experience",
+            field=models.IntegerField(default=0),
+        ),
+    ]
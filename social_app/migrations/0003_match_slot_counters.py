@@ -0,0 +1,46 @@
+# Generated by Django 4.2.2 on 2026-10-19 10:12
+
+from django.db import migrations, models
+from django.db.models import Count, Q
+
+
+def count_joined_slots(apps, schema_editor):
+    Match = apps.get_model("social_app", "Match")
+    matches = Match.objects.annotate(
+        players=Count("player"),
+        hunters=Count("player", filter=Q(player__role="HU")),
+        hiders=Count("player", filter=Q(player__role="HI")),
+    )
+    for match in matches:
+        match.joined_players = match.players
+        match.joined_hunters = match.hunters
+        match.joined_hiders = match.hiders
+    Match.objects.bulk_update(
+        matches, ["joined_players", "joined_hunters", "joined_hiders"]
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("social_app", "0002_sync_model_state"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="match",
+            name="joined_players",
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="match",
+            name="joined_hunters",
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="match",
+            name="joined_hiders",
+            field=models.IntegerField(default=0),
+        ),
+        migrations.RunPython(count_joined_slots, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 4.2.2 on 2026-10-19 11:02
+
+from django.db import migrations, models
+
+
+def mark_started_matches(apps, schema_editor):
+    Match = apps.get_model("social_app", "Match")
+    Match.objects.filter(has_started=True).update(phase="hunting")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("social_app", "0003_match_slot_counters"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="match",
+            name="phase",
+            field=models.CharField(
+                choices=[
+                    ("lobby", "Lobby"),
+                    ("hiding", "Hiding"),
+                    ("hunting", "Hunting"),
+                    ("ended", "Ended"),
+                ],
+                default="lobby",
+                max_length=10,
+            ),
+        ),
+        migrations.AddField(
+            model_name="match",
+            name="started_at",
+            field=models.DateTimeField(null=True),
+        ),
+        migrations.RunPython(mark_started_matches, migrations.RunPython.noop),
+    ]
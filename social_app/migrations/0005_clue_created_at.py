@@ -0,0 +1,18 @@
+# Generated by Django 4.2.2 on 2026-10-19 11:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("social_app", "0004_match_phase"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="clue",
+            name="created_at",
+            field=models.DateTimeField(null=True),
+        ),
+    ]
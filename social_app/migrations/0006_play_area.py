@@ -0,0 +1,31 @@
+# Generated by Django 4.2.2 on 2026-10-19 12:21
+
+import django.contrib.gis.db.models.fields
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("social_app", "0005_clue_created_at"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="match",
+            name="play_area_radius",
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="match",
+            name="play_area",
+            field=django.contrib.gis.db.models.fields.PolygonField(
+                blank=True, null=True, srid=4326
+            ),
+        ),
+        migrations.AddField(
+            model_name="player",
+            name="is_out_of_bounds",
+            field=models.BooleanField(default=False),
+        ),
+    ]
@@ -0,0 +1,48 @@
+# Generated by Django 4.2.2 on 2026-10-19 14:27
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("social_app", "0006_play_area"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="TrailBlock",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("match_id", models.BigIntegerField()),
+                ("start_ms", models.BigIntegerField()),
+                ("end_ms", models.BigIntegerField()),
+                ("count", models.IntegerField()),
+                ("data", models.BinaryField()),
+                (
+                    "player",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        to="social_app.player",
+                    ),
+                ),
+            ],
+            options={
+                "indexes": [
+                    models.Index(
+                        fields=["match_id", "player", "start_ms"],
+                        name="social_app__match_i_db4b15_idx",
+                    )
+                ],
+            },
+        ),
+    ]
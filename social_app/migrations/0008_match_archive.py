@@ -0,0 +1,63 @@
+# Generated by Django 4.2.2 on 2026-10-19 14:28
+
+import django.contrib.gis.db.models.fields
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("social_app", "0007_trailblock"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="MatchArchive",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("match_id", models.BigIntegerField(unique=True)),
+                ("host", models.CharField(default="", max_length=20)),
+                ("name", models.CharField(default="", max_length=25)),
+                ("numberOfHunters", models.IntegerField()),
+                ("numberOfHiders", models.IntegerField()),
+                ("duration", models.IntegerField(null=True)),
+                ("hiding_duration", models.IntegerField(null=True)),
+                ("hint_interval_duration", models.IntegerField(null=True)),
+                (
+                    "createdAtLocation",
+                    django.contrib.gis.db.models.fields.PointField(
+                        null=True, srid=4326
+                    ),
+                ),
+                ("started_at", models.DateTimeField(null=True)),
+                ("ended_at", models.DateTimeField()),
+                ("roster", models.JSONField(default=list)),
+            ],
+        ),
+        migrations.CreateModel(
+            name="MatchEvent",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("match_id", models.BigIntegerField(db_index=True)),
+                ("kind", models.CharField(max_length=20)),
+                ("data", models.JSONField(default=dict)),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 4.2.2 on 2026-10-19 14:31
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("social_app", "0008_match_archive"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="match",
+            name="last_activity",
+            field=models.DateTimeField(
+                db_index=True, default=django.utils.timezone.now, null=True
+            ),
+        ),
+        migrations.AddField(
+            model_name="player",
+            name="last_seen",
+            field=models.DateTimeField(
+                db_index=True, default=django.utils.timezone.now, null=True
+            ),
+        ),
+    ]
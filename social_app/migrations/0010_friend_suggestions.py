@@ -0,0 +1,77 @@
+# Generated by Django 4.2.2 on 2026-10-19 14:33
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def participations_from_archives(apps, schema_editor):
+    MatchArchive = apps.get_model("social_app", "MatchArchive")
+    MatchParticipation = apps.get_model("social_app", "MatchParticipation")
+    Player = apps.get_model("social_app", "Player")
+    existing = set(Player.objects.values_list("pk", flat=True))
+    MatchParticipation.objects.bulk_create(
+        [
+            MatchParticipation(match_id=archive.match_id, player_id=entry["id"])
+            for archive in MatchArchive.objects.all()
+            for entry in archive.roster
+            if entry["id"] in existing
+        ],
+        ignore_conflicts=True,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("social_app", "0009_last_activity"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="FriendSuggestions",
+            fields=[
+                (
+                    "player",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        primary_key=True,
+                        serialize=False,
+                        to="social_app.player",
+                    ),
+                ),
+                ("candidates", models.JSONField(default=list)),
+                ("updated_at", models.DateTimeField(auto_now=True, db_index=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name="MatchParticipation",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("match_id", models.BigIntegerField()),
+                (
+                    "player",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        to="social_app.player",
+                    ),
+                ),
+            ],
+            options={
+                "indexes": [
+                    models.Index(
+                        fields=["match_id"], name="social_app__match_i_fdb1a7_idx"
+                    )
+                ],
+                "unique_together": {("player", "match_id")},
+            },
+        ),
+        migrations.RunPython(participations_from_archives, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,56 @@
+# Generated by Django 4.2.2 on 2026-10-19 14:38
+
+import django
+from django.db import migrations, models
+
+# CheckConstraint takes condition= from Django 5.1 on, check= before
+CHECK_CONSTRAINT_ARGUMENT = "condition" if django.VERSION >= (5, 1) else "check"
+
+
+def canonicalize_friendships(apps, schema_editor):
+    Friendship = apps.get_model("social_app", "Friendship")
+    for reversed_friendship in Friendship.objects.filter(player__gt=models.F("friend")):
+        canonical = Friendship.objects.filter(
+            player=reversed_friendship.friend_id, friend=reversed_friendship.player_id
+        ).first()
+        if canonical is None:
+            Friendship.objects.filter(pk=reversed_friendship.pk).update(
+                player=reversed_friendship.friend_id,
+                friend=reversed_friendship.player_id,
+            )
+        else:
+            # befriended in both directions: keep one row with the higher experience
+            canonical.experience = max(
+                canonical.experience, reversed_friendship.experience
+            )
+            canonical.save(update_fields=["experience"])
+            reversed_friendship.delete()
+    Friendship.objects.filter(player=models.F("friend")).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("social_app", "0010_friend_suggestions"),
+    ]
+
+    operations = [
+        migrations.RunPython(canonicalize_friendships, migrations.RunPython.noop),
+        migrations.AlterUniqueTogether(
+            name="friendship",
+            unique_together=set(),
+        ),
+        migrations.AddConstraint(
+            model_name="friendship",
+            constraint=models.UniqueConstraint(
+                fields=("player", "friend"), name="unique_friendship"
+            ),
+        ),
+        migrations.AddConstraint(
+            model_name="friendship",
+            constraint=models.CheckConstraint(
+                **{CHECK_CONSTRAINT_ARGUMENT: models.Q(("player__lt", models.F("friend")))},
+                name="friendship_low_id_first",
+            ),
+        ),
+    ]
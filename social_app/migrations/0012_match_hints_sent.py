@@ -0,0 +1,18 @@
+# Generated by Django 4.2.2 on 2026-10-19 14:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("social_app", "0011_canonical_friendship"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="match",
+            name="hints_sent",
+            field=models.IntegerField(default=0),
+        ),
+    ]
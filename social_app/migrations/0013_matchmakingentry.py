@@ -0,0 +1,48 @@
+# Generated by Django 4.2.2 on 2026-10-19 14:57
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("social_app", "0012_match_hints_sent"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="MatchmakingEntry",
+            fields=[
+                (
+                    "player",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        primary_key=True,
+                        serialize=False,
+                        to="social_app.player",
+                    ),
+                ),
+                ("latitude", models.FloatField()),
+                ("longitude", models.FloatField()),
+                (
+                    "role",
+                    models.CharField(
+                        choices=[("HI", "Hider"), ("HU", "Hunter")],
+                        max_length=2,
+                        null=True,
+                    ),
+                ),
+                (
+                    "enqueued_at",
+                    models.DateTimeField(
+                        db_index=True, default=django.utils.timezone.now
+                    ),
+                ),
+                ("host", models.CharField(blank=True, default="", max_length=20)),
+                ("claim", models.CharField(blank=True, default="", max_length=32)),
+                ("claimed_until", models.DateTimeField(null=True)),
+            ],
+        ),
+    ]
@@ -1,8 +1,17 @@
 from django.db import models
-from django.db.models import Q
+from django.db.models import F, Q
 from django.contrib.auth.models import User
 from django.contrib.gis.db import models
+from django.conf import settings
+from django.utils import timezone
 import datetime
+import django
+
+# CheckConstraint takes its condition as condition= from Django 5.1 on, and
+# as check= before
+CHECK_CONSTRAINT_ARGUMENT = 'condition' if django.VERSION >= (5, 1) else 'check'
+
+from .signals import slots_changed
 
 class Match(models.Model):
     # no need for id field as Django creates auto-incrementing ids
@@ -22,14 +31,64 @@ class Match(models.Model):
     createdAtLocation = models.PointField(null=True)
     createdAtTime = models.TimeField(auto_now=False, auto_now_add=False, null=True)
 
+    # optional play area: a radius (in meters) around createdAtLocation
+    # and/or a polygon, see geofence.py
+    play_area_radius = models.FloatField(null=True, blank=True)
+    play_area = models.PolygonField(null=True, blank=True)
+
     has_started = models.BooleanField(default=False)
 
+    # a match moves through these phases on its own once it has been started,
+    # see phases.py
+    PHASE_CHOICES = [
+        ("lobby", "Lobby"),
+        ("hiding", "Hiding"),
+        ("hunting", "Hunting"),
+        ("ended", "Ended"),
+    ]
+    phase = models.CharField(max_length=10, default="lobby", choices=PHASE_CHOICES)
+    started_at = models.DateTimeField(null=True)
+    # hint ticks published so far; claimed with a conditional UPDATE so that
+    # each tick is published once however many processes schedule it
+    hints_sent = models.IntegerField(default=0)
+
+    # last time the match was hosted, joined or started; together with the
+    # players' last_seen used to clean up abandoned matches (cleanup.py)
+    last_activity = models.DateTimeField(null=True, default=timezone.now, db_index=True)
+
+    # slot counters which are kept in step with player_set, so that a join can
+    # be claimed with a single conditional UPDATE instead of count-then-save
+    joined_players = models.IntegerField(default=0)
+    joined_hunters = models.IntegerField(default=0)
+    joined_hiders = models.IntegerField(default=0)
+
+    # maps a role (None meaning "any player") to its counter and capacity
+    SLOT_COLUMNS = {
+        None: ("joined_players", F("numberOfHunters") + F("numberOfHiders")),
+        "HU": ("joined_hunters", F("numberOfHunters")),
+        "HI": ("joined_hiders", F("numberOfHiders")),
+    }
+
     def is_full(self):
-        if self.player_set.count() >= self.numberOfHunters + self.numberOfHiders:
+        if self.joined_players >= self.numberOfHunters + self.numberOfHiders:
             return True
         else:
             return False
 
+    # atomically takes one slot of the given role if one is free; the check and
+    # the increment happen in the same UPDATE, so concurrent joins cannot overfill
+    def claim_slot(self, role=None):
+        counter, capacity = self.SLOT_COLUMNS[role]
+        claimed = Match.objects.filter(pk=self.pk, **{f'{counter}__lt': capacity}).update(**{counter: F(counter) + 1})
+        if claimed:
+            slots_changed.send(sender=Match, match_ids=[self.pk])
+        return claimed == 1
+
+    def release_slot(self, role=None):
+        counter, _ = self.SLOT_COLUMNS[role]
+        if Match.objects.filter(pk=self.pk, **{f'{counter}__gt': 0}).update(**{counter: F(counter) - 1}):
+            slots_changed.send(sender=Match, match_ids=[self.pk])
+
     def all_ready(self):
         if self.player_set.count() < 2:
             return False
@@ -48,21 +107,30 @@ class Match(models.Model):
                 return False
         return True
 
+    # the instants at which the match enters its hunting and ended phases,
+    # or None if the match has not been started yet
+    def get_phase_deadlines(self):
+        if self.started_at is None:
+            return None
+        unit = datetime.timedelta(seconds=settings.MATCH_DURATION_UNIT_SECONDS)
+        hunting = self.started_at + (self.hiding_duration or 0) * unit
+        return {
+            "hunting": hunting,
+            "ended": hunting + (self.duration or 0) * unit,
+        }
+
+    def get_hint_interval(self):
+        if not self.hint_interval_duration:
+            return None
+        return datetime.timedelta(seconds=self.hint_interval_duration * settings.MATCH_DURATION_UNIT_SECONDS)
+
     def get_average_friendship_experience(self):
-        friendships = []
-        for player1 in self.player_set.all():
-            for player2 in self.player_set.all():
-                if player1 is player2:
-                    continue
-                if Friendship.objects.filter(player=player1, friend=player2).exists():
-                    toAdd = Friendship.objects.get(player=player1, friend=player2)
-                    if toAdd not in friendships:
-                        friendships.append(toAdd)
-
-        if len(friendships) == 0:
-            return 0;
-        average_experience = sum(friendship.experience for friendship in friendships) / len(friendships)
-        return average_experience
+        # every friendship is stored once, so this counts each pair of
+        # befriended players in the match exactly once
+        players = self.player_set.values('pk')
+        average_experience = Friendship.objects.filter(player__in=players, friend__in=players) \
+            .aggregate(average=models.Avg('experience'))['average']
+        return average_experience or 0
 
     def __str__(self):
         return self.name
@@ -84,6 +152,9 @@ class Player(models.Model):
     is_loaded = models.BooleanField(default=False, null=False)
     is_caught = models.BooleanField(default=False)
     is_invisible = models.BooleanField(default=False)
+    is_out_of_bounds = models.BooleanField(default=False)
+    # last time the player sent its location or joined/hosted a match
+    last_seen = models.DateTimeField(null=True, default=timezone.now, db_index=True)
 
     # represents the GPS location of a player
     location = models.PointField(null=True)
@@ -91,30 +162,31 @@ class Player(models.Model):
     # function which has to return all Friendship objects which are associated with this user
     # i.e. returns the friendships of a player
     def get_friends(self):
-        friendships = Friendship.objects.filter(Q(player=self) | Q(friend=self))
+        friendships = Friendship.of(self).select_related('player__user', 'friend__user')
         friends = [f.get_friend_of_player(self) for f in friendships]
         return friends
 
     def get_experience_with(self, friend):
-        friendship = Friendship.objects.filter(Q(player=self, friend=friend) | Q(player=friend, friend=self))
-        return friendship.get().experience
+        return Friendship.between(self, friend).get().experience
 
     def update_experience_with_friends(self, experience):
-        friendships = Friendship.objects.filter(Q(player=self) | Q(friend=self))
-        for friendship in friendships:
-            friendship.experience += experience
-            friendship.save()
-
-        
+        Friendship.of(self).update(experience=F('experience') + experience)
 
     def get_requests(self):
         friendship_requests = FriendshipRequest.objects.filter(recipient=self.user.id)
         requests = [r.requester for r in friendship_requests]
         return requests
 
+    # gives back the player and role slots this player holds in its match
+    def release_match_slots(self):
+        if self.match is None:
+            return
+        if self.role is not None:
+            self.match.release_slot(self.role)
+        self.match.release_slot()
+
     def is_friend_with(self, player):
-        is_friend = Friendship.objects.filter(Q(player=self, friend=player) | Q(player=player, friend=self)).exists()
-        return is_friend
+        return Friendship.between(self, player).exists()
 
     def __str__(self):
         return self.user.username
@@ -128,6 +200,8 @@ class Clue(models.Model):
     player = models.OneToOneField(Player, on_delete=models.CASCADE, null=True)
     # should we use the already defined location in Player model ???
     location = models.PointField(null=True)
+    # when the hint engine (hints.py) last placed this clue
+    created_at = models.DateTimeField(null=True)
 
 
 class Object(models.Model):
@@ -141,6 +215,109 @@ class Object(models.Model):
     location = models.PointField(null=True)
 
 
+class TrailBlock(models.Model):
+    # A block of consecutive location fixes of one player, written by the
+    # trail store (trails.py). Times, latitudes and longitudes are kept as
+    # delta-encoded int32 arrays in data instead of one row per fix.
+    # The match is referenced by id only, so that trails outlive the match.
+    match_id = models.BigIntegerField()
+    player = models.ForeignKey(Player, on_delete=models.CASCADE)
+
+    # first and last fix of the block in milliseconds since the epoch
+    start_ms = models.BigIntegerField()
+    end_ms = models.BigIntegerField()
+    count = models.IntegerField()
+    data = models.BinaryField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['match_id', 'player', 'start_ms']),
+        ]
+
+    def __str__(self):
+        return f'Trail of {self.player_id} in match {self.match_id} ({self.count} fixes)'
+
+
+class MatchEvent(models.Model):
+    # Persistent copy of everything published to a match's event log (phase
+    # changes, hints, triggers, catches), kept for replays. Like TrailBlock it
+    # references the match by id only.
+    match_id = models.BigIntegerField(db_index=True)
+    kind = models.CharField(max_length=20)
+    data = models.JSONField(default=dict)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f'{self.kind} in match {self.match_id}'
+
+
+class MatchArchive(models.Model):
+    # What is left of a match after end_match has deleted it, see archive.py
+    match_id = models.BigIntegerField(unique=True)
+    host = models.CharField(max_length=20, default="")
+    name = models.CharField(max_length=25, default="")
+
+    numberOfHunters = models.IntegerField()
+    numberOfHiders = models.IntegerField()
+    duration = models.IntegerField(null=True)
+    hiding_duration = models.IntegerField(null=True)
+    hint_interval_duration = models.IntegerField(null=True)
+
+    createdAtLocation = models.PointField(null=True)
+    started_at = models.DateTimeField(null=True)
+    ended_at = models.DateTimeField()
+
+    # [{"id": ..., "username": ..., "role": ..., "is_caught": ...}, ...]
+    roster = models.JSONField(default=list)
+
+    def __str__(self):
+        return f'{self.name} (ended {self.ended_at})'
+
+
+class MatchParticipation(models.Model):
+    # Who played in which (archived) match, for the shared-match history of
+    # the friend suggestions
+    match_id = models.BigIntegerField()
+    player = models.ForeignKey(Player, on_delete=models.CASCADE)
+
+    class Meta:
+        unique_together = ('player', 'match_id')
+        indexes = [
+            models.Index(fields=['match_id']),
+        ]
+
+
+class FriendSuggestions(models.Model):
+    # Precomputed, ranked friend suggestions of a player, refreshed in the
+    # background by suggestions.py so that serving them is a single read
+    player = models.OneToOneField(Player, on_delete=models.CASCADE, primary_key=True)
+    # [{"username": ..., "score": ..., "mutual_friends": ..., "shared_matches": ..., "distance": ...}, ...]
+    candidates = models.JSONField(default=list)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
+
+    def __str__(self):
+        return f'Suggestions for {self.player_id}'
+
+
+class MatchmakingEntry(models.Model):
+    # A player queued for automatic matchmaking, see matchmaking.py. Once the
+    # player has been put into a match the row stays, with host naming the
+    # host of that match, until the player enqueues again.
+    player = models.OneToOneField(Player, on_delete=models.CASCADE, primary_key=True)
+    latitude = models.FloatField()
+    longitude = models.FloatField()
+    role = models.CharField(max_length=2, choices=Player.ROLE_CHOICES, null=True)
+    enqueued_at = models.DateTimeField(default=timezone.now, db_index=True)
+    host = models.CharField(max_length=20, blank=True, default="")
+    # the matchmaking cycle currently placing the player and until when it
+    # may do so
+    claim = models.CharField(max_length=32, blank=True, default="")
+    claimed_until = models.DateTimeField(null=True)
+
+    def __str__(self):
+        return f'{self.player_id} waiting for a match'
+
+
 class Friendship(models.Model):
     # Followers are players who have befriended you, while friends are players
     # who you have befriended. We use ForeignKey (Many-to-One) because Friendship
@@ -158,6 +335,26 @@ class Friendship(models.Model):
     )
 
     experience = models.IntegerField(default=0)
+
+    # Every friendship is stored once, as the canonical pair with the lower
+    # player id in `player`, so that checking whether two players are friends
+    # is a single probe of the unique (player, friend) index.
+    def save(self, *args, **kwargs):
+        if self.player_id > self.friend_id:
+            self.player_id, self.friend_id = self.friend_id, self.player_id
+        super().save(*args, **kwargs)
+
+    # the friendship of the two players, in whatever order they are given
+    @classmethod
+    def between(cls, player, other):
+        low, high = sorted((player.pk, other.pk))
+        return cls.objects.filter(player=low, friend=high)
+
+    # all friendships the player is part of
+    @classmethod
+    def of(cls, player):
+        return cls.objects.filter(Q(player=player) | Q(friend=player))
+
     def get_friend_of_player(self, player_to_inspect):
         if player_to_inspect.user.id == self.player.user.id:
             return self.friend
@@ -166,10 +363,14 @@ class Friendship(models.Model):
         return None
 
     class Meta:
-        unique_together = ('player', 'friend')
+        constraints = [
+            models.UniqueConstraint(fields=['player', 'friend'], name='unique_friendship'),
+            models.CheckConstraint(**{CHECK_CONSTRAINT_ARGUMENT: Q(player__lt=F('friend'))},
+                                   name='friendship_low_id_first'),
+        ]
 
     def __str__(self):
-        return f'{self.player.user.username} -> {self.friend.user.username}'
+        return f'{self.player.user.username} <-> {self.friend.user.username}'
 
 
 class FriendshipRequest(models.Model):
@@ -187,8 +388,9 @@ class FriendshipRequest(models.Model):
     # accepts the friendship request and creates a new Friendship object and
     # deletes the current Friendship request
     def accept(self):
-        acceptedFriendship = Friendship(player=self.requester, friend=self.recipient)
-        acceptedFriendship.save()
+        # both players may have requested each other
+        low, high = sorted((self.requester_id, self.recipient_id))
+        Friendship.objects.get_or_create(player_id=low, friend_id=high)
         self.delete()
 
     # declines the friendship request and deletes the current Friendship request
@@ -0,0 +1,124 @@
+import threading
+
+from django.utils import timezone
+
+from . import events
+from .models import Match
+from .scheduler import scheduler
+from .signals import phase_changed, hint_tick
+
+# Moves started matches through hiding -> hunting -> ended on the server,
+# using the durations stored on the Match, and fires a hint tick every
+# hint_interval_duration while the hunt is on. Every transition is written
+# to the match row (so any process can read the phase) and published to the
+# match's events.
+#
+# Every worker process schedules the matches it knows of, so several
+# processes fire the same transition or hint tick. Each of them is claimed
+# with a conditional UPDATE of the match row, and only the process whose
+# UPDATE matched publishes it.
+
+_resumed = False
+_resume_lock = threading.Lock()
+
+
+def schedule_match(match):
+    deadlines = match.get_phase_deadlines()
+    if deadlines is None:
+        return
+    scheduler.cancel(match.id)
+    scheduler.call_at(deadlines["hunting"].timestamp(), _start_hunting, match.id, key=match.id)
+    scheduler.call_at(deadlines["ended"].timestamp(), _end, match.id, key=match.id)
+
+    hint_interval = match.get_hint_interval()
+    if hint_interval is not None:
+        first_hint = max(deadlines["hunting"], timezone.now()) + hint_interval
+        if first_hint < deadlines["ended"]:
+            scheduler.call_at(first_hint.timestamp(), _hint, match.id, key=match.id)
+
+
+def cancel_match(match_id):
+    scheduler.cancel(match_id)
+
+
+# ends the match right away, e.g. when the host ends it early
+def end_now(match_id):
+    cancel_match(match_id)
+    _end([match_id])
+
+
+# reschedules the matches that were running when the process (re)started;
+# called lazily the first time phases are needed
+def resume_matches():
+    global _resumed
+    with _resume_lock:
+        if _resumed:
+            return
+        _resumed = True
+    for match in Match.objects.filter(phase__in=["hiding", "hunting"]):
+        schedule_match(match)
+
+
+# starts the match unless it has already been started; returns whether it
+# was started by this call
+def start(match):
+    resume_matches()
+    now = timezone.now()
+    started = Match.objects.filter(id=match.id, has_started=False).update(
+        has_started=True, phase="hiding", started_at=now, last_activity=now)
+    if not started:
+        return False
+    match.has_started = True
+    match.phase = "hiding"
+    match.started_at = now
+    match.last_activity = now
+    _publish([match.id], "hiding")
+    schedule_match(match)
+    return True
+
+
+def _advance(match_ids, from_phases, to_phase):
+    # only matches which are still in the expected phase move on, so a match
+    # that was ended early, rescheduled twice or already moved by another
+    # process is not moved again
+    moved = [match_id for match_id in set(match_ids)
+             if Match.objects.filter(id=match_id, phase__in=from_phases).update(phase=to_phase)]
+    _publish(moved, to_phase)
+
+
+def _publish(match_ids, phase):
+    for match_id in match_ids:
+        events.publish(match_id, "phase", phase=phase)
+        phase_changed.send(sender=Match, match_id=match_id, phase=phase)
+
+
+def _start_hunting(match_ids):
+    _advance(match_ids, ["lobby", "hiding"], "hunting")
+
+
+def _end(match_ids):
+    _advance(match_ids, ["lobby", "hiding", "hunting"], "ended")
+
+
+# the number of hint ticks which have fallen due in the match by now
+def _hints_due(match, now):
+    return int((now - match.get_phase_deadlines()["hunting"]) / match.get_hint_interval())
+
+
+def _hint(match_ids):
+    matches = list(Match.objects.filter(id__in=set(match_ids), phase="hunting"))
+    if not matches:
+        return
+
+    now = timezone.now()
+    ticked = []
+    for match in matches:
+        due = _hints_due(match, now)
+        if Match.objects.filter(id=match.id, hints_sent__lt=due).update(hints_sent=due):
+            events.publish(match.id, "hint")
+            ticked.append(match.id)
+        next_hint = match.get_phase_deadlines()["hunting"] + (due + 1) * match.get_hint_interval()
+        if next_hint < match.get_phase_deadlines()["ended"]:
+            scheduler.call_at(next_hint.timestamp(), _hint, match.id, key=match.id)
+    if ticked:
+        hint_tick.send(sender=Match, match_ids=ticked)
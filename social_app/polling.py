@@ -0,0 +1,83 @@
+import threading
+import time
+
+import numpy as np
+from django.conf import settings
+
+from . import middleware
+from .geofence import distances_m
+from .models import Player
+
+# Recommended poll intervals. Responses of the match routes carry an
+# X-Poll-Interval header with the number of seconds the client should wait
+# before polling again: short in the middle of a chase, long in the lobby,
+# while hiding as a hunter or after the match has ended, and stretched while
+# the server is busy.
+
+OPPONENT = {"HU": "HI", "HI": "HU"}
+
+_opponents = {}
+_lock = threading.Lock()
+
+
+# locations of the players of the given role in the match, cached for
+# POLL_OPPONENT_CACHE_SECONDS so that this costs one query per match and
+# role, not one per response
+def _locations(match_id, role):
+    key = (match_id, role)
+    with _lock:
+        cached = _opponents.get(key)
+        if cached is not None and time.monotonic() - cached[0] < settings.POLL_OPPONENT_CACHE_SECONDS:
+            return cached[1]
+        if len(_opponents) > 10000:
+            _opponents.clear()
+
+    opponents = Player.objects.filter(match=match_id, role=role, location__isnull=False)
+    if role == 'HI':
+        # invisible and caught hiders are out of sight, so no reason to poll faster
+        opponents = opponents.filter(is_invisible=False, is_caught=False)
+    locations = [location for location in opponents.values_list('location', flat=True)]
+    arrays = (np.array([location.y for location in locations]), np.array([location.x for location in locations]))
+    with _lock:
+        _opponents[key] = (time.monotonic(), arrays)
+    return arrays
+
+
+# 0 when idle, 1 when the game or default traffic fills its load shedding limit
+def _load():
+    return max(min(middleware.priority_classes[name].in_flight / middleware.priority_classes[name].limit, 1)
+               for name in ('game', 'default'))
+
+
+def _chase_interval(player):
+    role = OPPONENT.get(player.role)
+    if role is None or player.location is None:
+        return settings.POLL_INTERVALS["hunting"]
+    latitudes, longitudes = _locations(player.match_id, role)
+    if not len(latitudes):
+        return settings.POLL_INTERVALS["hunting"]
+
+    nearest = distances_m(player.location.y, player.location.x, latitudes, longitudes).min()
+    # from POLL_NEAR_INTERVAL right next to an opponent up to the hunting
+    # interval at POLL_FAR_M and beyond
+    closeness = np.clip((nearest - settings.POLL_NEAR_M) / (settings.POLL_FAR_M - settings.POLL_NEAR_M), 0, 1)
+    return settings.POLL_NEAR_INTERVAL + closeness * (settings.POLL_INTERVALS["hunting"] - settings.POLL_NEAR_INTERVAL)
+
+
+# seconds the player should wait before its next poll, or None if it is not
+# in a match
+def recommended_interval(player):
+    match = player.match
+    if match is None:
+        return None
+
+    if match.phase == "hunting":
+        interval = _chase_interval(player)
+    elif match.phase == "hiding" and player.role == "HU":
+        # hunters only wait for the hunt to begin
+        interval = settings.POLL_INTERVALS["hiding_hunter"]
+    else:
+        interval = settings.POLL_INTERVALS[match.phase]
+
+    interval *= 1 + settings.POLL_LOAD_STRETCH * _load()
+    return round(float(np.clip(interval, settings.POLL_MIN_INTERVAL, settings.POLL_MAX_INTERVAL)), 1)
@@ -0,0 +1,86 @@
+import heapq
+import itertools
+import logging
+import threading
+import time
+
+from django.db import close_old_connections
+
+logger = logging.getLogger(__name__)
+
+
+# A small in-process scheduler: a heap of (deadline, callback, argument)
+# entries served by a single daemon thread, which is only started once the
+# first entry has been scheduled.
+#
+# Entries with the same callback which fall due in the same wake-up are
+# handed to the callback together, i.e. a callback always receives a list of
+# the arguments it was scheduled with. This lets e.g. the hint ticks of
+# hundreds of matches be served by one batch of queries.
+class Scheduler:
+    def __init__(self):
+        self._heap = []
+        self._counter = itertools.count()
+        self._condition = threading.Condition()
+        self._thread = None
+
+    # runs callback([argument]) at the given time.time() timestamp; entries
+    # scheduled with a key can be cancelled together with cancel(key)
+    def call_at(self, when, callback, argument=None, key=None):
+        with self._condition:
+            heapq.heappush(self._heap, (when, next(self._counter), key, callback, argument))
+            self._condition.notify()
+            self._start()
+
+    def call_later(self, delay, callback, argument=None, key=None):
+        self.call_at(time.time() + delay, callback, argument, key)
+
+    # runs callback([argument]) every interval seconds until cancelled
+    def call_every(self, interval, callback, argument=None, key=None):
+        def repeat(arguments):
+            self.call_later(interval, repeat, argument, key)
+            callback(arguments)
+
+        self.call_later(interval, repeat, argument, key)
+
+    def cancel(self, key):
+        with self._condition:
+            self._heap = [entry for entry in self._heap if entry[2] != key]
+            heapq.heapify(self._heap)
+
+    def pending(self):
+        with self._condition:
+            return len(self._heap)
+
+    def _start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name='match-scheduler', daemon=True)
+            self._thread.start()
+
+    def _pop_due(self):
+        with self._condition:
+            while True:
+                now = time.time()
+                if self._heap and self._heap[0][0] <= now:
+                    break
+                timeout = self._heap[0][0] - now if self._heap else None
+                self._condition.wait(timeout)
+
+            due = {}
+            while self._heap and self._heap[0][0] <= now:
+                _, _, _, callback, argument = heapq.heappop(self._heap)
+                due.setdefault(callback, []).append(argument)
+            return due
+
+    def _run(self):
+        while True:
+            for callback, arguments in self._pop_due().items():
+                close_old_connections()
+                try:
+                    callback(arguments)
+                except Exception:
+                    logger.exception('scheduled callback %r failed', callback)
+            close_old_connections()
+
+
+scheduler = Scheduler()
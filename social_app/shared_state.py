@@ -0,0 +1,249 @@
+import logging
+import os
+import tempfile
+import threading
+import time
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+from django.conf import settings
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import Match, Player
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# Live match state shared by all worker processes of a host. A shared memory
+# segment holds SHARED_STATE_SLOTS fixed-layout player slots: player id,
+# match id, role, flags, location and the time of the last write. A player
+# lives in the first free slot at or after player id % SHARED_STATE_SLOTS
+# (looking at most PROBE slots ahead).
+#
+# Every slot carries a seqlock counter: a writer makes it odd, writes the
+# slot and makes it even again, and a reader that sees an odd or changed
+# counter reads again. Writers to the same slot exclude each other with a
+# byte-range lock on a lock file, one byte per slot. POSIX record locks are
+# held per process, so threads of the same process would all get that lock at
+# once; they first take one of LOCK_STRIPES thread locks of their process.
+# Readers never lock.
+#
+# Location polls of running matches are answered from here instead of
+# SQLite. Slots not written for SHARED_STATE_MAX_AGE_SECONDS count as empty,
+# which also hides whatever a previous run left in the segment.
+
+SLOT = np.dtype([
+    ('seq', np.uint32),
+    ('role', np.uint8),
+    ('flags', np.uint8),
+    ('player_id', np.int64),
+    ('match_id', np.int64),
+    ('latitude', np.float64),
+    ('longitude', np.float64),
+    ('updated', np.float64),
+])
+
+ROLES = {None: 0, "HU": 1, "HI": 2}
+
+CAUGHT = 1
+INVISIBLE = 2
+OUT_OF_BOUNDS = 4
+
+PROBE = 8
+READ_RETRIES = 5
+LOCK_STRIPES = 64
+
+
+def flags_of(player):
+    return ((CAUGHT if player.is_caught else 0) | (INVISIBLE if player.is_invisible else 0)
+            | (OUT_OF_BOUNDS if player.is_out_of_bounds else 0))
+
+
+class MatchState:
+    def __init__(self, name, slots):
+        self.name = name
+        self.slots = slots
+        self.memory = None
+        self.table = None
+        self.lock_file = None
+        self._lock = threading.Lock()
+        self._slot_locks = [threading.Lock() for _ in range(LOCK_STRIPES)]
+        self._failed = False
+
+    # attaches to the segment, creating it if this is the first process
+    def _attach(self):
+        if self.table is not None or self._failed:
+            return self.table is not None
+        with self._lock:
+            if self.table is not None or self._failed:
+                return self.table is not None
+            try:
+                try:
+                    self.memory = shared_memory.SharedMemory(self.name, create=True, size=self.slots * SLOT.itemsize)
+                except FileExistsError:
+                    self.memory = shared_memory.SharedMemory(self.name)
+                # the segment outlives the process which created it
+                resource_tracker.unregister(self.memory._name, 'shared_memory')
+                self.lock_file = os.open(os.path.join(tempfile.gettempdir(), f'{self.name}.lock'),
+                                         os.O_RDWR | os.O_CREAT, 0o600)
+                self.table = np.ndarray((self.slots,), dtype=SLOT, buffer=self.memory.buf)
+            except (OSError, ValueError):
+                logger.exception('shared match state unavailable, using the database')
+                self._failed = True
+            return self.table is not None
+
+    def enabled(self):
+        return settings.SHARED_STATE_ENABLED and fcntl is not None and self._attach()
+
+    # writes fields into the slot under the seqlock, if the slot still
+    # belongs to the player, or is free and may be claimed
+    def _write(self, index, owner, claim=False, **fields):
+        with self._slot_locks[index % LOCK_STRIPES]:
+            return self._write_locked(index, owner, claim, fields)
+
+    def _write_locked(self, index, owner, claim, fields):
+        fcntl.lockf(self.lock_file, fcntl.LOCK_EX, 1, index)
+        try:
+            current = self.table['player_id'][index]
+            free = current == 0 or self.table['updated'][index] < time.time() - settings.SHARED_STATE_MAX_AGE_SECONDS
+            if current != owner and not (claim and free):
+                return False
+            self.table['seq'][index] += 1
+            for field, value in fields.items():
+                self.table[field][index] = value
+            self.table['seq'][index] += 1
+            return True
+        finally:
+            fcntl.lockf(self.lock_file, fcntl.LOCK_UN, 1, index)
+
+    def _probe(self, player_id):
+        home = player_id % self.slots
+        return [(home + i) % self.slots for i in range(PROBE)]
+
+    def _find(self, player_id):
+        for index in self._probe(player_id):
+            if self.table['player_id'][index] == player_id:
+                return index
+        return None
+
+    # stores the player's match, role, flags and location
+    def put(self, player):
+        if not self.enabled():
+            return
+        if player.match_id is None:
+            self.remove(player.pk)
+            return
+        location = player.location
+        fields = dict(
+            player_id=player.pk, match_id=player.match_id, role=ROLES.get(player.role, 0), flags=flags_of(player),
+            latitude=location.y if location is not None else np.nan,
+            longitude=location.x if location is not None else np.nan,
+            updated=time.time(),
+        )
+        index = self._find(player.pk)
+        if index is not None and self._write(index, player.pk, **fields):
+            return
+        for index in self._probe(player.pk):
+            if self._write(index, player.pk, claim=True, **fields):
+                return
+
+    # sets or clears a flag of the given players, if they have a slot
+    def set_flag(self, player_ids, flag, value):
+        if not self.enabled():
+            return
+        for player_id in player_ids:
+            index = self._find(player_id)
+            if index is None:
+                continue
+            flags = int(self.table['flags'][index])
+            self._write(index, player_id, flags=(flags | flag) if value else (flags & ~flag))
+
+    def remove(self, player_id):
+        if not self.enabled():
+            return
+        index = self._find(player_id)
+        if index is not None:
+            self._write(index, player_id, player_id=0, match_id=0, updated=0.0)
+
+    # copies of the slots at rows, leaving out slots that kept being written
+    # to while they were read
+    def _consistent(self, rows):
+        table = self.table
+        copies = []
+        for _ in range(READ_RETRIES):
+            before = table['seq'][rows]
+            copy = table[rows]
+            after = table['seq'][rows]
+            torn = (before != after) | (before % 2 == 1)
+            copies.append(copy[~torn])
+            rows = rows[torn]
+            if not len(rows):
+                break
+        return np.concatenate(copies)
+
+    # a consistent copy of the live slots of the match's players with the
+    # given role, including players without a location yet, or None when
+    # shared state is not available
+    def players(self, match_id, role):
+        if not self.enabled():
+            return None
+        rows = np.flatnonzero((self.table['match_id'] == match_id) & (self.table['role'] == ROLES[role]))
+        copy = self._consistent(rows)
+        live = ((copy['match_id'] == match_id) & (copy['role'] == ROLES[role])
+                & (copy['updated'] >= time.time() - settings.SHARED_STATE_MAX_AGE_SECONDS))
+        return copy[live]
+
+
+state = MatchState(settings.SHARED_STATE_NAME, settings.SHARED_STATE_SLOTS)
+
+
+# stores the players as the database has them now, after their rows were
+# changed with .update(), which sends no post_save
+def refresh(player_ids):
+    if not player_ids or not state.enabled():
+        return
+    for player in Player.objects.filter(pk__in=player_ids):
+        state.put(player)
+
+
+# the location listing of get_hiders_locations/get_hunters_locations from
+# shared state, or None if the views have to ask the database
+def locations(match, role, visible_only=False):
+    if not match.has_started:
+        # players only report locations continuously once the match runs
+        return None
+    rows = state.players(match.id, role)
+    if rows is None:
+        return None
+    # players without a live slot (lost in a restart, not written for
+    # SHARED_STATE_MAX_AGE_SECONDS, or with all PROBE slots taken) are only
+    # known to the database
+    counter, _ = Match.SLOT_COLUMNS[role]
+    if len(rows) < getattr(match, counter):
+        return None
+    rows = rows[~np.isnan(rows['latitude'])]
+    if visible_only:
+        rows = rows[rows['flags'] & INVISIBLE == 0]
+    return [
+        {
+            "latitude": float(row['latitude']),
+            "longitude": float(row['longitude']),
+            "out_of_bounds": bool(row['flags'] & OUT_OF_BOUNDS),
+        }
+        for row in rows
+    ]
+
+
+@receiver(post_save, sender=Player)
+def player_saved(sender, instance, **kwargs):
+    state.put(instance)
+
+
+@receiver(post_delete, sender=Player)
+def player_deleted(sender, instance, **kwargs):
+    state.remove(instance.pk)
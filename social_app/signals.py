@@ -0,0 +1,15 @@
+from django.dispatch import Signal
+
+# Sent by phases.py whenever a match moves into a new phase.
+# Arguments: match_id, phase
+phase_changed = Signal()
+
+# Sent by phases.py once per scheduler wake-up for all matches whose hint
+# interval has elapsed, so that receivers can serve them in one batch.
+# Arguments: match_ids
+hint_tick = Signal()
+
+# Sent whenever the joined player counters of matches change without a
+# save(), i.e. by Match.claim_slot/release_slot and the bulk counter updates.
+# Arguments: match_ids
+slots_changed = Signal()
@@ -0,0 +1,145 @@
+import threading
+from collections import Counter, defaultdict
+
+import numpy as np
+from django.conf import settings
+from django.contrib.gis.geos import Polygon
+from django.db.models import Q
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .geo import METERS_PER_DEGREE
+from .geofence import distances_m
+from .models import Player, Friendship, FriendshipRequest, MatchParticipation, FriendSuggestions
+from .scheduler import scheduler
+
+# Friend suggestions. Every player has a FriendSuggestions row holding its
+# best candidates, ranked by mutual friends, shared matches and proximity.
+# Friendship, request and location changes only mark the players involved
+# as dirty; a background job recomputes the dirty players in batches every
+# SUGGESTIONS_REFRESH_SECONDS, so that the request path is a single read.
+
+_dirty = set()
+_lock = threading.Lock()
+_refreshing = False
+
+
+def mark_dirty(*player_ids):
+    global _refreshing
+    with _lock:
+        _dirty.update(player_ids)
+        if not _refreshing:
+            _refreshing = True
+            scheduler.call_every(settings.SUGGESTIONS_REFRESH_SECONDS, lambda _: refresh_dirty(), key='suggestions')
+
+
+def refresh_dirty():
+    with _lock:
+        batch = [_dirty.pop() for _ in range(min(len(_dirty), settings.SUGGESTIONS_BATCH_SIZE))]
+    if batch:
+        refresh(batch)
+
+
+def _friends_of(player_ids):
+    friends = defaultdict(set)
+    pairs = Friendship.objects.filter(Q(player__in=player_ids) | Q(friend__in=player_ids)) \
+        .values_list('player', 'friend')
+    for a, b in pairs:
+        friends[a].add(b)
+        friends[b].add(a)
+    return friends
+
+
+def _nearby(player, radius_km):
+    location = player.location
+    dy = radius_km * 1000 / METERS_PER_DEGREE
+    dx = dy / max(np.cos(np.radians(location.y)), 0.01)
+    box = Polygon.from_bbox((location.x - dx, location.y - dy, location.x + dx, location.y + dy))
+    return Player.objects.filter(location__contained=box).exclude(pk=player.pk) \
+        .values_list('pk', flat=True)[:settings.SUGGESTIONS_MAX_NEARBY]
+
+
+def refresh(player_ids):
+    players = {p.pk: p for p in Player.objects.filter(pk__in=player_ids)}
+
+    friends = _friends_of(list(players))
+    friends_of_friends = _friends_of(list({f for pk in players for f in friends[pk]}))
+    requested = defaultdict(set)
+    for a, b in FriendshipRequest.objects.filter(Q(requester__in=players) | Q(recipient__in=players)) \
+            .values_list('requester', 'recipient'):
+        requested[a].add(b)
+        requested[b].add(a)
+
+    played_in = defaultdict(set)
+    for player_id, match_id in MatchParticipation.objects.filter(player__in=players).values_list('player', 'match_id'):
+        played_in[player_id].add(match_id)
+    co_players = defaultdict(list)
+    for match_id, player_id in MatchParticipation.objects.filter(
+            match_id__in={m for matches in played_in.values() for m in matches}).values_list('match_id', 'player'):
+        co_players[match_id].append(player_id)
+
+    ranked = {}
+    for pk, player in players.items():
+        mutual = Counter(c for f in friends[pk] for c in friends_of_friends[f])
+        shared = Counter(c for m in played_in[pk] for c in co_players[m])
+        nearby = _nearby(player, settings.SUGGESTIONS_RADIUS_KM) if player.location else []
+
+        candidates = (set(mutual) | set(shared) | set(nearby)) - friends[pk] - requested[pk] - {pk}
+        ranked[pk] = (candidates, mutual, shared)
+
+    everyone = {c for candidates, _, _ in ranked.values() for c in candidates}
+    details = {pk: (username, location) for pk, username, location
+               in Player.objects.filter(pk__in=everyone).values_list('pk', 'user__username', 'location')}
+
+    rows = []
+    for pk, (candidates, mutual, shared) in ranked.items():
+        candidates = [c for c in candidates if c in details]
+        location = players[pk].location
+        distances = np.full(len(candidates), np.inf)
+        located = [i for i, c in enumerate(candidates) if details[c][1] is not None]
+        if location is not None and located:
+            latitudes = np.array([details[candidates[i]][1].y for i in located])
+            longitudes = np.array([details[candidates[i]][1].x for i in located])
+            distances[located] = distances_m(location.y, location.x, latitudes, longitudes) / 1000
+
+        scored = [
+            {
+                "username": details[c][0],
+                "mutual_friends": mutual[c],
+                "shared_matches": shared[c],
+                "distance": None if np.isinf(d) else round(float(d), 2),
+                "score": (settings.SUGGESTIONS_MUTUAL_WEIGHT * mutual[c]
+                          + settings.SUGGESTIONS_SHARED_MATCH_WEIGHT * shared[c]
+                          + settings.SUGGESTIONS_PROXIMITY_WEIGHT / (1 + float(d))),
+            }
+            for c, d in zip(candidates, distances)
+        ]
+        scored.sort(key=lambda s: s["score"], reverse=True)
+        rows.append(FriendSuggestions(player_id=pk, candidates=scored[:settings.SUGGESTIONS_PER_PLAYER]))
+
+    FriendSuggestions.objects.bulk_create(rows, update_conflicts=True, unique_fields=['player'],
+                                          update_fields=['candidates', 'updated_at'])
+
+
+@receiver(post_save, sender=Friendship)
+@receiver(post_delete, sender=Friendship)
+def friendship_changed(sender, instance, created=True, **kwargs):
+    # experience updates do not change any suggestions
+    if not created:
+        return
+    friendships_changed([(instance.player_id, instance.friend_id)])
+
+
+# for friendships created or deleted in bulk, which sends no signals
+def friendships_changed(pairs):
+    # the pair's own suggestions change, and so do the mutual friend counts
+    # of everyone befriended with either of them
+    players = {pk for pair in pairs for pk in pair}
+    friends = _friends_of(list(players))
+    mark_dirty(*players, *(f for pk in players for f in friends[pk]))
+
+
+@receiver(post_save, sender=FriendshipRequest)
+@receiver(post_delete, sender=FriendshipRequest)
+def friendship_request_changed(sender, instance, **kwargs):
+    mark_dirty(instance.requester_id, instance.recipient_id)
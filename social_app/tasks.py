@@ -0,0 +1,153 @@
+import atexit
+import json
+import logging
+import queue
+import sqlite3
+import threading
+
+from django.conf import settings
+from django.db import close_old_connections
+
+from . import archive
+from .models import Player, Match
+
+logger = logging.getLogger(__name__)
+
+# Background execution of work the client does not wait for. Views hand such
+# work to `background.defer(task, *args)` and answer right away; a pool of
+# TASKS_WORKERS threads runs it from a queue of at most TASKS_MAX_QUEUED
+# tasks. When the queue is full the caller runs the task itself, which slows
+# the request down instead of losing the work.
+#
+# With TASKS_JOURNAL set, every deferred task is also written to that SQLite
+# file until it has run, and tasks left over from a previous run of the
+# process (e.g. after a crash) are run again on start. Task arguments must
+# then be JSON serializable, and tasks must be safe to run twice.
+#
+# On shutdown the pool stops taking new work and is given
+# TASKS_DRAIN_SECONDS to finish what is queued.
+
+registry = {}
+
+
+# registers fn as a task, under a name that survives a restart
+def task(fn):
+    registry[f'{fn.__module__}.{fn.__qualname__}'] = fn
+    fn.task_name = f'{fn.__module__}.{fn.__qualname__}'
+    return fn
+
+
+class Journal:
+    def __init__(self, path):
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(str(path), check_same_thread=False, isolation_level=None)
+        self.connection.execute('PRAGMA journal_mode = WAL')
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS task (id INTEGER PRIMARY KEY, name TEXT NOT NULL, arguments TEXT NOT NULL)')
+
+    def add(self, name, args, kwargs):
+        with self.lock:
+            cursor = self.connection.execute('INSERT INTO task (name, arguments) VALUES (?, ?)',
+                                             (name, json.dumps([args, kwargs])))
+            return cursor.lastrowid
+
+    def remove(self, task_id):
+        with self.lock:
+            self.connection.execute('DELETE FROM task WHERE id = ?', (task_id,))
+
+    def pending(self):
+        with self.lock:
+            rows = self.connection.execute('SELECT id, name, arguments FROM task ORDER BY id').fetchall()
+        return [(task_id, name, *json.loads(arguments)) for task_id, name, arguments in rows]
+
+
+class TaskExecutor:
+    def __init__(self, workers, max_queued, journal_path=None):
+        self.workers = workers
+        self.journal_path = journal_path
+        self.journal = None
+        self._queue = queue.Queue(maxsize=max_queued)
+        self._threads = []
+        self._lock = threading.Lock()
+        self._closing = False
+
+    def start(self):
+        with self._lock:
+            if self._threads or self._closing:
+                return
+            if self.journal_path:
+                self.journal = Journal(self.journal_path)
+            for i in range(self.workers):
+                thread = threading.Thread(target=self._run, name=f'background-{i}', daemon=True)
+                thread.start()
+                self._threads.append(thread)
+        if self.journal is not None:
+            for task_id, name, args, kwargs in self.journal.pending():
+                if name not in registry:
+                    logger.error('dropping journaled task %s: no such task', name)
+                    self.journal.remove(task_id)
+                    continue
+                self._enqueue(task_id, registry[name], args, kwargs)
+
+    # runs fn(*args, **kwargs) in the background; fn has to be a @task
+    def defer(self, fn, *args, **kwargs):
+        self.start()
+        if self._closing:
+            self._execute(None, fn, args, kwargs)
+            return
+        task_id = self.journal.add(fn.task_name, args, kwargs) if self.journal is not None else None
+        self._enqueue(task_id, fn, args, kwargs)
+
+    def _enqueue(self, task_id, fn, args, kwargs):
+        try:
+            self._queue.put_nowait((task_id, fn, args, kwargs))
+        except queue.Full:
+            self._execute(task_id, fn, args, kwargs)
+
+    def _execute(self, task_id, fn, args, kwargs):
+        try:
+            fn(*args, **kwargs)
+        except Exception:
+            logger.exception('background task %s failed', fn.task_name)
+        finally:
+            if task_id is not None:
+                self.journal.remove(task_id)
+
+    def _run(self):
+        while True:
+            task_id, fn, args, kwargs = self._queue.get()
+            try:
+                self._execute(task_id, fn, args, kwargs)
+            finally:
+                close_old_connections()
+                self._queue.task_done()
+
+    # stops taking new work and waits up to timeout seconds for the queue to
+    # run empty; returns whether it did
+    def drain(self, timeout=None):
+        self._closing = True
+        with self._queue.all_tasks_done:
+            return self._queue.all_tasks_done.wait_for(lambda: not self._queue.unfinished_tasks, timeout)
+
+
+background = TaskExecutor(settings.TASKS_WORKERS, settings.TASKS_MAX_QUEUED, settings.TASKS_JOURNAL)
+atexit.register(lambda: background.drain(settings.TASKS_DRAIN_SECONDS))
+
+
+@task
+def add_experience_with_friends(player_id, experience):
+    Player(pk=player_id).update_experience_with_friends(experience)
+
+
+# deletes the match (and everything cascading from it) unless more than
+# max_players have joined it in the meantime; a started match is archived
+# first, unless that has already happened
+@task
+def delete_match(match_id, max_players=None):
+    match = Match.objects.filter(pk=match_id).first()
+    if match is None:
+        return
+    if max_players is not None and match.player_set.count() > max_players:
+        return
+    archive.archive_started([match])
+    match.delete()
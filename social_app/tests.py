@@ -1,3 +1,708 @@
-from django.test import TestCase
+import datetime
+import json
+import os
+import tempfile
+import threading
+import time
+from multiprocessing import resource_tracker
+from unittest import mock
 
-# Create your tests here.
+import numpy as np
+from asgiref.sync import sync_to_async
+from django.contrib.auth.models import User
+from django.contrib.gis.geos import Point, Polygon
+from django.conf import settings
+from django.db import connections
+from django.http import HttpResponse
+from django.test import AsyncClient, Client, RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+
+from social_app import (archive, cleanup, clustering, events, geofence, matchmaking, middleware, phases, shared_state,
+                        suggestions, tasks, tiles, trails)
+from social_app.models import (Player, Match, Clue, Friendship, FriendshipRequest, FriendSuggestions, MatchArchive,
+                               MatchEvent, MatchmakingEntry, MatchParticipation)
+from social_app.scheduler import Scheduler
+from social_app.signals import hint_tick, phase_changed
+from social_app.trails import decode_block, encode_block
+
+
+# Fires many joins at the same match at once and checks that the slot
+# counters never let more players in than the match has room for. This needs
+# a file-backed test database (see DATABASES['default']['TEST'] in settings),
+# since the threads each open their own connection. Load shedding is turned
+# off, as it would rightly turn some of the simultaneous requests away.
+@override_settings(MIDDLEWARE=[m for m in settings.MIDDLEWARE if not m.endswith('LoadSheddingMiddleware')])
+class ConcurrentJoinTests(TransactionTestCase):
+    NUMBER_OF_CLIENTS = 300
+
+    def setUp(self):
+        User.objects.bulk_create(
+            [User(username=f'player{i}') for i in range(self.NUMBER_OF_CLIENTS + 1)]
+        )
+        Player.objects.bulk_create([Player(user=user) for user in User.objects.all()])
+
+        self.host = Player.objects.get(user__username='player0')
+        self.match = Match.objects.create(host='player0', name='crowded', numberOfHunters=2,
+                                          numberOfHiders=4, joined_players=1)
+        self.host.match = self.match
+        self.host.save()
+
+        self.clients = []
+        for user in User.objects.exclude(username='player0'):
+            client = Client()
+            client.force_login(user)
+            self.clients.append(client)
+
+    def fire(self, path, data=None):
+        barrier = threading.Barrier(len(self.clients))
+        responses = []
+
+        def join(client):
+            try:
+                barrier.wait()
+                responses.append(client.post(path, data or {}).content.decode())
+            finally:
+                connections.close_all()
+
+        threads = [threading.Thread(target=join, args=(client,)) for client in self.clients]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return responses
+
+    def test_join_match_does_not_overfill(self):
+        responses = self.fire('/join_match/', {'hostname': 'player0'})
+
+        self.match.refresh_from_db()
+        self.assertEqual(self.match.player_set.count(), 6)
+        self.assertEqual(self.match.joined_players, 6)
+        self.assertEqual(sum(r.startswith('1:') for r in responses), 5)
+
+    def test_join_hunter_and_hider_do_not_overfill(self):
+        self.match.numberOfHiders = 100
+        self.match.joined_players = self.NUMBER_OF_CLIENTS + 1
+        self.match.save()
+        Player.objects.update(match=self.match)
+
+        self.fire('/join_hunter/')
+        self.match.refresh_from_db()
+        self.assertEqual(Player.objects.filter(match=self.match, role='HU').count(), 2)
+        self.assertEqual(self.match.joined_hunters, 2)
+
+        # hunters switching over give their hunter slot back
+        self.fire('/join_hider/')
+        self.match.refresh_from_db()
+        self.assertEqual(Player.objects.filter(match=self.match, role='HI').count(), 100)
+        self.assertEqual(self.match.joined_hiders, 100)
+        self.assertEqual(Player.objects.filter(match=self.match, role='HU').count(),
+                         self.match.joined_hunters)
+
+
+class TrailBlockTests(SimpleTestCase):
+    def test_round_trip(self):
+        times_ms = [1700000000000, 1700000001000, 1700000003500]
+        latitudes = [48.1371079, 48.1372, -89.9999999]
+        # crossing the antimeridian makes the longitude delta wrap around
+        longitudes = [179.9999, -179.9999, 11.5754]
+
+        start_ms, data = encode_block(times_ms, latitudes, longitudes)
+        decoded_times, decoded_latitudes, decoded_longitudes = decode_block(start_ms, len(times_ms), data)
+        self.assertEqual(decoded_times.tolist(), times_ms)
+        np.testing.assert_allclose(decoded_latitudes, latitudes, atol=1e-7)
+        np.testing.assert_allclose(decoded_longitudes, longitudes, atol=1e-7)
+
+
+class SchedulerTests(SimpleTestCase):
+    def test_entries_due_together_are_batched(self):
+        scheduler = Scheduler()
+        batches = []
+        done = threading.Event()
+
+        def callback(arguments):
+            batches.append(sorted(arguments))
+            done.set()
+
+        when = time.time() + 0.05
+        scheduler.call_at(when, callback, 'a')
+        scheduler.call_at(when, callback, 'b')
+        scheduler.call_at(when, callback, 'c', key='cancelled')
+        scheduler.cancel('cancelled')
+
+        self.assertTrue(done.wait(2))
+        self.assertEqual(batches, [['a', 'b']])
+        self.assertEqual(scheduler.pending(), 0)
+
+
+# Every worker process schedules the same transitions and hint ticks; the
+# conditional UPDATEs in phases.py have to let exactly one of them through.
+@override_settings(MATCH_DURATION_UNIT_SECONDS=1)
+class PhaseClaimTests(TestCase):
+    def setUp(self):
+        self.match = Match.objects.create(host='host', name='phases', has_started=True, phase='hiding',
+                                          hiding_duration=5, duration=100, hint_interval_duration=10,
+                                          started_at=timezone.now() - datetime.timedelta(seconds=30))
+        self.phases = []
+        self.ticks = []
+        phase_changed.connect(self.on_phase_changed)
+        hint_tick.connect(self.on_hint_tick)
+
+    def tearDown(self):
+        phase_changed.disconnect(self.on_phase_changed)
+        hint_tick.disconnect(self.on_hint_tick)
+        phases.cancel_match(self.match.id)
+
+    def on_phase_changed(self, sender, match_id, phase, **kwargs):
+        self.phases.append((match_id, phase))
+
+    def on_hint_tick(self, sender, match_ids, **kwargs):
+        self.ticks.append(match_ids)
+
+    def test_transition_is_claimed_once(self):
+        # two processes firing the same deadline, one of them twice
+        phases._start_hunting([self.match.id, self.match.id])
+        phases._start_hunting([self.match.id])
+
+        self.match.refresh_from_db()
+        self.assertEqual(self.match.phase, 'hunting')
+        self.assertEqual(self.phases, [(self.match.id, 'hunting')])
+        self.assertEqual(MatchEvent.objects.filter(match_id=self.match.id, kind='phase').count(), 1)
+
+    def test_hint_tick_is_claimed_once(self):
+        Match.objects.filter(pk=self.match.pk).update(phase='hunting')
+
+        # the hunt began 25 seconds ago, so two ticks of 10 seconds are due
+        phases._hint([self.match.id])
+        phases._hint([self.match.id])
+
+        self.match.refresh_from_db()
+        self.assertEqual(self.match.hints_sent, 2)
+        self.assertEqual(self.ticks, [[self.match.id]])
+        self.assertEqual(MatchEvent.objects.filter(match_id=self.match.id, kind='hint').count(), 1)
+
+    def test_start_is_idempotent(self):
+        Match.objects.filter(pk=self.match.pk).update(has_started=False, phase='lobby', started_at=None)
+        self.match.refresh_from_db()
+
+        self.assertTrue(phases.start(self.match))
+        started_at = Match.objects.get(pk=self.match.pk).started_at
+        self.assertFalse(phases.start(Match.objects.get(pk=self.match.pk)))
+
+        self.assertEqual(Match.objects.get(pk=self.match.pk).started_at, started_at)
+        self.assertEqual(self.phases, [(self.match.id, 'hiding')])
+
+
+class HintBatchTests(TestCase):
+    def setUp(self):
+        self.match = Match.objects.create(host='host', name='hints', has_started=True, phase='hunting')
+        self.other = Match.objects.create(host='other', name='other hints', has_started=True, phase='hunting')
+
+        def hider(name, match, **flags):
+            return Player.objects.create(user=User.objects.create(username=name), match=match, role='HI',
+                                         location=Point(11.57, 48.14), **flags)
+
+        self.visible = hider('visible', self.match)
+        self.other_visible = hider('other', self.other)
+        hider('caught', self.match, is_caught=True)
+        hider('invisible', self.match, is_invisible=True)
+        Player.objects.create(user=User.objects.create(username='hunter'), match=self.match, role='HU',
+                              location=Point(11.57, 48.14))
+
+    def test_one_clue_per_visible_hider(self):
+        hint_tick.send(sender=Match, match_ids=[self.match.id, self.other.id])
+        first = {clue.player_id: clue.created_at for clue in Clue.objects.all()}
+        self.assertEqual(set(first), {self.visible.pk, self.other_visible.pk})
+
+        # the next tick replaces the clues instead of adding new ones
+        hint_tick.send(sender=Match, match_ids=[self.match.id])
+        self.assertEqual(Clue.objects.count(), 2)
+        clue = Clue.objects.get(player=self.visible)
+        self.assertGreater(clue.created_at, first[self.visible.pk])
+        self.assertLessEqual(clue.location.distance(Point(11.57, 48.14)), 0.001)
+
+
+class GeofenceEnforceTests(TestCase):
+    def test_flags_follow_the_play_area(self):
+        match = Match.objects.create(host='host', name='fenced', createdAtLocation=Point(11.57, 48.14),
+                                     play_area_radius=100)
+
+        def player(name, longitude, **flags):
+            return Player.objects.create(user=User.objects.create(username=name), match=match,
+                                         location=Point(longitude, 48.14), **flags)
+
+        inside = player('inside', 11.5701)
+        outside = player('outside', 11.58)
+        returned = player('returned', 11.57, is_out_of_bounds=True)
+
+        geofence.enforce(match)
+
+        flags = dict(Player.objects.filter(match=match).values_list('pk', 'is_out_of_bounds'))
+        self.assertEqual(flags, {inside.pk: False, outside.pk: True, returned.pk: False})
+
+
+class ArchiveTests(TestCase):
+    def setUp(self):
+        self.match = Match.objects.create(host='host', name='archived', has_started=True, phase='hunting',
+                                          createdAtLocation=Point(11.57, 48.14), started_at=timezone.now())
+        self.host = Player.objects.create(user=User.objects.create(username='host'), match=self.match, role='HU')
+        self.hider = Player.objects.create(user=User.objects.create(username='hider'), match=self.match, role='HI')
+        events.publish(self.match.id, 'catch', hunter='host', hider='hider')
+        trails.store.record(self.match.id, self.hider.pk, Point(11.5701, 48.1401), time_ms=1700000000000)
+
+    def test_archive_is_never_replaced(self):
+        archive.archive_started([self.match])
+        Player.objects.filter(pk=self.hider.pk).update(match=None)
+
+        # a later ended transition or delete sees a smaller roster
+        phase_changed.send(sender=Match, match_id=self.match.id, phase='ended')
+        archive.archive_started([self.match])
+
+        roster = MatchArchive.objects.get(match_id=self.match.id).roster
+        self.assertEqual({player["username"] for player in roster}, {'host', 'hider'})
+
+    def test_matches_that_never_started_are_not_archived(self):
+        Match.objects.filter(pk=self.match.pk).update(has_started=False)
+        self.match.refresh_from_db()
+        archive.archive_started([self.match])
+        self.assertFalse(MatchArchive.objects.exists())
+
+    def test_export_lists_match_roster_events_and_fixes(self):
+        archive.archive_started([self.match])
+        lines = [json.loads(line) for line in archive.export_match(MatchArchive.objects.get(match_id=self.match.id))]
+
+        self.assertEqual([line["type"] for line in lines], ['match', 'player', 'player', 'event', 'fix'])
+        self.assertEqual(lines[3]["kind"], 'catch')
+        self.assertEqual(lines[4]["time_ms"], 1700000000000)
+
+    async def test_asgi_export_streams_from_an_async_iterator(self):
+        await sync_to_async(archive.archive_started)([self.match])
+        client = AsyncClient()
+        await sync_to_async(client.force_login)(self.hider.user)
+
+        response = await client.get(f'/export_match/{self.match.id}/')
+        self.assertTrue(response.is_async)
+        lines = [json.loads(line) async for line in response.streaming_content]
+        self.assertEqual([line["type"] for line in lines], ['match', 'player', 'player', 'event', 'fix'])
+
+
+class GarbageCollectionTests(TestCase):
+    def test_abandoned_matches_and_stale_players(self):
+        old = timezone.now() - datetime.timedelta(hours=2)
+
+        def player(name, match, last_seen, **fields):
+            player = Player.objects.create(user=User.objects.create(username=name), match=match, **fields)
+            Player.objects.filter(pk=player.pk).update(last_seen=last_seen)
+            return player
+
+        live = Match.objects.create(host='live_host', name='live', joined_players=2, joined_hunters=1)
+        player('live_host', live, timezone.now())
+        stale = player('stale', live, old, role='HU', ready=True)
+
+        abandoned = Match.objects.create(host='gone', name='abandoned', has_started=True, phase='hunting',
+                                         started_at=old, last_activity=old)
+        player('gone', abandoned, old)
+        left_behind = player('left_behind', abandoned, timezone.now(), role='HI', ready=True, is_loaded=True,
+                             is_caught=True)
+
+        result = cleanup.collect_garbage(datetime.timedelta(hours=1))
+
+        self.assertEqual(result["matches"], 1)
+        self.assertFalse(Match.objects.filter(pk=abandoned.pk).exists())
+        self.assertTrue(MatchArchive.objects.filter(match_id=abandoned.pk).exists())
+        for pk in (stale.pk, left_behind.pk):
+            self.assertEqual(
+                Player.objects.filter(pk=pk).values('match', 'role', 'ready', 'is_loaded', 'is_caught').get(),
+                {'match': None, 'role': None, 'ready': False, 'is_loaded': False, 'is_caught': False})
+
+        live.refresh_from_db()
+        self.assertEqual((live.joined_players, live.joined_hunters), (1, 0))
+
+
+class FriendSuggestionTests(TestCase):
+    def test_candidates_are_ranked_and_filtered(self):
+        def player(name, location=None):
+            return Player.objects.create(user=User.objects.create(username=name), location=location)
+
+        me = player('me', Point(11.57, 48.14))
+        friend = player('friend')
+        friend_of_friend = player('friend_of_friend')
+        requested = player('requested', Point(11.5701, 48.1401))
+        co_player = player('co_player')
+        nearby = player('nearby', Point(11.571, 48.141))
+        player('far_away', Point(13.40, 52.52))
+
+        Friendship.objects.create(player=me, friend=friend)
+        Friendship.objects.create(player=friend_of_friend, friend=friend)
+        FriendshipRequest.objects.create(requester=me, recipient=requested)
+        MatchParticipation.objects.bulk_create([MatchParticipation(match_id=1, player=me),
+                                                MatchParticipation(match_id=1, player=co_player)])
+
+        suggestions.refresh([me.pk])
+
+        candidates = {c["username"]: c for c in FriendSuggestions.objects.get(player=me).candidates}
+        self.assertEqual(set(candidates), {'friend_of_friend', 'co_player', 'nearby'})
+        self.assertEqual(candidates['friend_of_friend']["mutual_friends"], 1)
+        self.assertEqual(candidates['co_player']["shared_matches"], 1)
+        self.assertIsNone(candidates['co_player']["distance"])
+        self.assertLess(candidates['nearby']["distance"], 1)
+
+
+class MatchmakingTests(TestCase):
+    def queue(self, name, role=None, seconds_ago=0, **fields):
+        player = Player.objects.create(user=User.objects.create(username=name))
+        MatchmakingEntry.objects.create(player=player, latitude=48.14, longitude=11.57, role=role,
+                                        enqueued_at=timezone.now() - datetime.timedelta(seconds=seconds_ago),
+                                        **fields)
+        return player
+
+    def test_nearby_players_share_a_new_match(self):
+        first = self.queue('first', seconds_ago=3)
+        hunter = self.queue('hunter', 'HU', seconds_ago=2)
+        hider = self.queue('hider', 'HI', seconds_ago=1)
+
+        matchmaking.run_cycle()
+
+        match = Match.objects.get()
+        self.assertEqual(match.host, 'first')
+        self.assertEqual((match.joined_players, match.joined_hunters, match.joined_hiders), (3, 1, 2))
+        self.assertEqual(dict(Player.objects.values_list('pk', 'role')),
+                         {first.pk: 'HI', hunter.pk: 'HU', hider.pk: 'HI'})
+        self.assertEqual(matchmaking.status(hunter.pk), 'first')
+        self.assertIsNone(MatchmakingEntry.objects.exclude(claim="").first())
+
+    def test_queued_players_join_an_open_match(self):
+        match = Match.objects.create(host='open', name='open', createdAtLocation=Point(11.5701, 48.1401),
+                                     numberOfHunters=1, numberOfHiders=1, joined_players=1, joined_hiders=1)
+        hunter = self.queue('hunter', 'HU')
+
+        matchmaking.run_cycle()
+
+        match.refresh_from_db()
+        self.assertEqual(Player.objects.get(pk=hunter.pk).match_id, match.pk)
+        self.assertEqual((match.joined_players, match.joined_hunters), (2, 1))
+        self.assertEqual(Match.objects.count(), 1)
+
+    def test_entries_claimed_elsewhere_or_already_placed_are_left_out(self):
+        claimed = self.queue('claimed', claim='other', claimed_until=timezone.now() + datetime.timedelta(minutes=1))
+        busy = self.queue('busy')
+        Player.objects.filter(pk=busy.pk).update(
+            match=Match.objects.create(host='somebody', name='elsewhere'))
+
+        matchmaking.run_cycle()
+
+        self.assertIsNone(Player.objects.get(pk=claimed.pk).match_id)
+        self.assertEqual(matchmaking.status(claimed.pk), 'queued')
+        self.assertIsNone(matchmaking.status(busy.pk))
+        self.assertEqual(Match.objects.count(), 1)
+
+
+class ClusteringTests(SimpleTestCase):
+    def setUp(self):
+        # two points in Munich, three in Berlin and one outside the box
+        points = [(1, Point(11.57, 48.14)), (2, Point(11.58, 48.15)),
+                  (3, Point(13.40, 52.52)), (4, Point(13.41, 52.51)), (5, Point(13.39, 52.53)),
+                  (6, Point(2.35, 48.86))]
+        patcher = mock.patch.dict(clustering.caches, {"matches": clustering.CoordinateCache(lambda: points)})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    @override_settings(CLUSTER_CELLS_PER_TILE=4, CLUSTER_SAMPLE_SIZE=2)
+    def test_points_in_one_cell_form_one_cluster(self):
+        clusters = clustering.clusters("matches", 5, 47, 5, 54, 15)
+
+        self.assertEqual(sorted(c["count"] for c in clusters), [2, 3])
+        berlin = next(c for c in clusters if c["count"] == 3)
+        self.assertAlmostEqual(berlin["latitude"], 52.52)
+        self.assertAlmostEqual(berlin["longitude"], 13.40)
+        self.assertEqual(len(berlin["ids"]), 2)
+        self.assertTrue(set(berlin["ids"]) <= {3, 4, 5})
+
+    def test_higher_zoom_splits_clusters(self):
+        clusters = clustering.clusters("matches", 14, 47, 5, 54, 15)
+        self.assertEqual(sum(c["count"] for c in clusters), 5)
+        self.assertEqual(len(clusters), 5)
+
+    def test_empty_box(self):
+        self.assertEqual(clustering.clusters("matches", 5, 0, 0, 1, 1), [])
+
+
+class PointInPolygonTests(SimpleTestCase):
+    def inside(self, polygon, points):
+        longitudes, latitudes = np.array(points, dtype=float).T
+        return geofence.points_in_polygon(latitudes, longitudes, polygon).tolist()
+
+    def test_inside_and_outside(self):
+        square = Polygon.from_bbox((0, 0, 1, 1))
+        self.assertEqual(self.inside(square, [(0.5, 0.5), (1.5, 0.5), (0.5, -0.5), (-0.1, 0.9)]),
+                         [True, False, False, False])
+
+    def test_concave_polygon(self):
+        # a U open to the top: the notch between the arms is outside
+        u = Polygon(((0, 0), (3, 0), (3, 3), (2, 3), (2, 1), (1, 1), (1, 3), (0, 3), (0, 0)))
+        self.assertEqual(self.inside(u, [(0.5, 2), (2.5, 2), (1.5, 2), (1.5, 0.5)]),
+                         [True, True, False, True])
+
+    def test_edges_are_half_open(self):
+        # like pixels, the left and bottom edges belong to the polygon and the
+        # right and top ones do not, so neighbouring areas never share a point
+        square = Polygon.from_bbox((0, 0, 1, 1))
+        self.assertEqual(self.inside(square, [(0, 0.5), (0.5, 0), (1, 0.5), (0.5, 1)]),
+                         [True, True, False, False])
+
+    def test_radius_and_polygon_together(self):
+        match = Match(createdAtLocation=Point(0.5, 0.5), play_area_radius=20000,
+                      play_area=Polygon.from_bbox((0, 0, 1, 1)))
+        latitudes, longitudes = np.array([0.5, 0.9, 1.5]), np.array([0.5, 0.9, 0.5])
+        self.assertEqual(geofence.inside_play_area(match, latitudes, longitudes).tolist(), [True, False, False])
+
+
+class TileCacheTests(SimpleTestCase):
+    def setUp(self):
+        self.builds = []
+
+        def build(zoom, x, y):
+            self.builds.append((zoom, x, y))
+            entities = {('match', 1)} if (x, y) == (0, 0) else {('player', 2)}
+            return f'{zoom}/{x}/{y}'.encode(), entities
+
+        patcher = mock.patch.object(tiles, '_build', build)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.cache = tiles.TileCache()
+
+    def test_tiles_are_built_once(self):
+        self.assertEqual(self.cache.get(1, 0, 0), b'1/0/0')
+        self.assertEqual(self.cache.get(1, 0, 0), b'1/0/0')
+        self.assertEqual(self.builds, [(1, 0, 0)])
+
+    def test_invalidation_drops_the_tiles_of_the_entity(self):
+        self.cache.get(1, 0, 0)
+        self.cache.get(1, 1, 0)
+
+        self.cache.invalidate('match', 1)
+        self.cache.get(1, 0, 0)
+        self.cache.get(1, 1, 0)
+        self.assertEqual(self.builds, [(1, 0, 0), (1, 1, 0), (1, 0, 0)])
+
+    def test_invalidation_drops_the_tile_of_the_new_position(self):
+        self.cache.get(1, 1, 0)
+
+        # a new match appearing in the north-east quarter of the world
+        self.cache.invalidate('match', 3, Point(90, 45))
+        self.cache.get(1, 1, 0)
+        self.assertEqual(self.builds, [(1, 1, 0), (1, 1, 0)])
+
+    @override_settings(TILE_CACHE_SIZE=2)
+    def test_least_recently_used_tile_is_evicted(self):
+        self.cache.get(1, 0, 0)
+        self.cache.get(1, 1, 0)
+        self.cache.get(1, 0, 0)
+        self.cache.get(1, 0, 1)
+        self.cache.get(1, 0, 0)
+        self.cache.get(1, 1, 0)
+        self.assertEqual(self.builds, [(1, 0, 0), (1, 1, 0), (1, 0, 1), (1, 1, 0)])
+
+
+class LoadSheddingTests(SimpleTestCase):
+    def setUp(self):
+        classes = {
+            'game': middleware.PriorityClass('game', limit=1),
+            'default': middleware.PriorityClass('default', limit=1),
+            'lobby': middleware.PriorityClass('lobby', limit=1, yields_to=['game']),
+        }
+        patcher = mock.patch.dict(middleware.priority_classes, classes, clear=True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.classes = classes
+        self.factory = RequestFactory()
+        self.shedding = middleware.LoadSheddingMiddleware(lambda request: HttpResponse('0: ok'))
+
+    def test_full_class_is_shed_with_retry_after(self):
+        self.assertTrue(self.classes['game'].try_acquire())
+
+        response = self.shedding(self.factory.get('/update_location/'))
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response['Retry-After'], str(settings.LOAD_SHEDDING_RETRY_AFTER_SECONDS))
+        self.assertEqual(self.classes['game'].metrics()['shed'], 1)
+
+        self.classes['game'].release()
+        self.assertEqual(self.shedding(self.factory.get('/update_location/')).status_code, 200)
+        self.assertEqual(self.classes['game'].metrics()['in_flight'], 0)
+
+    def test_lobby_yields_to_game(self):
+        self.assertEqual(self.shedding(self.factory.get('/get_players/')).status_code, 200)
+
+        self.assertTrue(self.classes['game'].try_acquire())
+        self.assertEqual(self.shedding(self.factory.get('/get_players/')).status_code, 503)
+        # routes without a priority fall into the default class, which does not yield
+        self.assertEqual(self.shedding(self.factory.get('/unknown_route/')).status_code, 200)
+        self.classes['game'].release()
+
+    def test_waiting_request_gets_the_released_slot(self):
+        self.assertTrue(self.classes['game'].try_acquire())
+        threading.Timer(0.05, self.classes['game'].release).start()
+
+        self.assertTrue(self.classes['game'].try_acquire(timeout=5))
+        self.assertGreater(self.classes['game'].metrics()['wait_seconds'], 0)
+        self.classes['game'].release()
+
+
+recorded_task_calls = []
+
+
+@tasks.task
+def record_task_call(*args, **kwargs):
+    recorded_task_calls.append((list(args), kwargs))
+
+
+class TaskJournalTests(SimpleTestCase):
+    def setUp(self):
+        recorded_task_calls.clear()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = f'{directory.name}/tasks.sqlite3'
+
+    def test_tasks_left_over_from_a_crash_are_replayed(self):
+        # what a process that crashed with two tasks queued leaves behind
+        journal = tasks.Journal(self.path)
+        journal.add(record_task_call.task_name, [1], {'match': 2})
+        journal.add('social_app.tasks.renamed_meanwhile', [], {})
+        journal.add(record_task_call.task_name, [3], {})
+        journal.connection.close()
+
+        executor = tasks.TaskExecutor(workers=1, max_queued=10, journal_path=self.path)
+        with self.assertLogs('social_app.tasks', 'ERROR'):
+            executor.start()
+        self.assertTrue(executor.drain(5))
+
+        self.assertEqual(recorded_task_calls, [([1], {'match': 2}), ([3], {})])
+        self.assertEqual(executor.journal.pending(), [])
+
+    def test_task_stays_journaled_until_it_has_run(self):
+        executor = tasks.TaskExecutor(workers=1, max_queued=10, journal_path=self.path)
+        started, release = threading.Event(), threading.Event()
+
+        @tasks.task
+        def blocking():
+            started.set()
+            release.wait(5)
+
+        executor.defer(blocking)
+        self.assertTrue(started.wait(5))
+        executor.defer(record_task_call, 'queued')
+        self.assertEqual([name for _, name, _, _ in executor.journal.pending()],
+                         [blocking.task_name, record_task_call.task_name])
+
+        release.set()
+        self.assertTrue(executor.drain(5))
+        self.assertEqual(executor.journal.pending(), [])
+        self.assertEqual(recorded_task_calls, [(['queued'], {})])
+
+
+class SharedStateTests(SimpleTestCase):
+    def setUp(self):
+        self.state = shared_state.MatchState(f'soc_group_2_test_{os.getpid()}_{id(self)}', 16)
+        self.assertTrue(self.state.enabled())
+        self.addCleanup(self.detach)
+
+    def detach(self):
+        self.state.table = None
+        self.state.memory.close()
+        # attaching unregistered the segment, which unlink() undoes again
+        resource_tracker.register(self.state.memory._name, 'shared_memory')
+        self.state.memory.unlink()
+        os.close(self.state.lock_file)
+        os.remove(os.path.join(tempfile.gettempdir(), f'{self.state.name}.lock'))
+
+    def player(self, pk, role='HI', **fields):
+        return Player(pk=pk, match_id=7, role=role, location=Point(2.5, 1.5), **fields)
+
+    def test_slot_round_trip(self):
+        self.state.put(self.player(3, is_invisible=True))
+        self.state.put(self.player(4, role='HU'))
+
+        rows = self.state.players(7, 'HI')
+        self.assertEqual(rows['player_id'].tolist(), [3])
+        self.assertEqual((rows['latitude'][0], rows['longitude'][0]), (1.5, 2.5))
+        self.assertEqual(rows['flags'][0], shared_state.INVISIBLE)
+        self.assertEqual(rows['seq'][0] % 2, 0)
+
+        self.state.set_flag([3], shared_state.CAUGHT, True)
+        self.assertEqual(self.state.players(7, 'HI')['flags'][0], shared_state.INVISIBLE | shared_state.CAUGHT)
+
+        self.state.remove(3)
+        self.assertEqual(len(self.state.players(7, 'HI')), 0)
+
+    def test_torn_slots_are_read_again(self):
+        self.state.put(self.player(3))
+        index = self.state._find(3)
+        # a writer of the slot that is halfway through
+        self.state.table['seq'][index] += 1
+        self.assertEqual(len(self.state.players(7, 'HI')), 0)
+        self.state.table['seq'][index] += 1
+        self.assertEqual(len(self.state.players(7, 'HI')), 1)
+
+    def test_stale_slot_is_ignored_and_reclaimed(self):
+        self.state.put(self.player(3))
+        index = self.state._find(3)
+        self.state.table['updated'][index] = time.time() - settings.SHARED_STATE_MAX_AGE_SECONDS - 1
+        self.assertEqual(len(self.state.players(7, 'HI')), 0)
+
+        # 19 has the same home slot as 3
+        self.state.put(self.player(19))
+        self.assertEqual(self.state._find(19), index)
+        self.assertEqual(self.state.players(7, 'HI')['player_id'].tolist(), [19])
+
+    def test_locations_fall_back_when_players_are_missing(self):
+        self.state.put(self.player(3))
+        match = Match(pk=7, has_started=True, joined_hiders=2)
+        with mock.patch.object(shared_state, 'state', self.state):
+            self.assertIsNone(shared_state.locations(match, 'HI'))
+            self.state.put(self.player(4, is_invisible=True))
+            self.assertEqual(len(shared_state.locations(match, 'HI')), 2)
+            self.assertEqual(shared_state.locations(match, 'HI', visible_only=True),
+                             [{"latitude": 1.5, "longitude": 2.5, "out_of_bounds": False}])
+
+
+@override_settings(SQLITE_SINGLE_WRITER=False)
+class GameActionsTests(TestCase):
+    def setUp(self):
+        match = Match.objects.create(host='hunter', name='batched', joined_players=2, joined_hunters=1,
+                                     joined_hiders=1)
+        self.hunter = Player.objects.create(user=User.objects.create(username='hunter'), match=match, role='HU')
+        self.hider = Player.objects.create(user=User.objects.create(username='hider'), match=match, role='HI')
+        self.client = Client()
+        self.client.force_login(self.hunter.user)
+
+    def post(self, *actions):
+        return self.client.post('/game_actions/', {'actions': actions}, content_type='application/json')
+
+    def test_batch_is_applied(self):
+        response = self.post(
+            {'action': 'become_ready'},
+            {'action': 'update_location', 'latitude': 48.14, 'longitude': 11.57},
+            {'action': 'catch_hider', 'username': 'hider'},
+            {'action': 'dance'},
+        )
+
+        self.assertEqual(response.json(), ["1: You're ready!", '1: Successfully updated location!',
+                                           '1: Player caught successfully', '0: Unknown action dance'])
+        self.hunter.refresh_from_db()
+        self.assertTrue(self.hunter.ready)
+        self.assertEqual(self.hunter.location.coords, (11.57, 48.14))
+        self.assertTrue(Player.objects.get(pk=self.hider.pk).is_caught)
+        self.assertTrue(MatchEvent.objects.filter(match=self.hunter.match, kind='catch').exists())
+
+    def test_bad_action_rolls_back_the_batch(self):
+        with self.assertRaises(KeyError):
+            self.post(
+                {'action': 'catch_hider', 'username': 'hider'},
+                {'action': 'become_ready'},
+                {'action': 'update_location', 'latitude': 48.14},
+            )
+
+        self.hunter.refresh_from_db()
+        self.assertFalse(self.hunter.ready)
+        self.assertIsNone(self.hunter.location)
+        self.assertFalse(Player.objects.get(pk=self.hider.pk).is_caught)
+        self.assertFalse(MatchEvent.objects.exists())
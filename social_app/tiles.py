@@ -0,0 +1,132 @@
+import json
+import threading
+import time
+from collections import Counter, OrderedDict, defaultdict
+
+from django.conf import settings
+from django.contrib.gis.geos import Polygon
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .geo import tile_bounds, tile_xy
+from .models import Player, Match
+from .signals import phase_changed, slots_changed
+
+# Slippy-map tiles of lobby map data. The matches and players inside a tile
+# are encoded once and kept in an LRU of TILE_CACHE_SIZE tiles, so clients
+# panning over the same area share one query instead of each running its own
+# radius scan. The cache remembers which tiles every match and player appears
+# in; when one changes, exactly those tiles and the tiles covering its new
+# position are dropped.
+#
+# Changes made by other processes only show up once a tile is older than
+# TILE_MAX_AGE_SECONDS.
+
+
+def _build(zoom, x, y):
+    box = Polygon.from_bbox(tile_bounds(zoom, x, y))
+    matches = [
+        {
+            "id": pk,
+            "name": name,
+            "host": host,
+            "latitude": location.y,
+            "longitude": location.x,
+            "has_started": has_started,
+            "number_of_joined_players": joined_players,
+            "number_of_hunters": number_of_hunters,
+            "number_of_hiders": number_of_hiders,
+        }
+        for pk, name, host, location, has_started, joined_players, number_of_hunters, number_of_hiders
+        in Match.objects.filter(createdAtLocation__contained=box).values_list(
+            'pk', 'name', 'host', 'createdAtLocation', 'has_started', 'joined_players',
+            'numberOfHunters', 'numberOfHiders')
+    ]
+    players = [
+        {
+            "id": pk,
+            "username": username,
+            "latitude": location.y,
+            "longitude": location.x,
+        }
+        for pk, username, location
+        in Player.objects.filter(location__contained=box).values_list('pk', 'user__username', 'location')
+    ]
+    payload = json.dumps({"matches": matches, "players": players}).encode()
+    entities = {('match', m["id"]) for m in matches} | {('player', p["id"]) for p in players}
+    return payload, entities
+
+
+class TileCache:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.tiles = OrderedDict()
+        self.tiles_of = defaultdict(set)
+        self.zooms = Counter()
+
+    def get(self, zoom, x, y):
+        key = (zoom, x, y)
+        with self.lock:
+            cached = self.tiles.get(key)
+            if cached is not None and time.monotonic() - cached[0] <= settings.TILE_MAX_AGE_SECONDS:
+                self.tiles.move_to_end(key)
+                return cached[1]
+
+        payload, entities = _build(zoom, x, y)
+        with self.lock:
+            self._drop(key)
+            self.tiles[key] = (time.monotonic(), payload, entities)
+            self.zooms[zoom] += 1
+            for entity in entities:
+                self.tiles_of[entity].add(key)
+            while len(self.tiles) > settings.TILE_CACHE_SIZE:
+                self._drop(next(iter(self.tiles)))
+        return payload
+
+    def _drop(self, key):
+        cached = self.tiles.pop(key, None)
+        if cached is None:
+            return
+        self.zooms[key[0]] -= 1
+        if not self.zooms[key[0]]:
+            del self.zooms[key[0]]
+        for entity in cached[2]:
+            self.tiles_of[entity].discard(key)
+            if not self.tiles_of[entity]:
+                del self.tiles_of[entity]
+
+    # drops the tiles the entity was in, and those covering its new position
+    def invalidate(self, kind, pk, location=None):
+        with self.lock:
+            for key in list(self.tiles_of.get((kind, pk), ())):
+                self._drop(key)
+            if location is not None:
+                for zoom in list(self.zooms):
+                    x, y = tile_xy(location.y, location.x, zoom)
+                    self._drop((zoom, int(x), int(y)))
+
+
+cache = TileCache()
+
+
+@receiver(post_save, sender=Match)
+@receiver(post_delete, sender=Match)
+def match_changed(sender, instance, **kwargs):
+    cache.invalidate('match', instance.pk, instance.createdAtLocation)
+
+
+@receiver(slots_changed)
+def match_slots_changed(sender, match_ids, **kwargs):
+    for match_id in match_ids:
+        cache.invalidate('match', match_id)
+
+
+@receiver(phase_changed)
+def match_phase_changed(sender, match_id, phase, **kwargs):
+    cache.invalidate('match', match_id)
+
+
+@receiver(post_save, sender=Player)
+@receiver(post_delete, sender=Player)
+def player_changed(sender, instance, **kwargs):
+    cache.invalidate('player', instance.pk, instance.location)
@@ -0,0 +1,121 @@
+import threading
+import time
+import zlib
+
+import numpy as np
+from django.conf import settings
+from django.dispatch import receiver
+
+from .models import TrailBlock
+from .scheduler import scheduler
+from .signals import phase_changed
+
+# Append-only store of every location fix players send during a match.
+#
+# Fixes are buffered per (match, player) and written as TrailBlock rows of up
+# to TRAIL_BLOCK_SIZE fixes each. A block holds three int32 arrays - the time
+# in milliseconds since the block start and the latitude and longitude in
+# 1e-7 degrees - each delta-encoded and zlib-compressed together, which keeps
+# a fix at a few bytes instead of a whole row.
+
+COORDINATE_SCALE = 10 ** 7
+
+
+def encode_block(times_ms, latitudes, longitudes):
+    start_ms = int(times_ms[0])
+    columns = np.stack([
+        np.asarray(times_ms, dtype=np.int64) - start_ms,
+        np.round(np.asarray(latitudes) * COORDINATE_SCALE),
+        np.round(np.asarray(longitudes) * COORDINATE_SCALE),
+    ]).astype(np.int32)
+    deltas = np.diff(columns, axis=1, prepend=0).astype('<i4')
+    return start_ms, zlib.compress(deltas.tobytes())
+
+
+# gives back (times_ms, latitudes, longitudes) of a block
+def decode_block(start_ms, count, data):
+    deltas = np.frombuffer(zlib.decompress(data), dtype='<i4').reshape(3, count)
+    # summed in int32, so that deltas which wrapped around when encoded (e.g.
+    # crossing the antimeridian) wrap back
+    columns = np.cumsum(deltas, axis=1, dtype=np.int32)
+    return columns[0].astype(np.int64) + start_ms, columns[1] / COORDINATE_SCALE, columns[2] / COORDINATE_SCALE
+
+
+class TrailStore:
+    def __init__(self):
+        self._buffers = {}
+        self._lock = threading.Lock()
+        self._flushing = False
+
+    def record(self, match_id, player_id, location, time_ms=None):
+        if time_ms is None:
+            time_ms = int(time.time() * 1000)
+        with self._lock:
+            buffer = self._buffers.setdefault((match_id, player_id), [])
+            buffer.append((time_ms, location.y, location.x))
+            full = len(buffer) >= settings.TRAIL_BLOCK_SIZE
+            self._start_periodic_flush()
+        if full:
+            self._write(self._take(lambda key: key == (match_id, player_id)))
+
+    def flush_match(self, match_id):
+        self._write(self._take(lambda key: key[0] == match_id))
+
+    def flush_all(self):
+        self._write(self._take(lambda key: True))
+
+    # lazily yields (player_id, time_ms, latitude, longitude) of the fixes of
+    # a match, optionally narrowed down to a player and a time window given
+    # in milliseconds since the epoch; blocks are only decoded when reached
+    def read(self, match_id, player_id=None, start_ms=None, end_ms=None):
+        self.flush_match(match_id)
+
+        blocks = TrailBlock.objects.filter(match_id=match_id)
+        if player_id is not None:
+            blocks = blocks.filter(player_id=player_id)
+        if start_ms is not None:
+            blocks = blocks.filter(end_ms__gte=start_ms)
+        if end_ms is not None:
+            blocks = blocks.filter(start_ms__lte=end_ms)
+
+        blocks = blocks.order_by('player_id', 'start_ms').values_list('player_id', 'start_ms', 'count', 'data')
+        for player, block_start_ms, count, data in blocks.iterator(chunk_size=100):
+            times_ms, latitudes, longitudes = decode_block(block_start_ms, count, bytes(data))
+            keep = np.ones(count, dtype=bool)
+            if start_ms is not None:
+                keep &= times_ms >= start_ms
+            if end_ms is not None:
+                keep &= times_ms <= end_ms
+            for time_ms, latitude, longitude in zip(times_ms[keep], latitudes[keep], longitudes[keep]):
+                yield player, int(time_ms), float(latitude), float(longitude)
+
+    def _take(self, wanted):
+        with self._lock:
+            keys = [key for key in self._buffers if wanted(key)]
+            return {key: self._buffers.pop(key) for key in keys}
+
+    def _write(self, buffers):
+        blocks = []
+        for (match_id, player_id), fixes in buffers.items():
+            for i in range(0, len(fixes), settings.TRAIL_BLOCK_SIZE):
+                times_ms, latitudes, longitudes = zip(*fixes[i:i + settings.TRAIL_BLOCK_SIZE])
+                start_ms, data = encode_block(times_ms, latitudes, longitudes)
+                blocks.append(TrailBlock(match_id=match_id, player_id=player_id, start_ms=start_ms,
+                                         end_ms=times_ms[-1], count=len(times_ms), data=data))
+        if blocks:
+            TrailBlock.objects.bulk_create(blocks)
+
+    # buffered fixes of slow movers are written out every TRAIL_FLUSH_SECONDS
+    def _start_periodic_flush(self):
+        if not self._flushing:
+            self._flushing = True
+            scheduler.call_every(settings.TRAIL_FLUSH_SECONDS, lambda _: self.flush_all(), key='trails')
+
+
+store = TrailStore()
+
+
+@receiver(phase_changed)
+def flush_ended_match(sender, match_id, phase, **kwargs):
+    if phase == 'ended':
+        store.flush_match(match_id)
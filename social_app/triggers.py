@@ -0,0 +1,124 @@
+import math
+import threading
+
+from django.conf import settings
+from django.dispatch import receiver
+
+from . import events
+from .geo import METERS_PER_DEGREE, local_distance_m, random_point_near
+from .models import Object
+from .signals import phase_changed
+
+# Trap and loot triggers. When a match starts, its objects are loaded into an
+# in-memory grid whose cells are one trigger radius wide, so every location
+# update only has to look at the objects in the 3x3 cells around the player.
+# An object triggers once for the first player who comes close enough and
+# is then removed from the match.
+#
+# Every worker process keeps its own grids, so several processes may find
+# the same object. Each object is claimed by deleting its row, and only the
+# process whose DELETE removed it publishes the trigger.
+
+
+class ObjectGrid:
+    def __init__(self, cell_size_m):
+        self.cell_size = cell_size_m / METERS_PER_DEGREE
+        self.cells = {}
+
+    def _cell(self, latitude, longitude):
+        return math.floor(latitude / self.cell_size), math.floor(longitude / self.cell_size)
+
+    def add(self, object_id, type, latitude, longitude):
+        self.cells.setdefault(self._cell(latitude, longitude), []).append((object_id, type, latitude, longitude))
+
+    # removes and returns the objects within radius_m meters of the location
+    def pop_near(self, latitude, longitude, radius_m):
+        row, column = self._cell(latitude, longitude)
+        # a degree of longitude shrinks towards the poles, so more columns may
+        # be needed to cover the radius
+        column_span = math.ceil(1 / max(math.cos(math.radians(latitude)), 0.01))
+
+        found = []
+        for cell_row in range(row - 1, row + 2):
+            for cell_column in range(column - column_span, column + column_span + 1):
+                cell = self.cells.get((cell_row, cell_column))
+                if not cell:
+                    continue
+                near = [o for o in cell if local_distance_m(latitude, longitude, o[2], o[3]) <= radius_m]
+                if near:
+                    found.extend(near)
+                    cell[:] = [o for o in cell if o not in near]
+        return found
+
+    def __len__(self):
+        return sum(len(cell) for cell in self.cells.values())
+
+
+_grids = {}
+_lock = threading.Lock()
+
+
+def load_match(match_id):
+    grid = ObjectGrid(settings.OBJECT_TRIGGER_RADIUS_M)
+    for object_id, type, location in Object.objects.filter(match_id=match_id, location__isnull=False) \
+            .values_list('id', 'type', 'location'):
+        grid.add(object_id, type, location.y, location.x)
+    with _lock:
+        _grids[match_id] = grid
+    return grid
+
+
+def unload_match(match_id):
+    with _lock:
+        _grids.pop(match_id, None)
+
+
+@receiver(phase_changed)
+def follow_match_phase(sender, match_id, phase, **kwargs):
+    if phase == 'hiding':
+        load_match(match_id)
+    elif phase == 'ended':
+        unload_match(match_id)
+
+
+# tests a new location fix of a player against the objects of its match and
+# returns the trigger events it caused
+def check_location(player, location):
+    if player.match_id is None:
+        return []
+
+    grid = _grids.get(player.match_id)
+    if grid is None:
+        # the match may have been started by another process
+        if not player.match.has_started or player.match.phase == 'ended':
+            return []
+        grid = load_match(player.match_id)
+
+    with _lock:
+        triggered = grid.pop_near(location.y, location.x, settings.OBJECT_TRIGGER_RADIUS_M)
+    if not triggered:
+        return []
+
+    return [
+        events.publish(player.match_id, 'trigger', object_id=object_id, type=type,
+                       username=player.user.username, latitude=latitude, longitude=longitude)
+        for object_id, type, latitude, longitude in triggered
+        if Object.objects.filter(id=object_id).delete()[0] == 1
+    ]
+
+
+# seeds traps and loot at random around the place the match was created at,
+# all in one INSERT
+def place_objects(match, number_of_traps, number_of_loot, radius_m):
+    types = ['T'] * number_of_traps + ['L'] * number_of_loot
+    objects = Object.objects.bulk_create([
+        Object(match=match, type=type, location=random_point_near(match.createdAtLocation, radius_m))
+        for type in types
+    ])
+
+    grid = _grids.get(match.id)
+    if grid is not None:
+        with _lock:
+            for o in objects:
+                grid.add(o.id, o.type, o.location.y, o.location.x)
+    return objects
@@ -10,14 +10,20 @@ urlpatterns = [
     path('login/', views.signin),
     path('logout/', views.signout),
     path('check_auth/', views.check_auth),
+    path('get_load_metrics/', views.get_load_metrics),
 
     path('get_players/', views.get_players),
     path('get_players_nearby/<str:radius>/', views.get_players_nearby),
     path('get_player_by_username/<str:username>/', views.get_player_by_username),
+    path('get_friend_suggestions/', views.get_friend_suggestions),
+    path('get_clusters/<str:kind>/<int:zoom>/<str:bbox>/', views.get_clusters),
+    path('tiles/<int:z>/<int:x>/<int:y>/', views.get_tile),
 
     path('get_friends/', views.get_friends),
     path('send_friendship_request/<str:username>/', views.send_friendship_request),
+    path('send_friendship_requests/', views.send_friendship_requests),
     path('respond_friendship_request/', views.respond_friendship_request),
+    path('respond_all_friendship_requests/', views.respond_all_friendship_requests),
     path('get_friendship_requests/', views.get_friendship_requests),
     path('remove_friend/', views.remove_friend),
 
@@ -29,13 +35,19 @@ urlpatterns = [
     path('get_matches_of_friends/', views.get_matches_of_friends),
     path('host_match/', views.host_match),
     path('join_match/', views.join_match),
+    path('enqueue_matchmaking/', views.enqueue_matchmaking),
+    path('leave_matchmaking/', views.leave_matchmaking),
+    path('get_matchmaking_status/', views.get_matchmaking_status),
+    path('place_objects/', views.place_objects),
     path('start_match/', views.start_match),
     path('get_players_in_current_match/', views.get_players_in_current_match),
     path('get_match/', views.get_match),
     path('end_match/', views.end_match),
+    path('export_match/<int:match_id>/', views.export_match),
     path('exit_match/', views.exit_match),
     path('match_ended/', views.match_ended),
     path('match_started/', views.match_started),
+    path('get_match_events/<str:since>/', views.get_match_events),
     path('become_ready/', views.become_ready),
     path('become_unready/', views.become_unready),
     path('all_ready/', views.all_ready),
@@ -47,6 +59,8 @@ urlpatterns = [
     path('get_hiders_locations/', views.get_hiders_locations),
     path('get_hunters_locations/', views.get_hunters_locations),
     path('get_server_time/', views.get_server_time),
+    path('clock_sync/', views.clock_sync),
+    path('get_hints/', views.get_hints),
 
     path('check_if_caught/', views.check_if_caught),
     path('catch_hider/<str:caught_player_username>/', views.catch_hider),
@@ -56,6 +70,7 @@ urlpatterns = [
 
     path('become_invisible/', views.become_invisible),
     path('become_visible/', views.become_visible),
+    path('game_actions/', views.game_actions),
 
     path('update_experience_with_friends/<str:experience>/', views.update_experience_with_friends),
     path('clear_player/', views.clear_player),
@@ -63,3 +78,52 @@ urlpatterns = [
     path('all_loaded/', views.all_loaded),
 
 ]
+
+# Priority class of every route, by its first path segment, for the load
+# shedding in social_app/middleware.py. Routes not listed here are in the
+# LOAD_SHEDDING_DEFAULT_CLASS.
+#  - game: latency critical calls of running matches
+#  - poll: cheap reads which clients repeat at a fixed interval, like the
+#    match events
+#  - lobby: listings and map data, shed first under overload
+ROUTE_PRIORITIES = {
+    'update_location': 'game',
+    'get_hiders_locations': 'game',
+    'get_hunters_locations': 'game',
+    'get_server_time': 'game',
+    'clock_sync': 'game',
+    'get_hints': 'game',
+    'check_if_caught': 'game',
+    'catch_hider': 'game',
+    'check_if_hider_nearby': 'game',
+    'check_if_match_suddenly_ended': 'game',
+    'become_invisible': 'game',
+    'become_visible': 'game',
+    'game_actions': 'game',
+    'match_ended': 'game',
+
+    'get_match_events': 'poll',
+    'get_load_metrics': 'poll',
+
+    'get_players': 'lobby',
+    'get_players_nearby': 'lobby',
+    'get_player_by_username': 'lobby',
+    'get_friend_suggestions': 'lobby',
+    'get_clusters': 'lobby',
+    'tiles': 'lobby',
+    'get_friends': 'lobby',
+    'get_friendship_requests': 'lobby',
+    'get_matches': 'lobby',
+    'get_matches_nearby': 'lobby',
+    'get_matches_of_friends': 'lobby',
+    'export_match': 'lobby',
+}
+
+# Routes whose responses carry a recommended poll interval, see
+# social_app/polling.py.
+MATCH_ROUTES = {
+    'update_location', 'get_match', 'get_players_in_current_match', 'match_started', 'match_ended',
+    'all_ready', 'all_loaded', 'get_match_events', 'get_hiders_locations', 'get_hunters_locations',
+    'get_hints', 'check_if_caught', 'catch_hider', 'check_if_hider_nearby', 'check_if_match_suddenly_ended',
+    'get_matchmaking_status', 'game_actions',
+}
@@ -1,11 +1,17 @@
 import json
+import time
 
 from django.contrib.auth.models import User
-from django.contrib.gis.geos import Point
+from django.contrib.gis.geos import Point, Polygon
+from django.db import transaction
 from django.db.models import Q
-from django.http import HttpResponse, JsonResponse
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
 
-from .models import Player, Friendship, Match, FriendshipRequest
+from .models import Player, Friendship, Match, FriendshipRequest, Clue, MatchArchive, FriendSuggestions
+from . import (archive, clustering, events, geofence, lobby, matchmaking, middleware, phases, shared_state,
+               suggestions, tasks, tiles, trails, triggers)
+from .writer import writes
+from django.conf import settings
 from django.contrib.auth import login, authenticate, logout
 from django.contrib.auth.forms import UserCreationForm
 from geopy.distance import distance, Distance
@@ -123,6 +129,54 @@ def get_players_nearby(request,radius):
     ]
     return JsonResponse(players, safe=False)
 
+# clustered matches or players for a zoomed out map; bbox is
+# "min_latitude,min_longitude,max_latitude,max_longitude"
+def get_clusters(request, kind, zoom, bbox):
+    if not request.user.is_authenticated:
+        return HttpResponse(f'User not signed in')
+
+    if kind not in clustering.caches:
+        return HttpResponse(f'0: Unknown kind {kind}')
+    if zoom > settings.CLUSTER_MAX_ZOOM:
+        return HttpResponse(f'0: Zoom level too high, request the listing instead')
+
+    min_latitude, min_longitude, max_latitude, max_longitude = (float(c) for c in bbox.split(','))
+    clusters = clustering.clusters(kind, zoom, min_latitude, min_longitude, max_latitude, max_longitude)
+    return JsonResponse(clusters, safe=False)
+
+# the matches and players inside slippy-map tile z/x/y
+def get_tile(request, z, x, y):
+    if not request.user.is_authenticated:
+        return HttpResponse(f'User not signed in')
+
+    if z < settings.TILE_MIN_ZOOM:
+        return HttpResponse(f'0: Zoom level too low, request clusters instead')
+    if not (0 <= x < 2 ** z and 0 <= y < 2 ** z):
+        return HttpResponse(f'0: No such tile')
+
+    return HttpResponse(tiles.cache.get(z, x, y), content_type='application/json')
+
+# in-flight, waiting and shed request counters of the load shedding
+# middleware in this process, for staff only
+def get_load_metrics(request):
+    if not request.user.is_authenticated:
+        return HttpResponse(f'User not signed in!')
+    if not request.user.is_staff:
+        return HttpResponse('1: Not allowed', status=403)
+    return JsonResponse(middleware.load_metrics())
+
+# ranked friend suggestions, precomputed in the background by suggestions.py
+def get_friend_suggestions(request):
+    if not request.user.is_authenticated:
+        return HttpResponse(f'User not signed in')
+
+    candidates = FriendSuggestions.objects.filter(player=request.user.pk).values_list('candidates', flat=True).first()
+    if candidates is None:
+        # not computed yet, the next refresh will pick the player up
+        suggestions.mark_dirty(request.user.pk)
+        candidates = []
+    return JsonResponse(candidates, safe=False)
+
 def get_player_by_username(request, username):
     if not request.user.is_authenticated:
         return HttpResponse(f'User not signed in')
@@ -154,10 +208,28 @@ def update_location(request):
 
     player = request.user.player
     player.location = Point(longitude, latitude)
-    player.save()
+    player.last_seen = timezone.now()
+    writes.run(Player.objects.filter(pk=player.pk).update, location=player.location, last_seen=player.last_seen)
+    after_location_update(player)
+    suggestions.mark_dirty(player.pk)
 
     return HttpResponse("1: Successfully updated location!")
 
+# the in-game side effects of a new location fix, shared with the async
+# update_location in async_views.py
+def after_location_update(player):
+    tiles.cache.invalidate('player', player.pk, player.location)
+    # trap and loot triggers are published to the match's events
+    triggers.check_location(player, player.location)
+    if player.match_id is not None:
+        left, returned = geofence.enforce(player.match)
+        if player.pk in left or player.pk in returned:
+            player.is_out_of_bounds = player.pk in left
+        if player.match.has_started:
+            trails.store.record(player.match_id, player.pk, player.location)
+    # after the geofence, so that the slot gets the player's current flags
+    shared_state.state.put(player)
+
 def get_friends(request):
     if not request.user.is_authenticated:
         return HttpResponse(f'User not signed in')
@@ -242,6 +314,66 @@ def respond_friendship_request(request):
             duplicate_request.delete()
         return HttpResponse("1: Friendship request declined successfully", status=200)
 
+# sends friendship requests to all usernames in the list at once, e.g. for a
+# contact import
+def send_friendship_requests(request):
+    if not request.user.is_authenticated:
+        return HttpResponse(f'user not signed in')
+    if not hasattr(request.user, 'player'):
+        return HttpResponse(f'user is not a player')
+
+    data = json.loads(request.body)
+    usernames = set(data['usernames']) - {request.user.username}
+    player = request.user.player
+
+    recipients = dict(Player.objects.filter(user__username__in=usernames).values_list('user__username', 'pk'))
+    befriended = {pk for pair in Friendship.of(player).filter(Q(player__in=recipients.values()) |
+                                                              Q(friend__in=recipients.values()))
+                  .values_list('player', 'friend') for pk in pair}
+    already_requested = set(FriendshipRequest.objects.filter(requester=player, recipient__in=recipients.values())
+                            .values_list('recipient', flat=True))
+
+    to_send = {username: pk for username, pk in recipients.items()
+               if pk not in befriended and pk not in already_requested}
+    FriendshipRequest.objects.bulk_create([FriendshipRequest(requester=player, recipient_id=pk)
+                                           for pk in to_send.values()], ignore_conflicts=True)
+    suggestions.mark_dirty(player.pk, *to_send.values())
+
+    return JsonResponse({
+        "sent": sorted(to_send),
+        "already_friends": sorted(u for u, pk in recipients.items() if pk in befriended),
+        "already_sent": sorted(u for u, pk in recipients.items() if pk in already_requested and pk not in befriended),
+        "not_found": sorted(usernames - set(recipients)),
+    })
+
+# accepts or declines all pending friendship requests of the player at once
+def respond_all_friendship_requests(request):
+    if not request.user.is_authenticated:
+        return HttpResponse(f'user not signed in')
+    if not hasattr(request.user, 'player'):
+        return HttpResponse(f'user is not a player')
+
+    data = json.loads(request.body)
+    response = data['response']
+    player = request.user.player
+
+    requesters = list(FriendshipRequest.objects.filter(recipient=player).values_list('requester', flat=True))
+    if not requesters:
+        return HttpResponse("0: No requests", status=200)
+
+    if response:
+        pairs = [tuple(sorted((player.pk, requester))) for requester in requesters]
+        Friendship.objects.bulk_create([Friendship(player_id=low, friend_id=high) for low, high in pairs],
+                                       ignore_conflicts=True)
+        suggestions.friendships_changed(pairs)
+    # requests the player sent to the same people are settled as well
+    FriendshipRequest.objects.filter(Q(recipient=player, requester__in=requesters) |
+                                     Q(requester=player, recipient__in=requesters)).delete()
+
+    if response:
+        return HttpResponse(f"1: Accepted {len(requesters)} friendship requests", status=200)
+    return HttpResponse(f"1: Declined {len(requesters)} friendship requests", status=200)
+
 def get_friendship_requests(request):
     # Commented for testing purposes
     # if not request.user.is_authenticated:
@@ -266,9 +398,11 @@ def remove_friend(request):
     data = json.loads(request.body)
     friend_to_remove = data['friend_to_remove']
 
-    friend = Player.objects.get(id=friend_to_remove)
-    friendship = Friendship.objects.get(player=request.user.player, friend=friend)
-    friendship.delete()
+    try:
+        friend = Player.objects.get(pk=friend_to_remove)
+    except (Player.DoesNotExist, ValueError):
+        return HttpResponse('0: Player not found')
+    Friendship.between(request.user.player, friend).delete()
 
     return HttpResponse("1: Successfully removed this friend")
 
@@ -303,27 +437,11 @@ def get_matches_nearby(request, radius):
     if not request.user.is_authenticated:
         return HttpResponse(f'user not signed in')
 
-    radius.replace(',', '.')
-    matches = [
-        {
-            "name": match.name,
-            "host": match.host,
-            "latitude": match.createdAtLocation.y,
-            "longitude": match.createdAtLocation.x,
-            "duration": match.duration,
-            "hiding_duration": match.hiding_duration,
-            "hint_interval_duration": match.hint_interval_duration,
-            "distance": distance(request.user.player.location, match.createdAtLocation).kilometers,
-            "number_of_joined_players": match.player_set.count(),
-            "number_of_hunters": match.numberOfHunters,
-            "number_of_hiders": match.numberOfHiders,
-            "number_of_joined_hunters": Player.objects.filter(match=match, role='HU').count(),
-            "number_of_joined_hiders": Player.objects.filter(match=match, role='HI').count()
-        }
-        for match in Match.objects.all() if distance(request.user.player.location, match.createdAtLocation).kilometers < float(radius)
-                                            and match.has_started is False and match.is_full() is False
-    ]
-    return JsonResponse(matches, safe=False)
+    radius = float(radius.replace(',', '.'))
+    location = request.user.player.location
+    if location is None:
+        return JsonResponse([], safe=False)
+    return HttpResponse(lobby.snapshot.nearby(location.y, location.x, radius), content_type='application/json')
 
 def get_matches_of_friends(request):
     if not request.user.is_authenticated:
@@ -367,6 +485,9 @@ def host_match(request):
 
     player = request.user.player
 
+    if player.match is not None:
+        player.release_match_slots()
+
     if player.match is not None and player.match.host is player.user.username:
         match = Match.objects.get(host=request.user.username)
         match.delete()
@@ -380,12 +501,49 @@ def host_match(request):
     match.hint_interval_duration = hint_interval_duration
     match.numberOfHiders = number_of_hiders
     match.numberOfHunters = number_of_hunters
+    # optional play area, as a radius in meters and/or a list of
+    # [latitude, longitude] corners
+    if data.get('play_area_radius') is not None:
+        match.play_area_radius = float(data['play_area_radius'])
+    if data.get('play_area'):
+        corners = [(float(lon), float(lat)) for lat, lon in data['play_area']]
+        match.play_area = Polygon(corners + corners[:1])
+    # the host takes the first player slot
+    match.joined_players = 1
     match.save()
     player.match = match
+    player.role = None
+    player.last_seen = timezone.now()
     player.save()
     return HttpResponse(f'1: Created match')
 
 
+# lets the host scatter traps and loot around the match location before
+# the match starts
+def place_objects(request):
+    if not request.user.is_authenticated:
+        return HttpResponse(f'user not signed in')
+
+    match = request.user.player.match
+    if match is None or match.host != request.user.username:
+        return HttpResponse(f'0: Not a host')
+    if match.has_started:
+        return HttpResponse(f'0: Match has already started')
+
+    data = json.loads(request.body)
+    number_of_traps = int(data['number_of_traps'])
+    number_of_loot = int(data['number_of_loot'])
+    radius = float(data['radius'])
+    if number_of_traps < 0 or number_of_loot < 0:
+        return HttpResponse(f'0: Number of objects must not be negative')
+    if not 0 <= radius <= settings.OBJECT_MAX_RADIUS_M:
+        return HttpResponse(f'0: Radius must be between 0 and {settings.OBJECT_MAX_RADIUS_M} meters')
+    if match.object_set.count() + number_of_traps + number_of_loot > settings.OBJECT_MAX_PER_MATCH:
+        return HttpResponse(f'0: A match can have at most {settings.OBJECT_MAX_PER_MATCH} objects')
+
+    objects = triggers.place_objects(match, number_of_traps, number_of_loot, radius)
+    return HttpResponse(f'1: Placed {len(objects)} objects')
+
 def join_match(request):
     if not request.user.is_authenticated:
         return HttpResponse(f'user not signed in')
@@ -395,16 +553,71 @@ def join_match(request):
     host_name = request.POST['hostname']
     hostPlayer = Player.objects.get(user__username=host_name)
 
-    if hostPlayer.match is not None:
-        if hostPlayer.match.is_full():
-            return HttpResponse(f"0: Match is full")
-        else:
-            request.user.player.match = Match.objects.get(host=host_name)
-            request.user.player.save()
-            return HttpResponse(f'1: Joined match')
-    else:
+    if hostPlayer.match is None:
         return HttpResponse(f'0: No match with host {host_name} exists')
 
+    player = request.user.player
+    match = hostPlayer.match
+    if player.match_id == match.id:
+        return HttpResponse(f'1: Joined match')
+
+    # the slot is claimed first and given back if the player row changed
+    # underneath us (e.g. the same player joining twice at once)
+    if not match.claim_slot():
+        return HttpResponse(f"0: Match is full")
+    joined = Player.objects.filter(pk=player.pk, match=player.match_id).update(match=match, role=None,
+                                                                              last_seen=timezone.now())
+    if not joined:
+        match.release_slot()
+        return HttpResponse(f'0: Could not join match')
+    Match.objects.filter(pk=match.pk).update(last_activity=timezone.now())
+
+    player.release_match_slots()
+    player.match = match
+    player.role = None
+    shared_state.state.put(player)
+    return HttpResponse(f'1: Joined match')
+
+# queues the player for automatic matchmaking; role is "HU", "HI" or
+# missing for either
+def enqueue_matchmaking(request):
+    if not request.user.is_authenticated:
+        return HttpResponse(f'user not signed in')
+    if request.method != 'POST':
+        return HttpResponse(f'incorrect request method.')
+
+    data = json.loads(request.body)
+    latitude = float(data['latitude'])
+    longitude = float(data['longitude'])
+    role = data.get('role')
+    if role not in (None, "HU", "HI"):
+        return HttpResponse(f'0: Unknown role {role}')
+
+    if request.user.player.match is not None:
+        return HttpResponse(f'0: Already in a match')
+
+    matchmaking.enqueue(request.user.pk, latitude, longitude, role)
+    return HttpResponse(f'1: Queued for matchmaking')
+
+def leave_matchmaking(request):
+    if not request.user.is_authenticated:
+        return HttpResponse(f'user not signed in')
+
+    if not matchmaking.dequeue(request.user.pk):
+        return HttpResponse(f'0: Not queued')
+    return HttpResponse(f'1: Left matchmaking')
+
+def get_matchmaking_status(request):
+    if not request.user.is_authenticated:
+        return HttpResponse(f'user not signed in')
+
+    status = matchmaking.status(request.user.pk)
+    if status is None:
+        return HttpResponse(f'0: Not queued')
+    if status == 'queued':
+        return HttpResponse(f'0: Waiting for a match')
+    return HttpResponse(f'1: Joined match of {status}')
+
 def become_ready(request):
     if not request.user.is_authenticated:
         return HttpResponse(f'user not signed in')
@@ -413,7 +626,7 @@ def become_ready(request):
         return HttpResponse(f"0: No active match")
 
     request.user.player.ready = True
-    request.user.player.save()
+    writes.run(Player.objects.filter(pk=request.user.player.pk).update, ready=True)
     return HttpResponse(f"1: You're ready!")
 
 def become_unready(request):
@@ -435,6 +648,7 @@ def exit_match(request):
     if request.user.player.match is None:
         return HttpResponse(f"0: No active match")
     else:
+        request.user.player.release_match_slots()
         request.user.player.role = None
         match = request.user.player.match
         request.user.player.match = None
@@ -442,9 +656,12 @@ def exit_match(request):
         request.user.player.is_caught = False
         request.user.player.is_invisible = False
         request.user.player.is_loaded = False
+        request.user.player.is_out_of_bounds = False
         request.user.player.save()
-        if match.player_set.count() == 0:
-            match.delete()
+        if not match.player_set.exists():
+            # the cascade runs in the background; it checks again that
+            # nobody joined in the meantime
+            tasks.background.defer(tasks.delete_match, match.pk, max_players=0)
             return HttpResponse('1: Exited and ended match')
 
         return HttpResponse(f'1: Exited match')
@@ -460,7 +677,8 @@ def get_players_in_current_match(request):
             "username": player.user.username,
             "latitude": player.location.y,
             "longitude": player.location.x,
-            "distance": round(distance(request.user.player.location, player.location).kilometers, 2)
+            "distance": round(distance(request.user.player.location, player.location).kilometers, 2),
+            "out_of_bounds": player.is_out_of_bounds,
         }
         for player in request.user.player.match.player_set.all()
     ]
@@ -496,7 +714,8 @@ def get_match(request):
             "number_of_hunters": match.numberOfHunters,
             "number_of_hiders": match.numberOfHiders,
             "number_of_joined_hunters": Player.objects.filter(match=match, role='HU').count(),
-            "number_of_joined_hiders": Player.objects.filter(match=match, role='HI').count()
+            "number_of_joined_hiders": Player.objects.filter(match=match, role='HI').count(),
+            "phase": match.phase,
     }
 
     return JsonResponse(match, safe=False)
@@ -508,14 +727,17 @@ def start_match(request):
     if request.user.player.match.player_set.count() < 2:
         return HttpResponse(f'0: Not enough players')
 
-    request.user.player.match.has_started = True
-    request.user.player.match.save()
+    if not phases.start(request.user.player.match):
+        return HttpResponse(f'0: Match has already started')
     return HttpResponse(f'1: Started match')
 
 def all_ready(request):
     if not request.user.is_authenticated:
         return HttpResponse(f'user not signed in')
 
+    if request.user.player.match is None:
+        return HttpResponse(f'0: Player not in match')
+
     if request.user.player.match.player_set.count() < 2:
         return HttpResponse(f'0: Not enough players')
 
@@ -525,22 +747,39 @@ def all_ready(request):
         return HttpResponse(f'1: All players are ready! {request.user.player.match.player_set.count()}')
 
 def end_match(request):
+    # an ended match stays around until the background task has deleted it,
+    # so the host may have more than one; end the latest
+    match = Match.objects.filter(host=request.user.username).order_by('-pk').first()
+    if match is None:
+        return HttpResponse('0: No match found for the host')
+
+    # the match is archived as it enters the ended phase, so detach the
+    # players only afterwards; match_ended then answers "1" for all of them
+    # right away and only the delete itself is left to the background
+    phases.end_now(match.id)
+    player_ids = list(match.player_set.values_list('pk', flat=True))
+    Player.objects.filter(pk__in=player_ids).update(
+        role=None, match=None, ready=False, is_caught=False, is_invisible=False,
+        is_loaded=False, is_out_of_bounds=False)
+    for player_id in player_ids:
+        shared_state.state.remove(player_id)
+    tasks.background.defer(tasks.delete_match, match.pk)
+    return HttpResponse('1: Match ended successfully')
+
+# streams the replay of an ended match the player took part in as NDJSON
+def export_match(request, match_id):
+    if not request.user.is_authenticated:
+        return HttpResponse(f'user not signed in')
 
     try:
-        match = Match.objects.get(host=request.user.username)
-        match.delete()
-        request.user.player.role = None
-        request.user.player.match = None
-        request.user.player.ready = False
-        request.user.player.is_caught = False
-        request.user.player.is_invisible = False
-        request.user.player.is_loaded = False
+        match_archive = MatchArchive.objects.get(match_id=match_id)
+    except MatchArchive.DoesNotExist:
+        return HttpResponse(f'0: No archived match with id {match_id}')
 
+    if not any(player["id"] == request.user.pk for player in match_archive.roster):
+        return HttpResponse(f'0: You did not take part in this match')
 
-        request.user.player.save()
-        return HttpResponse('1: Match ended successfully')
-    except ObjectDoesNotExist:
-        return HttpResponse('0: No match found for the host')
+    return StreamingHttpResponse(archive.export_match(match_archive), content_type='application/x-ndjson')
 
 def match_ended(request):
     if not request.user.is_authenticated:
@@ -563,6 +802,33 @@ def match_started(request):
 
     return HttpResponse(f"0: Match hasn't started!")
 
+# the events (phase changes, hint ticks, ...) of the player's match which are
+# newer than the given sequence number, together with the current phase and
+# the phase deadlines as Unix timestamps; the client polls this at the
+# interval of the X-Poll-Interval header and can count down to the next phase
+# on its own in between
+def get_match_events(request, since):
+    if not request.user.is_authenticated:
+        return HttpResponse(f'user not signed in')
+
+    if request.user.player.match is None:
+        return HttpResponse(f"0: There is no active match!")
+
+    try:
+        since = int(since)
+    except ValueError:
+        return HttpResponse(f'0: Invalid sequence number')
+
+    phases.resume_matches()
+    match = request.user.player.match
+    deadlines = match.get_phase_deadlines() or {}
+
+    return JsonResponse({
+        "phase": match.phase,
+        "deadlines": {phase: deadline.timestamp() for phase, deadline in deadlines.items()},
+        "events": events.since(match.id, since),
+    })
+
 def join_hunter(request):
     if not request.user.is_authenticated:
         return HttpResponse(f'user not signed in')
@@ -572,16 +838,9 @@ def join_hunter(request):
     if request.user.player.role == 'HU':
         return HttpResponse(f'0: Player already hunter')
 
-    maxHunters = request.user.player.match.numberOfHunters
-    joinedHunters = Player.objects.filter(match=request.user.player.match, role='HU').count()
-
-    if joinedHunters < maxHunters:
-
-        request.user.player.role = 'HU'
-        request.user.player.save()
-        return HttpResponse(f'1: Player is now hunter')
-    else:
+    if not take_role(request.user.player, 'HU'):
         return HttpResponse(f'0: Hunter slots are full')
+    return HttpResponse(f'1: Player is now hunter')
 
 
 def join_hider(request):
@@ -594,16 +853,29 @@ def join_hider(request):
     if request.user.player.role == 'HI':
         return HttpResponse(f'0: Player already hider')
 
-    maxHiders = request.user.player.match.numberOfHiders
-    joinedHiders = Player.objects.filter(match=request.user.player.match, role='HI').count()
-
-    if joinedHiders < maxHiders:
-        request.user.player.role = 'HI'
-        request.user.player.save()
-
-        return HttpResponse(f'1: Player is now hunter')
-    else:
+    if not take_role(request.user.player, 'HI'):
         return HttpResponse(f'0: Hunter slots are full')
+    return HttpResponse(f'1: Player is now hunter')
+
+# claims a role slot in the player's match and switches the player over to it,
+# giving back the slot of the previous role. Returns False if no slot was free.
+def take_role(player, role):
+    match = player.match
+    if not match.claim_slot(role):
+        return False
+
+    # compare-and-swap on the player's current role, so two concurrent role
+    # changes of the same player cannot both keep a slot
+    switched = Player.objects.filter(pk=player.pk, match=match, role=player.role).update(role=role)
+    if not switched:
+        match.release_slot(role)
+        return False
+
+    if player.role is not None:
+        match.release_slot(player.role)
+    player.role = role
+    shared_state.state.put(player)
+    return True
 
 def get_hiders_locations(request):
     if not request.user.is_authenticated:
@@ -615,13 +887,16 @@ def get_hiders_locations(request):
     if request.user.player.role != "HU":
         return HttpResponse(f'0: Not a hunter')
 
-    players = [
-        {
-            "latitude": player.location.y,
-            "longitude": player.location.x,
-        }
-        for player in request.user.player.match.player_set.filter(role="HI", is_invisible=False)
-    ]
+    players = shared_state.locations(request.user.player.match, "HI", visible_only=True)
+    if players is None:
+        players = [
+            {
+                "latitude": player.location.y,
+                "longitude": player.location.x,
+                "out_of_bounds": player.is_out_of_bounds,
+            }
+            for player in request.user.player.match.player_set.filter(role="HI", is_invisible=False)
+        ]
     return JsonResponse(players, safe=False)
 
 def get_hunters_locations(request):
@@ -634,14 +909,39 @@ def get_hunters_locations(request):
     if request.user.player.role != "HI":
         return HttpResponse(f'0: Not a hider')
 
-    players = [
+    players = shared_state.locations(request.user.player.match, "HU")
+    if players is None:
+        players = [
+            {
+                "latitude": player.location.y,
+                "longitude": player.location.x,
+                "out_of_bounds": player.is_out_of_bounds,
+            }
+            for player in request.user.player.match.player_set.filter(role="HU")
+        ]
+    return JsonResponse(players, safe=False)
+
+# the latest (fuzzed) clues of all uncaught hiders in the hunter's match
+def get_hints(request):
+    if not request.user.is_authenticated:
+        return HttpResponse(f'0: User not signed in')
+
+    if request.user.player.match is None:
+        return HttpResponse(f'0: Player not in match')
+
+    if request.user.player.role != "HU":
+        return HttpResponse(f'0: Not a hunter')
+
+    clues = Clue.objects.filter(match=request.user.player.match_id, player__is_caught=False)
+    hints = [
         {
-            "latitude": player.location.y,
-            "longitude": player.location.x,
+            "latitude": location.y,
+            "longitude": location.x,
+            "created_at": created_at.isoformat(),
         }
-        for player in request.user.player.match.player_set.filter(role="HU")
+        for location, created_at in clues.values_list('location', 'created_at')
     ]
-    return JsonResponse(players, safe=False)
+    return JsonResponse(hints, safe=False)
 
 def check_if_caught(request):
     if not request.user.is_authenticated:
@@ -668,7 +968,10 @@ def catch_hider(request, caught_player_username):
     try:
         caught_player = Player.objects.get(user__username=caught_player_username)
         caught_player.is_caught = True
-        caught_player.save()
+        writes.run(Player.objects.filter(pk=caught_player.pk).update, is_caught=True)
+        shared_state.state.put(caught_player)
+        events.publish(request.user.player.match_id, 'catch', hunter=request.user.username,
+                       hider=caught_player_username)
         return HttpResponse('1: Player caught successfully')
     except Player.DoesNotExist:
         return HttpResponse('0: Player not found')
@@ -724,6 +1027,38 @@ def get_server_time(request):
     server_time = timezone.localtime(timezone.now()).isoformat()
     return JsonResponse({'server_time': server_time})
 
+# NTP style clock synchronisation. The client sends its own clock reading as
+# ?originate=..., notes when the answer arrives, and from the server's
+# receive and transmit timestamps estimates its offset to the server clock
+# and the round trip time; a few exchanges are enough. All timestamps are
+# microseconds of the server's monotonic clock, which is shared by all worker
+# processes of a host, and so are the deadlines of the player's match.
+def clock_sync(request):
+    receive = time.monotonic_ns() // 1000
+
+    originate = request.GET.get('originate') or None
+    if originate is not None:
+        try:
+            originate = int(originate)
+        except ValueError:
+            return HttpResponse(f'0: originate has to be an integer')
+    response = {
+        "originate": originate,
+        "receive": receive,
+    }
+    if request.user.is_authenticated and hasattr(request.user, 'player') \
+            and request.user.player.match is not None:
+        match = request.user.player.match
+        deadlines = match.get_phase_deadlines() or {}
+        now = timezone.now()
+        response["phase"] = match.phase
+        response["deadlines"] = {
+            phase: receive + round((deadline - now).total_seconds() * 1e6) for phase, deadline in deadlines.items()
+        }
+
+    response["transmit"] = time.monotonic_ns() // 1000
+    return JsonResponse(response)
+
 def become_invisible(request):
     if not request.user.is_authenticated:
         return HttpResponse(f'0: User not signed in')
@@ -732,7 +1067,7 @@ def become_invisible(request):
         return HttpResponse(f'0: Player not in match')
 
     request.user.player.is_invisible = True
-    request.user.player.save()
+    request.user.player.save(update_fields=['is_invisible'])
     return HttpResponse(f'1: Player is now invisible!')
 
 
@@ -744,38 +1079,106 @@ def become_visible(request):
         return HttpResponse(f'0: Player not in match')
 
     request.user.player.is_invisible = False
-    request.user.player.save()
+    request.user.player.save(update_fields=['is_invisible'])
     return HttpResponse(f'1: Player is now visible!')
 
+# Several in-game actions in one request: {"actions": [{"action": ..., ...}]}
+# with the actions update_location (latitude, longitude), become_invisible,
+# become_visible, become_ready, is_loaded and catch_hider (username). They
+# are applied in order within one transaction, on one load of the player and
+# its match, and all changes to the player are written with a single UPDATE.
+# Answers with the result of every action, worded like the single endpoints.
+def game_actions(request):
+    if not request.user.is_authenticated:
+        return HttpResponse(f'0: User not signed in')
+    if request.method != 'POST':
+        return HttpResponse(f'incorrect request method.')
+
+    actions = json.loads(request.body)['actions']
+    # also used by PollIntervalMiddleware
+    player = request.player = Player.objects.select_related('user', 'match').get(pk=request.user.pk)
+    changes = {}
+    caught = []
+    results = []
+
+    def apply():
+        for action in actions:
+            results.append(_game_action(player, action, changes, caught))
+        if changes:
+            Player.objects.filter(pk=player.pk).update(**changes)
+
+    writes.run(transaction.atomic()(apply))
+
+    # side effects once everything is committed
+    if 'location' in changes:
+        after_location_update(player)
+        suggestions.mark_dirty(player.pk)
+    elif changes:
+        shared_state.state.put(player)
+    for pk, username in caught:
+        shared_state.state.set_flag([pk], shared_state.CAUGHT, True)
+        events.publish(player.match_id, 'catch', hunter=player.user.username, hider=username)
+    return JsonResponse(results, safe=False)
+
+def _game_action(player, action, changes, caught):
+    name = action.get('action')
+    if name == 'update_location':
+        player.location = Point(float(action['longitude']), float(action['latitude']))
+        player.last_seen = timezone.now()
+        changes.update(location=player.location, last_seen=player.last_seen)
+        return "1: Successfully updated location!"
+
+    if player.match is None:
+        return '0: Player not in match'
+
+    flags = {
+        'become_invisible': ('is_invisible', True, '1: Player is now invisible!'),
+        'become_visible': ('is_invisible', False, '1: Player is now visible!'),
+        'become_ready': ('ready', True, "1: You're ready!"),
+        'is_loaded': ('is_loaded', True, '1: Player is loaded'),
+    }
+    if name in flags:
+        field, value, result = flags[name]
+        setattr(player, field, value)
+        changes[field] = value
+        return result
+
+    if name == 'catch_hider':
+        if player.role != "HU":
+            return '0: You are not Hunter!'
+        hider = Player.objects.filter(user__username=action['username']).values_list('pk', flat=True).first()
+        if hider is None:
+            return '0: Player not found'
+        Player.objects.filter(pk=hider).update(is_caught=True)
+        caught.append((hider, action['username']))
+        return '1: Player caught successfully'
+
+    return f'0: Unknown action {name}'
+
 def update_experience_with_friends(request, experience):
     if not request.user.is_authenticated:
         return HttpResponse(f'0: User not signed in')
 
-    request.user.player.update_experience_with_friends(int(experience))
-    request.user.player.save()
+    tasks.background.defer(tasks.add_experience_with_friends, request.user.pk, int(experience))
     return HttpResponse(f"1: Updated experience with friends!")
 
 def clear_player(request):
     if not request.user.is_authenticated:
         return HttpResponse(f'0: User not signed in')
 
-
-
-
-
-
+    request.user.player.release_match_slots()
     request.user.player.role = None
     request.user.player.match = None
     request.user.player.ready = False
     request.user.player.is_caught = False
     request.user.player.is_invisible = False
     request.user.player.is_loaded = False
+    request.user.player.is_out_of_bounds = False
     request.user.player.save()
 
-    match = Match.objects.filter(host=request.user.username)
-    if match.exists():
-        if match.get().player_set.count() <= 1:
-            match.get().delete()
+    match = Match.objects.filter(host=request.user.username).values_list('pk', flat=True).first()
+    if match is not None:
+        tasks.background.defer(tasks.delete_match, match, max_players=1)
 
     return HttpResponse(f'1: Player cleared')
 
@@ -787,7 +1190,7 @@ def is_loaded(request):
         return HttpResponse(f'0: Player not in match')
 
     request.user.player.is_loaded = True
-    request.user.player.save()
+    writes.run(Player.objects.filter(pk=request.user.player.pk).update, is_loaded=True)
     return HttpResponse(f'1: Player is loaded')
 
 
@@ -795,6 +1198,9 @@ def all_loaded(request):
     if not request.user.is_authenticated:
         return HttpResponse(f'user not signed in')
 
+    if request.user.player.match is None:
+        return HttpResponse(f'0: Player not in match')
+
     if request.user.player.match.player_set.count() < 2:
         return HttpResponse(f'0: Not enough players')
 
@@ -0,0 +1,102 @@
+import atexit
+import logging
+import queue
+import threading
+from concurrent.futures import Future
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+logger = logging.getLogger(__name__)
+
+# SQLite only lets one connection write at a time. Instead of letting every
+# request thread fight over the database lock (and fail with "database is
+# locked" under load), small writes from the hot endpoints are queued to a
+# single writer thread, which commits whatever has queued up in one
+# transaction. Reads do not go through the queue and, thanks to WAL mode,
+# are not blocked by the writer.
+
+
+# applies SQLITE_PRAGMAS to every new SQLite connection
+@receiver(connection_created)
+def configure_sqlite(sender, connection, **kwargs):
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        for name, value in settings.SQLITE_PRAGMAS.items():
+            cursor.execute(f'PRAGMA {name} = {value}')
+
+
+class WriteQueue:
+    def __init__(self, max_batch):
+        self.max_batch = max_batch
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    # queues fn(*args, **kwargs) and returns a Future which is resolved once
+    # the transaction containing it has been committed
+    def submit(self, fn, *args, **kwargs):
+        future = Future()
+        self._queue.put((future, fn, args, kwargs))
+        self._start()
+        return future
+
+    # runs a write through the queue and waits for its result
+    def run(self, fn, *args, **kwargs):
+        if not settings.SQLITE_SINGLE_WRITER:
+            return fn(*args, **kwargs)
+        return self.submit(fn, *args, **kwargs).result()
+
+    # waits until everything queued so far has been written
+    def drain(self):
+        if self._thread is not None:
+            self._queue.join()
+
+    def _start(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='sqlite-writer', daemon=True)
+                self._thread.start()
+
+    def _take_batch(self):
+        batch = [self._queue.get()]
+        while len(batch) < self.max_batch:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._take_batch()
+            results = []
+            try:
+                with transaction.atomic():
+                    for future, fn, args, kwargs in batch:
+                        # each write gets its own savepoint, so one failing
+                        # write does not take the others down with it
+                        try:
+                            with transaction.atomic():
+                                results.append((future, fn(*args, **kwargs), None))
+                        except Exception as e:
+                            results.append((future, None, e))
+            except Exception as e:
+                logger.exception('write batch failed')
+                results = [(future, None, e) for future, *_ in batch]
+                connection.close()
+
+            for future, result, error in results:
+                if error is None:
+                    future.set_result(result)
+                else:
+                    future.set_exception(error)
+            for _ in batch:
+                self._queue.task_done()
+
+
+writes = WriteQueue(max_batch=settings.SQLITE_WRITE_BATCH_SIZE)
+atexit.register(writes.drain)